@@ -19,6 +19,9 @@ class InstructionDebug:
     function_name: str
 
 class Opcode(Enum):
+    # Members are singletons: identity hashing keeps dispatch-table lookups in C.
+    __hash__ = object.__hash__
+
     LOAD_IMM = auto()     # LOAD_IMM reg, value
     MOV = auto()          # MOV dst, src
     LOAD_CONST = auto()   # LOAD_CONST dst, value (supports any JSON value)
@@ -110,11 +113,23 @@ class Opcode(Enum):
     # (JQ-specific opcodes moved to compiler/jq_bytecode.py)
 
 
-@dataclass
+@dataclass(slots=True, frozen=True, init=False)
 class Instruction:
     opcode: Opcode
-    args: list  # e.g., ['a', 'b'] or ['x', 5]
+    args: list | tuple  # e.g., ['a', 'b'] or ('x', 5); never mutated after emission
     debug: InstructionDebug | None = None
 
+    def __init__(self, opcode: Opcode, args: list | tuple, debug: InstructionDebug | None = None):
+        # The generated frozen __init__ goes through object.__setattr__ by name;
+        # writing the slots directly makes emission about twice as cheap.
+        _set_opcode(self, opcode)
+        _set_args(self, args)
+        _set_debug(self, debug)
+
     def __str__(self):
         return f"{self.opcode.name} {' '.join(map(str, self.args))}"
+
+
+_set_opcode = Instruction.opcode.__set__
+_set_args = Instruction.args.__set__
+_set_debug = Instruction.debug.__set__
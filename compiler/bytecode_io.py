@@ -21,5 +21,5 @@ class BytecodeReader:
                 opcode_str = parts[0]
                 args = parts[1:]
                 opcode = Opcode[opcode_str]
-                instructions.append(Instruction(opcode, args))
+                instructions.append(Instruction(opcode, tuple(args)))
         return instructions
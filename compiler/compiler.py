@@ -13,7 +13,7 @@ class ASTCompiler:
         self.instructions = []
 
     def emit(self, opcode, *args):
-        self.instructions.append(Instruction(opcode, list(args)))
+        self.instructions.append(Instruction(opcode, args))
 
     def compile(self, nodes):
         for node in nodes:
@@ -0,0 +1,5 @@
+"""Compatibility wrapper for relocated jq codegen module."""
+from haifa_jq.jq_codegen import *  # noqa: F401,F403
+from haifa_jq.jq_codegen import __all__ as _HAIFA_JQ_ALL
+
+__all__ = _HAIFA_JQ_ALL
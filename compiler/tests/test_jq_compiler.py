@@ -1,9 +1,11 @@
 import unittest
 
-from ..jq_compiler import CURRENT_REGISTER, INPUT_REGISTER, JQCompiler
+from ..jq_compiler import CURRENT_REGISTER, INPUT_REGISTER, JQCompiler, compile_cached
 from ..jq_parser import parse_jq_program
-from ..bytecode import Opcode
+from ..bytecode import Instruction, Opcode
 from ..jq_bytecode import JQOpcode
+from ..jq_vm import JQVM
+from ..jq_codegen import generate_python_source
 
 
 class TestJQCompiler(unittest.TestCase):
@@ -14,28 +16,105 @@ class TestJQCompiler(unittest.TestCase):
     def test_literal_expression_generates_load_const(self):
         instructions = self.compile('"hello"')
         self.assertEqual(instructions[0].opcode, Opcode.MOV)
-        self.assertEqual(instructions[0].args, [CURRENT_REGISTER, INPUT_REGISTER])
+        self.assertEqual(instructions[0].args, (CURRENT_REGISTER, INPUT_REGISTER))
         self.assertEqual(instructions[1].opcode, Opcode.LOAD_CONST)
         self.assertEqual(instructions[1].args[1], "hello")
         self.assertEqual(instructions[-2].opcode, JQOpcode.EMIT)
         self.assertEqual(instructions[-1].opcode, Opcode.HALT)
 
-    def test_field_lookup_generates_obj_get(self):
-        instructions = self.compile(".foo.bar")
+    def test_constant_arithmetic_is_folded(self):
+        instructions = self.compile("1 + 2 * 3 >= 7 and not false")
         opcodes = [inst.opcode for inst in instructions]
-        self.assertIn(JQOpcode.OBJ_GET, opcodes)
+        self.assertNotIn(Opcode.ADD, opcodes)
+        self.assertNotIn(Opcode.MUL, opcodes)
+        self.assertEqual(instructions[1].args[1], True)
+        # Errors stay at run time.
+        self.assertIn(Opcode.DIV, [inst.opcode for inst in self.compile("1 / 0")])
+
+    def test_constant_prefix_of_long_chain_is_folded(self):
+        instructions = self.compile(" + ".join(["1"] * 200) + " + .a")
+        adds = [inst for inst in instructions if inst.opcode == Opcode.ADD]
+        self.assertEqual(len(adds), 1)
+        self.assertIn(200, [inst.args[1] for inst in instructions if inst.opcode == Opcode.LOAD_CONST])
+
+    def test_field_lookup_generates_obj_get(self):
+        instructions = self.compile(".foo")
         obj_gets = [inst for inst in instructions if inst.opcode == JQOpcode.OBJ_GET]
-        self.assertEqual(len(obj_gets), 2)
+        self.assertEqual(len(obj_gets), 1)
         self.assertEqual(obj_gets[0].args[2], "foo")
-        self.assertEqual(obj_gets[1].args[2], "bar")
+
+    def test_field_chain_generates_single_obj_get_path(self):
+        instructions = self.compile(".foo.bar")
+        opcodes = [inst.opcode for inst in instructions]
+        self.assertNotIn(JQOpcode.OBJ_GET, opcodes)
+        paths = [inst for inst in instructions if inst.opcode == JQOpcode.OBJ_GET_PATH]
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(paths[0].args[2], ("foo", "bar"))
+
+    def test_literal_index_joins_field_path(self):
+        instructions = self.compile(".a[1].b[-1]")
+        opcodes = [inst.opcode for inst in instructions]
+        self.assertNotIn(JQOpcode.GET_INDEX, opcodes)
+        paths = [inst for inst in instructions if inst.opcode == JQOpcode.OBJ_GET_PATH]
+        self.assertEqual([inst.args[2] for inst in paths], [("a", 1, "b", -1)])
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"a": [{}, {"b": [1, 2]}]}
+        self.assertEqual(vm.run(), [2])
+
+    def test_constant_slice_bounds_are_immediates(self):
+        instructions = self.compile(".[-3:-1]")
+        self.assertEqual([inst.opcode for inst in instructions].count(Opcode.LOAD_CONST), 0)
+        slices = [inst for inst in instructions if inst.opcode == JQOpcode.SLICE]
+        self.assertEqual(slices[0].args[2:], (-3, -1))
+
+    def test_update_path_indexes_are_immediates(self):
+        instructions = self.compile(".a[0].b[-1] |= 5")
+        sets = [inst for inst in instructions if inst.opcode == JQOpcode.SET_INDEX]
+        self.assertEqual([inst.args[1] for inst in sets], [-1, 0])
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"a": [{"b": [1, 2]}]}
+        self.assertEqual(vm.run(), [{"a": [{"b": [1, 5]}]}])
+
+    def test_block_local_temps_share_registers(self):
+        instructions = self.compile(".a.b + .x * 2 - .y + .z")
+        temps = {arg for inst in instructions for arg in inst.args if isinstance(arg, str) and arg.startswith("__jq_tmp")}
+        self.assertLessEqual(len(temps), 3)
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"a": {"b": 1}, "x": 2, "y": 3, "z": 4}
+        self.assertEqual(vm.run(), [6])
+
+    def test_wide_object_literal_compiles(self):
+        # Every value stays live until OBJ_BUILD, the worst case for temp reuse.
+        count = 3000
+        instructions = self.compile("{" + ", ".join(f"k{i}: (.a{i} + 1)" for i in range(count)) + "}")
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {f"a{i}": i for i in range(count)}
+        self.assertEqual(vm.run(), [{f"k{i}": i + 1 for i in range(count)}])
 
     def test_index_all_generates_loop(self):
-        instructions = self.compile(".items[]")
+        instructions = self.compile(".items[] | . + 1")
         opcodes = [inst.opcode for inst in instructions]
-        self.assertIn(JQOpcode.GET_INDEX, opcodes)
-        self.assertIn(JQOpcode.LEN_VALUE, opcodes)
+        self.assertIn(JQOpcode.FOR_IN_BEGIN, opcodes)
+        self.assertIn(JQOpcode.FOR_IN_NEXT, opcodes)
+        self.assertNotIn(JQOpcode.GET_INDEX, opcodes)
         labels = [inst.args[0] for inst in instructions if inst.opcode == Opcode.LABEL]
         self.assertTrue(any(label.startswith("__jq_loop_") for label in labels))
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"items": [1, 2]}
+        self.assertEqual(vm.run(), [2, 3])
+        # A null element does not end the loop.
+        vm = JQVM(self.compile(".items[] | . == null"))
+        vm.registers[INPUT_REGISTER] = {"items": [1, None, 3]}
+        self.assertEqual(vm.run(), [False, True, False])
+
+    def test_terminal_index_all_emits_range(self):
+        instructions = self.compile(".items[]")
+        opcodes = [inst.opcode for inst in instructions]
+        self.assertIn(JQOpcode.EMIT_RANGE, opcodes)
+        self.assertNotIn(JQOpcode.GET_INDEX, opcodes)
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"items": [1, [2], {"a": 3}]}
+        self.assertEqual(vm.run(), [1, [2], {"a": 3}])
 
     def test_length_function(self):
         instructions = self.compile(".items | length()")
@@ -44,16 +123,262 @@ class TestJQCompiler(unittest.TestCase):
     def test_map_generates_emit_capture(self):
         instructions = self.compile(".items | map(.x)")
         opcodes = [inst.opcode for inst in instructions]
-        self.assertIn(JQOpcode.PUSH_EMIT, opcodes)
+        self.assertIn(JQOpcode.EMIT_BEGIN, opcodes)
         self.assertIn(JQOpcode.POP_EMIT, opcodes)
-        self.assertIn(JQOpcode.GET_INDEX, opcodes)
+        self.assertIn(JQOpcode.FOR_IN_NEXT, opcodes)
+
+    def test_sort_by_collects_keys_in_one_capture(self):
+        instructions = self.compile("sort_by(.k | map(. * 2))")
+        opcodes = [inst.opcode for inst in instructions]
+        self.assertNotIn(JQOpcode.PUSH_EMIT, opcodes)
+        self.assertEqual(opcodes.count(JQOpcode.EMIT_BEGIN), opcodes.count(JQOpcode.POP_EMIT))
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = [{"k": [3]}, {"k": [1, 5]}, {"k": [2]}]
+        self.assertEqual(vm.run(), [[{"k": [1, 5]}, {"k": [2]}, {"k": [3]}]])
 
     def test_select_generates_skip_labels(self):
-        instructions = self.compile(".items[] | select(.flag)")
+        instructions = self.compile(".items[] | select(.flag) | .name")
         labels = [inst.args[0] for inst in instructions if inst.opcode == Opcode.LABEL]
         self.assertTrue(any(label.startswith("__jq_select_skip") for label in labels))
+        # A single lookup needs no capture buffer; generator predicates still use one.
+        self.assertNotIn(JQOpcode.EMIT_BEGIN, [inst.opcode for inst in instructions])
+        instructions = self.compile(".items[] | select(.flags[]) | .name")
+        labels = [inst.args[0] for inst in instructions if inst.opcode == Opcode.LABEL]
         self.assertTrue(any(label.startswith("__jq_select_cont") for label in labels))
 
+    def test_select_truth_scan_is_one_any(self):
+        instructions = self.compile(".[] | select(.flags | map(.)) | .name")
+        opcodes = [inst.opcode for inst in instructions]
+        self.assertIn(JQOpcode.ANY, opcodes)
+        self.assertEqual(opcodes.count(JQOpcode.FOR_IN_NEXT), 2)
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = [{"name": "a", "flags": [0, None, 1]}, {"name": "b", "flags": [0, False]}]
+        self.assertEqual(vm.run(), ["a"])
+
+    def test_boolean_select_skips_capture_buffer(self):
+        instructions = self.compile(".items[] | select(.v > 1 and .ok) | .name")
+        opcodes = [inst.opcode for inst in instructions]
+        self.assertNotIn(JQOpcode.FLATTEN, opcodes)
+        self.assertNotIn(JQOpcode.EMIT_BEGIN, opcodes)
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {
+            "items": [{"v": 2, "ok": True, "name": "a"}, {"v": 3, "ok": False, "name": "b"}]
+        }
+        self.assertEqual(vm.run(), ["a"])
+
+    def test_terminal_iteration_fuses_field_and_select(self):
+        instructions = self.compile(".items[] | .price")
+        fused = [inst for inst in instructions if inst.opcode == JQOpcode.ITER_FIELD]
+        self.assertEqual(len(fused), 1)
+        self.assertEqual(fused[0].args[1], "price")
+        instructions = self.compile(".items[] | select(.price > 10)")
+        fused = [inst for inst in instructions if inst.opcode == JQOpcode.ITER_SELECT]
+        self.assertEqual(len(fused), 1)
+        self.assertEqual(fused[0].args[1:], ("price", ">", 10))
+        self.assertNotIn(Opcode.JZ, [inst.opcode for inst in instructions])
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"items": [{"price": 5}, {"price": 12}, {"price": 30}]}
+        self.assertEqual(vm.run(), [{"price": 12}, {"price": 30}])
+
+    def test_static_sort_key_skips_key_buffer_loop(self):
+        instructions = self.compile("sort_by(.meta.rank)")
+        sort_by = [inst for inst in instructions if inst.opcode == JQOpcode.SORT_BY]
+        self.assertEqual(len(sort_by), 1)
+        self.assertEqual(sort_by[0].args[3], ("meta", "rank"))
+        self.assertNotIn(Opcode.LABEL, [inst.opcode for inst in instructions])
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = [{"meta": {"rank": 2}}, {"meta": {"rank": 1}}]
+        self.assertEqual(vm.run(), [[{"meta": {"rank": 1}}, {"meta": {"rank": 2}}]])
+
+    def test_repeated_subtree_replays_with_fresh_registers(self):
+        instructions = self.compile("(.a.b + 1) * (.a.b + 1)")
+        adds = [inst for inst in instructions if inst.opcode == Opcode.ADD]
+        self.assertEqual(len(adds), 2)
+        self.assertNotEqual(adds[0].args[0], adds[1].args[0])
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"a": {"b": 2}}
+        self.assertEqual(vm.run(), [9])
+
+    def test_only_repeated_subtrees_are_recorded(self):
+        compiler = JQCompiler()
+        compiler.compile(parse_jq_program(" + ".join(f".a{i}" for i in range(50))))
+        self.assertEqual(compiler._templates, {})
+        compiler.compile(parse_jq_program("(.a.b | length()) + (.a.b | length())"))
+        self.assertTrue(compiler._templates)
+
+    def test_compile_to_python_matches_vm(self):
+        data = {"items": [{"v": 3, "ok": True}, {"v": 1, "ok": False}, {"v": 4, "ok": True}], "x": None}
+        for expr in [
+            ".items[] | select(.ok) | {v: .v, half: .v / 2}",
+            ".items | map(.v * 2) | length",
+            ".items[0].v as $a | .items[] | .v - $a, .x // 7",
+            "if .x then 1 else .items[1].v >= 1 end",
+            ".items[-2:] | map(.v)",
+        ]:
+            with self.subTest(expr=expr):
+                node = parse_jq_program(expr)
+                vm = JQVM(JQCompiler().compile(node))
+                vm.registers[INPUT_REGISTER] = data
+                run = JQCompiler().compile_to_python(node)
+                self.assertEqual(list(run(data)), vm.run())
+                self.assertIs(JQCompiler().compile_to_python(parse_jq_program(expr)), run)
+
+    def test_compile_to_python_rejects_unsupported_filters(self):
+        with self.assertRaises(NotImplementedError):
+            JQCompiler().compile_to_python(parse_jq_program("try .a catch 0"))
+        with self.assertRaises(NotImplementedError):
+            JQCompiler().compile_to_python(parse_jq_program(" | ".join([". + 1"] * 3000)))
+
+    def test_compile_to_python_handles_deep_nesting_and_branches(self):
+        data = 7
+        for _ in range(30):
+            data = [data]
+        run = JQCompiler().compile_to_python(parse_jq_program(" | ".join([".[]"] * 30)))
+        self.assertEqual(list(run(data)), [7])
+
+        node = parse_jq_program(" | ".join(["(.a, .b)"] * 16))
+        # Branches share their continuation, so the source grows linearly.
+        self.assertLess(len(generate_python_source(node)), 5000)
+        data = 1
+        for _ in range(16):
+            data = {"a": data, "b": data}
+        self.assertEqual(len(list(JQCompiler().compile_to_python(node)(data))), 2**16)
+
+    def test_compile_cache_reuses_bytecode(self):
+        self.assertIs(compile_cached(".a | .b"), compile_cached(".a | .b"))
+        node = parse_jq_program(".items[] | .v")
+        cached = JQCompiler.compile_node_cached(node)
+        self.assertIs(JQCompiler.compile_node_cached(node), cached)
+        self.assertEqual(list(cached), JQCompiler().compile(node))
+
+    def test_peephole_drops_fallthrough_jumps_and_copies(self):
+        instructions = self.compile("if .a then 1 end")
+        for index, inst in enumerate(instructions[:-1]):
+            if inst.opcode == Opcode.JMP:
+                self.assertNotEqual(instructions[index + 1].args, inst.args)
+        instructions = self.compile("foreach .items[] as $x (0; . + $x)")
+        # The extract-less output copy is gone: EMIT reads the state register directly,
+        # and the update ADD writes that register without a trailing MOV.
+        state_movs = [inst for inst in instructions if inst.opcode == Opcode.MOV and inst.args[0].startswith("__jq_tmp")]
+        adds = [inst for inst in instructions if inst.opcode == Opcode.ADD]
+        emits = [inst for inst in instructions if inst.opcode == JQOpcode.EMIT]
+        self.assertEqual(state_movs, [])
+        self.assertEqual(adds[0].args[0], adds[0].args[1])
+        self.assertEqual(emits[-1].args[0], adds[0].args[0])
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"items": [1, 2, 3]}
+        self.assertEqual(vm.run(), [1, 3, 6])
+
+    def test_scalar_literals_share_prologue_constants(self):
+        instructions = self.compile(".items[] | .v + 1, .w + 1")
+        loads = [inst for inst in instructions if inst.opcode == Opcode.LOAD_CONST and inst.args[1] == 1]
+        self.assertEqual(len(loads), 1)
+        self.assertIs(instructions[1], loads[0])
+        instructions = self.compile("reduce .items[] as $x (0; . + $x), reduce .items[] as $x (0; . + $x)")
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"items": [1, 2]}
+        self.assertEqual(vm.run(), [3, 3])
+
+    def test_literal_stages_read_prologue_constants(self):
+        instructions = self.compile('if .x then "yes" else "yes" end, (2 | del(.a))')
+        loads = [inst for inst in instructions if inst.opcode == Opcode.LOAD_CONST]
+        # One shared "yes"; del still gets its own writable copy of 2.
+        self.assertEqual([inst.args[1] for inst in loads], ["yes", 2])
+        self.assertIs(instructions[1], loads[0])
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"x": True}
+        self.assertEqual(vm.run(), ["yes", 2])
+
+    def test_object_literal_builds_in_one_instruction(self):
+        instructions = self.compile("{a: .x, b: 1, a: .y}")
+        opcodes = [inst.opcode for inst in instructions]
+        self.assertNotIn(JQOpcode.OBJ_SET, opcodes)
+        build = [inst for inst in instructions if inst.opcode == JQOpcode.OBJ_BUILD]
+        self.assertEqual(len(build), 1)
+        self.assertEqual(build[0].args[1], ("a", "b", "a"))
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"x": 1, "y": 2}
+        self.assertEqual(vm.run(), [{"a": 2, "b": 1}])
+
+    def test_single_value_subpipeline_skips_capture_buffer(self):
+        instructions = self.compile("(.a | .b) + 1")
+        opcodes = [inst.opcode for inst in instructions]
+        self.assertNotIn(JQOpcode.EMIT_BEGIN, opcodes)
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"a": {"b": 2}}
+        self.assertEqual(vm.run(), [3])
+
+    def test_generator_subexpression_takes_last_value(self):
+        instructions = self.compile("{last: (.items[] | .v), none: (.missing[] | .v)}")
+        self.assertEqual([inst.opcode for inst in instructions].count(JQOpcode.LAST_OR_NULL), 2)
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"items": [{"v": 1}, {"v": 2}]}
+        self.assertEqual(vm.run(), [{"last": 2, "none": None}])
+
+    def test_unused_lookups_are_dropped(self):
+        instructions = self.compile("(.a, .b) | 2")
+        self.assertNotIn(JQOpcode.OBJ_GET, [inst.opcode for inst in instructions])
+        self.assertIn(Opcode.DIV, [inst.opcode for inst in self.compile("(.a / 0) | 2")])
+
+    def test_sequence_branches_share_compiled_continuation(self):
+        instructions = self.compile("(.a, .b) | .c + 1")
+        adds = [inst for inst in instructions if inst.opcode == Opcode.ADD]
+        self.assertEqual(len(adds), 2)
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"a": {"c": 1}, "b": {"c": 5}}
+        self.assertEqual(vm.run(), [2, 6])
+
+    def test_long_shared_continuation_becomes_one_routine(self):
+        tail = ". + 1 | . * 2 | . - 3 | . * 3 | . + 10 | . * 3 | . - 1"
+        instructions = self.compile(f"(.a, .b, .c) | {tail}")
+        self.assertEqual(len([inst for inst in instructions if inst.opcode == Opcode.MUL]), 3)
+        self.assertEqual(len([inst for inst in instructions if inst.opcode == JQOpcode.CALL_TAIL]), 3)
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"a": 1, "b": 2, "c": 10}
+        self.assertEqual(vm.run(), [38, 56, 200])
+
+    def test_run_matches_stepwise_execution(self):
+        instructions = self.compile('.items[] | (try (10 / .) catch "div") | {v: .}')
+        data = {"items": [2, 0, 5]}
+        fast = JQVM(instructions)
+        fast.registers[INPUT_REGISTER] = data
+        slow = JQVM(instructions)
+        slow.registers[INPUT_REGISTER] = data
+        slow.index_labels()
+        while slow.step() != "halt":
+            pass
+        self.assertEqual(fast.run(), slow.output)
+        self.assertEqual(fast.output, [{"v": 5}, {"v": "div"}, {"v": 2}])
+
+    def test_duplicate_subexpressions_are_evaluated_once(self):
+        instructions = self.compile(".a.b * .a.b >= .a.b")
+        lookups = [inst for inst in instructions if inst.opcode == JQOpcode.OBJ_GET_PATH]
+        self.assertEqual(len(lookups), 1)
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = {"a": {"b": 3}}
+        self.assertEqual(vm.run(), [True])
+
+    def test_arithmetic_accepts_immediate_operands(self):
+        vm = JQVM(
+            [
+                Instruction(Opcode.MUL, ("x", INPUT_REGISTER, 3)),
+                Instruction(Opcode.LT, ("y", 10, "x")),
+                Instruction(JQOpcode.EMIT, ("x",)),
+                Instruction(JQOpcode.EMIT, ("y",)),
+                Instruction(Opcode.HALT, ()),
+            ]
+        )
+        vm.registers[INPUT_REGISTER] = 4
+        self.assertEqual(vm.run(), [12, True])
+
+    def test_builtins_on_literals_are_folded(self):
+        instructions = self.compile('"abc" | length(), ("abc" | last()), flatten(7)')
+        folded = {JQOpcode.LEN_VALUE, JQOpcode.LAST, JQOpcode.FLATTEN}
+        self.assertFalse([inst for inst in instructions if inst.opcode in folded])
+        vm = JQVM(instructions)
+        vm.registers[INPUT_REGISTER] = None
+        self.assertEqual(vm.run(), [3, "c", 7])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -23,6 +23,14 @@ class TestJQIndexSlice(unittest.TestCase):
         data = {"items": [1, 2, 3, 4]}
         self.assertEqual(run_filter(".items[1:3] | length()", data), [2])
 
+    def test_slice_negative_and_dynamic_bounds(self):
+        data = {"items": [1, 2, 3, 4], "n": 1}
+        self.assertEqual(run_filter(".items[-3:-1]", data), [[2, 3]])
+        self.assertEqual(run_filter(".items[.n:.missing]", data), [[2, 3, 4]])
+
+    def test_slice_string(self):
+        self.assertEqual(run_filter(".s[1:3]", {"s": "hello"}), ["el"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 
 from ..jq_ast import (
+    BinaryOp,
     Field,
     Identity,
     IfElse,
@@ -10,6 +11,8 @@ from ..jq_ast import (
     Pipe,
     Sequence,
     TryCatch,
+    UpdateAssignment,
+    VarRef,
     flatten_pipe,
 )
 from ..jq_parser import JQSyntaxError, parse_jq_program
@@ -51,6 +54,13 @@ class TestJQParser(unittest.TestCase):
         self.assertIsInstance(node, Literal)
         self.assertEqual(node.value, "hello")
 
+    def test_number_literals_keep_json_types(self):
+        self.assertIs(type(parse_jq_program("42").value), int)
+        self.assertEqual(parse_jq_program("42").value, 42)
+        self.assertIs(type(parse_jq_program("1.5e2").value), float)
+        self.assertEqual(parse_jq_program("1.5e2").value, 150.0)
+        self.assertIs(type(parse_jq_program("2E1").value), float)
+
     def test_function_call(self):
         node = parse_jq_program("length()")
         self.assertEqual(node.name, "length")
@@ -80,6 +90,16 @@ class TestJQParser(unittest.TestCase):
         node = parse_jq_program(".a // .b")
         self.assertIsNotNone(node)
 
+    def test_tokenizer_prefers_longest_operator(self):
+        node = parse_jq_program(".a //= $b")
+        self.assertIsInstance(node, UpdateAssignment)
+        self.assertIsInstance(node.expr, BinaryOp)
+        self.assertEqual(node.expr.op, "//")
+        self.assertIsInstance(node.expr.right, VarRef)
+        self.assertEqual(parse_jq_program("1\u00a0+\t2").op, "+")
+        with self.assertRaises(JQSyntaxError):
+            parse_jq_program(".a = 1")
+
     def test_index_literal(self):
         node = parse_jq_program(".items[0]")
         self.assertIsInstance(node, Index)
@@ -119,6 +139,43 @@ class TestJQParser(unittest.TestCase):
         self.assertIsInstance(node, Field)
         self.assertEqual(node.name, "name")
 
+    def test_parse_results_are_cached_by_source(self):
+        node = parse_jq_program(".items[] | .name")
+        self.assertIs(parse_jq_program(".items[] | .name"), node)
+        parse_jq_program.cache_clear()
+        self.assertIsNot(parse_jq_program(".items[] | .name"), node)
+        self.assertEqual(parse_jq_program(".items[] | .name"), node)
+
+    def test_def_inlining_substitutes_nested_params(self):
+        node = parse_jq_program("def f($x): $x + 1; def g($y): f($y) | $y; g(.a)")
+        self.assertIsInstance(node, Pipe)
+        self.assertEqual(node.left.op, "+")
+        self.assertField(node.left.left, "a")
+        self.assertField(node.right, "a")
+
+    def test_def_inlining_shares_argument_subtrees(self):
+        node = parse_jq_program("def twice($x): $x + $x; twice(.a.b)")
+        self.assertIs(node.left, node.right)
+        self.assertField(node.left.source, "a")
+
+    def test_def_inlining_handles_long_pipelines(self):
+        node = parse_jq_program("def inc: . + 1; " + " | ".join(["inc"] * 3000))
+        stages = flatten_pipe(node)
+        self.assertEqual(len(stages), 3000)
+        self.assertEqual(stages[-1].op, "+")
+
+    def test_def_inlining_expands_parameterless_body_once(self):
+        node = parse_jq_program("def g: .a + 1; g, g")
+        first, second = node.expressions
+        self.assertIs(first, second)
+        self.assertEqual(first.op, "+")
+
+    def test_def_inlining_keeps_call_free_subtrees(self):
+        node = parse_jq_program("def f: .a; (.x | .y) | f")
+        self.assertField(node.right, "a")
+        self.assertEqual(parse_jq_program("def f: .a; .x | .y"), parse_jq_program(".x | .y"))
+        self.assertEqual(parse_jq_program("def f: .a; length()"), parse_jq_program("length()"))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -59,3 +59,8 @@ def test_halt_error_raises_runtime_error():
 def test_label_break_terminates_label_block():
     result = run_filter("label $stop | (.[] | if . == 2 then break $stop else . end)", [1, 2, 3])
     assert result == [1]
+
+
+def test_break_targets_innermost_shadowing_label():
+    result = run_filter("label $a | (label $a | (.[] | if . == 2 then break $a else . end)), 9", [1, 2, 3])
+    assert result == [1, 9]
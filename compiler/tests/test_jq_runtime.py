@@ -1,4 +1,7 @@
 import unittest
+from unittest import mock
+
+from haifa_jq import jq_runtime
 
 from ..jq_runtime import (
     JQRuntimeError,
@@ -99,6 +102,25 @@ class TestJQRuntime(unittest.TestCase):
             next(stream)
         self.assertIn("input #1", str(ctx.exception))
 
+    def test_run_filter_stream_resets_state_between_inputs(self):
+        inputs = [{"a": 1, "b": 0}, {"a": 4, "b": 2}, {"a": 3, "b": 0}]
+        result = run_filter_many('try (.a / .b) catch "err"', inputs)
+        self.assertEqual(result, ["err", 2, "err"])
+
+    def test_run_filter_stream_binds_env_for_every_input(self):
+        self.assertEqual(run_filter_many(". + $step", [1, 2, 3], env={"step": 10}), [11, 12, 13])
+
+    def test_run_filter_stream_runs_generated_python_when_supported(self):
+        with mock.patch.object(jq_runtime, "_VM", side_effect=AssertionError("VM used")):
+            self.assertEqual(run_filter_many(".a + 1", [{"a": 1}, {"a": 2}]), [2, 3])
+            with self.assertRaises(JQRuntimeError) as ctx:
+                run_filter_many(".a / .b", [{"a": 1, "b": 1}, {"a": 1, "b": 0}])
+            self.assertIn("input #1", str(ctx.exception))
+            self.assertEqual(run_filter(".s[1:-1], (.v[-2:] | length())", {"s": "abcd", "v": [1, 2, 3]}), ["bc", 2])
+        # Unsupported filters stay on the VM.
+        self.assertIsNone(jq_runtime._python_program("try .a catch 0"))
+        self.assertEqual(run_filter("try .a catch 0", {"a": 1}), [1])
+
     def test_comma_union_outputs_each_branch(self):
         data = {"a": 1, "b": 2}
         self.assertEqual(run_filter(".a, .b", data), [1, 2])
@@ -115,6 +137,28 @@ class TestJQRuntime(unittest.TestCase):
         self.assertEqual(len(result), 1)
         self.assertIn("zero", result[0])
 
+    def test_try_streams_outputs_before_error(self):
+        data = {"items": [{"v": 3}, {"v": 1}, {"v": 2}]}
+        result = run_filter('(try (.items[] | .v / (.v - 2)) catch "err") | {v: .}', data)
+        self.assertEqual(result, [{"v": 3}, {"v": -1}, {"v": "err"}])
+
+    def test_try_does_not_catch_downstream_errors(self):
+        with self.assertRaises(JQRuntimeError):
+            run_filter("(try .a catch 0) | . / 0", {"a": 1})
+
+    def test_and_or_short_circuit(self):
+        data = {"f": False, "t": True, "n": 1}
+        self.assertEqual(run_filter(".f and (.n / 0)", data), [False])
+        self.assertEqual(run_filter(".t or (.n / 0)", data), [True])
+        self.assertEqual(run_filter(".t and .n", data), [True])
+        with self.assertRaises(JQRuntimeError):
+            run_filter(".t and (.n / 0)", data)
+
+    def test_long_linear_pipeline_compiles(self):
+        self.assertEqual(run_filter(" | ".join([". + 1"] * 900), 0), [900])
+        self.assertEqual(run_filter(" | ".join(["tostring() | length()"] * 450), "abc"), [1])
+        self.assertEqual(run_filter(" | ".join([". + 1"] * 3000), 0), [3000])
+
     def test_def_creates_custom_function(self):
         data = {"name": "Alice"}
         self.assertEqual(run_filter("def greet: {greeting: .name}; greet", data), [{"greeting": "Alice"}])
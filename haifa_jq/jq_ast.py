@@ -139,9 +139,18 @@ class Break(JQNode):
 
 def flatten_pipe(expr: JQNode) -> List[JQNode]:
     """Expand a pipe tree into a flat left-to-right list."""
-    if isinstance(expr, Pipe):
-        return flatten_pipe(expr.left) + flatten_pipe(expr.right)
-    return [expr]
+    # Iterative so long pipelines neither hit the recursion limit nor copy
+    # partial lists at every level.
+    stages: List[JQNode] = []
+    pending = [expr]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, Pipe):
+            pending.append(node.right)
+            pending.append(node.left)
+        else:
+            stages.append(node)
+    return stages
 
 
 __all__ = [
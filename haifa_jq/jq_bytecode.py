@@ -11,17 +11,30 @@ from compiler.bytecode import Instruction
 
 
 class JQOpcode(Enum):
+    # Identity hashing, as for Opcode: handler/opcode-set lookups stay in C.
+    __hash__ = object.__hash__
+
     # jq-only opcodes (handlers in JQVM)
     OBJ_GET = auto()
+    OBJ_GET_PATH = auto()
     GET_INDEX = auto()
     LEN_VALUE = auto()
+    LAST_OR_NULL = auto()
+    ITER_FIELD = auto()
+    ITER_SELECT = auto()
+    FOR_IN_BEGIN = auto()
+    FOR_IN_NEXT = auto()
+    SLICE = auto()
 
     PUSH_EMIT = auto()
+    EMIT_BEGIN = auto()
     POP_EMIT = auto()
     EMIT = auto()
+    EMIT_RANGE = auto()
     TRY_BEGIN = auto()
     TRY_END = auto()
     OBJ_SET = auto()
+    OBJ_BUILD = auto()
     SET_INDEX = auto()
     FLATTEN = auto()
     REDUCE = auto()
@@ -69,5 +82,7 @@ class JQOpcode(Enum):
     # Control helpers
     HALT_NOW = auto()
     HALT_ERROR = auto()
+    CALL_TAIL = auto()
+    RET_TAIL = auto()
 
 __all__ = ["JQOpcode", "Instruction"]
@@ -0,0 +1,325 @@
+"""Generate Python source for jq programs that run many times.
+
+The generated generator function mirrors what ``JQCompiler`` + ``JQVM`` would
+produce for the same AST, but executes as plain Python without opcode
+dispatch. Only a subset of jq is supported; anything else raises
+``NotImplementedError`` so callers can stay on the bytecode VM.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from haifa_jq.jq_ast import (
+    BinaryOp,
+    Field,
+    FunctionCall,
+    Identity,
+    IfElse,
+    Index,
+    IndexAll,
+    AsBinding,
+    JQNode,
+    Literal,
+    ObjectLiteral,
+    Sequence,
+    Slice,
+    UnaryOp,
+    VarRef,
+    flatten_pipe,
+)
+
+
+# ---------- runtime helpers (same semantics as the matching JQVM handlers) ----------
+def _field(value, key):
+    if isinstance(value, dict) and key in value:
+        return value[key]
+    return None
+
+
+def _index(container, index):
+    index = int(index)
+    if isinstance(container, (list, tuple)) and -len(container) <= index < len(container):
+        return container[index]
+    return None
+
+
+def _items(value):
+    if isinstance(value, (list, tuple)):
+        return value
+    try:
+        return [None] * len(value)
+    except (TypeError, ValueError):
+        return []
+
+
+def _slice(value, start, end):
+    items = value if isinstance(value, str) else _items(value)
+    if start is not None and not isinstance(start, int):
+        start = math.floor(start)
+    if end is not None and not isinstance(end, int):
+        end = math.ceil(end)
+    result = items[start:end]
+    return list(result) if isinstance(result, tuple) else result
+
+
+def _length(value):
+    try:
+        return len(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _div(left, right):
+    if isinstance(left, int) and isinstance(right, int):
+        return left // right
+    return left / right
+
+
+def _coalesce(left, right):
+    return right() if left is None else left
+
+
+def _last(values):
+    last = None
+    for last in values:
+        pass
+    return last
+
+
+def _select_truth(values):
+    for value in values:
+        for item in value if isinstance(value, list) else (value,):
+            if item:
+                return True
+    return False
+
+
+_RUNTIME = {
+    "_field": _field,
+    "_index": _index,
+    "_items": _items,
+    "_slice": _slice,
+    "_length": _length,
+    "_div": _div,
+    "_coalesce": _coalesce,
+    "_last": _last,
+    "_select_truth": _select_truth,
+    "_json": json.loads,
+}
+
+# Deeper stages move into their own generator, keeping each function well
+# below Python's limits on nested blocks and indentation.
+_MAX_NESTING = 8
+
+
+class _Continue:
+    """Pipeline stage that hands the current value to an emitted generator."""
+
+    __slots__ = ("function",)
+
+    def __init__(self, function: str) -> None:
+        self.function = function
+
+
+_INFIX = {"+": "+", "-": "-", "*": "*", "%": "%", "==": "==", ">": ">", "<": "<"}
+_NEGATED = {"!=": "==", ">=": "<", "<=": ">"}
+_BOOLEAN_OPS = {"==", "!=", ">", "<", ">=", "<=", "and", "or"}
+
+
+class _PythonCodegen:
+    def __init__(self) -> None:
+        self._functions: List[List[str]] = []
+        self._var_counter = 0
+        self._pipe_cache: Dict[int, Tuple[JQNode, List[JQNode]]] = {}
+
+    def generate(self, node: JQNode) -> str:
+        entry = self._function(self._flat(node))
+        lines = ["def run(_input, _env=None):", "    _vars = dict(_env) if _env else {}"]
+        for function in self._functions:
+            lines.extend(function)
+        lines.append(f"    return {entry}(_input)")
+        return "\n".join(lines) + "\n"
+
+    def _flat(self, node: JQNode) -> List[JQNode]:
+        # Continuations are re-walked once per Sequence/IfElse branch; flatten each subtree once.
+        cached = self._pipe_cache.get(id(node))
+        if cached is None or cached[0] is not node:
+            cached = (node, flatten_pipe(node))
+            self._pipe_cache[id(node)] = cached
+        return cached[1]
+
+    def _new_var(self) -> str:
+        name = f"_v{self._var_counter}"
+        self._var_counter += 1
+        return name
+
+    def _function(self, stages: List[JQNode]) -> str:
+        name = f"_g{len(self._functions)}"
+        arg = self._new_var()
+        lines = [f"    def {name}({arg}):"]
+        self._functions.append(lines)
+        body: List[str] = []
+        self._pipeline(stages, arg, 2, body)
+        lines.extend(body)
+        return name
+
+    def _pipeline(self, stages: List[JQNode], cur: str, depth: int, out: List[str]) -> None:
+        pad = "    " * depth
+        if not stages:
+            out.append(f"{pad}yield {cur}")
+            return
+        if depth > _MAX_NESTING:
+            out.append(f"{pad}yield from {self._function(stages)}({cur})")
+            return
+        stage, rest = stages[0], stages[1:]
+
+        if isinstance(stage, _Continue):
+            out.append(f"{pad}yield from {stage.function}({cur})")
+            return
+
+        if isinstance(stage, Identity):
+            self._pipeline(rest, cur, depth, out)
+            return
+        if isinstance(stage, (Literal, Field, ObjectLiteral, UnaryOp, BinaryOp, Index, Slice, VarRef)):
+            var = self._new_var()
+            out.append(f"{pad}{var} = {self._expr(stage, cur)}")
+            self._pipeline(rest, var, depth, out)
+            return
+        if isinstance(stage, AsBinding):
+            out.append(f"{pad}_vars[{stage.name!r}] = {self._expr(stage.source, cur)}")
+            self._pipeline(rest, cur, depth, out)
+            return
+        if isinstance(stage, Sequence):
+            tail = self._tail(rest)
+            for expr in stage.expressions:
+                self._pipeline(self._flat(expr) + tail, cur, depth, out)
+            return
+        if isinstance(stage, IfElse):
+            tail = self._tail(rest)
+            out.append(f"{pad}if {self._expr(stage.condition, cur)}:")
+            self._pipeline(self._flat(stage.then_branch) + tail, cur, depth + 1, out)
+            if stage.else_branch is not None:
+                out.append(f"{pad}else:")
+                self._pipeline(self._flat(stage.else_branch) + tail, cur, depth + 1, out)
+            return
+        if isinstance(stage, IndexAll):
+            var = self._new_var()
+            out.append(f"{pad}for {var} in _items({self._expr(stage.source, cur)}):")
+            self._pipeline(rest, var, depth + 1, out)
+            return
+        if isinstance(stage, FunctionCall):
+            self._function_call(stage, rest, cur, depth, out)
+            return
+        raise NotImplementedError(f"Python codegen does not support {type(stage).__name__}")
+
+    def _tail(self, rest: List[JQNode]) -> List[Any]:
+        # Branches share one generator for what follows them instead of each
+        # emitting its own copy, which doubled the code per chained branch.
+        return [_Continue(self._function(rest))] if rest else rest
+
+    def _function_call(self, stage: FunctionCall, rest: List[JQNode], cur: str, depth: int, out: List[str]) -> None:
+        pad = "    " * depth
+        if stage.name == "select" and len(stage.args) == 1:
+            pred = stage.args[0]
+            if isinstance(pred, BinaryOp) and pred.op in _BOOLEAN_OPS:
+                out.append(f"{pad}if {self._expr(pred, cur)}:")
+            else:
+                out.append(f"{pad}if _select_truth({self._function(self._flat(pred))}({cur})):")
+            self._pipeline(rest, cur, depth + 1, out)
+            return
+        if stage.name == "map" and len(stage.args) == 1:
+            var = self._new_var()
+            body = self._function(self._flat(stage.args[0]))
+            out.append(f"{pad}{var} = [_out for _item in _items({cur}) for _out in {body}(_item)]")
+            self._pipeline(rest, var, depth, out)
+            return
+        if stage.name == "length" and not stage.args:
+            var = self._new_var()
+            out.append(f"{pad}{var} = _length({cur})")
+            self._pipeline(rest, var, depth, out)
+            return
+        raise NotImplementedError(f"Python codegen does not support {stage.name}/{len(stage.args)}")
+
+    def _expr(self, node: JQNode, base: str) -> str:
+        if isinstance(node, Identity):
+            return base
+        if isinstance(node, Literal):
+            return _literal_source(node.value)
+        if isinstance(node, VarRef):
+            return f"_vars.get({node.name!r}, 0)"
+        if isinstance(node, UnaryOp):
+            operand = self._expr(node.operand, base)
+            if node.op == "-":
+                return f"(-{operand})"
+            if node.op == "not":
+                return f"(not {operand})"
+            raise NotImplementedError(f"Unsupported unary operator: {node.op}")
+        if isinstance(node, BinaryOp):
+            left = self._expr(node.left, base)
+            right = self._expr(node.right, base)
+            if node.op in _INFIX:
+                return f"({left} {_INFIX[node.op]} {right})"
+            if node.op in _NEGATED:
+                return f"(not ({left} {_INFIX[_NEGATED[node.op]]} {right}))"
+            if node.op == "/":
+                return f"_div({left}, {right})"
+            if node.op in ("and", "or"):
+                # Short-circuits like the bytecode; the result is always a boolean.
+                return f"(bool({left}) {node.op} bool({right}))"
+            if node.op == "//":
+                return f"_coalesce({left}, lambda: {right})"
+            raise NotImplementedError(f"Unsupported binary operator: {node.op}")
+        if isinstance(node, Field):
+            return f"_field({self._expr(node.source, base)}, {node.name!r})"
+        if isinstance(node, ObjectLiteral):
+            items = ", ".join(f"{key!r}: {self._expr(value, base)}" for key, value in node.pairs)
+            return "{" + items + "}"
+        if isinstance(node, Index):
+            return f"_index({self._expr(node.source, base)}, {self._expr(node.index, base)})"
+        if isinstance(node, Slice):
+            start = "None" if node.start is None else self._expr(node.start, base)
+            end = "None" if node.end is None else self._expr(node.end, base)
+            return f"_slice({self._expr(node.source, base)}, {start}, {end})"
+        # Anything else keeps the bytecode rule: last output of the sub-pipeline, or null.
+        return f"_last({self._function(self._flat(node))}({base}))"
+
+
+def _literal_source(value: Any) -> str:
+    if isinstance(value, float) and not math.isfinite(value):
+        return f"float({str(value)!r})"
+    if isinstance(value, (list, dict)):
+        # A fresh copy per evaluation, like LOAD_CONST.
+        return f"_json({json.dumps(value)!r})"
+    return repr(value)
+
+
+@lru_cache(maxsize=128)
+def _load(source: str) -> Callable[..., Iterator[Any]]:
+    namespace = dict(_RUNTIME)
+    exec(compile(source, "<jq>", "exec"), namespace)
+    return namespace["run"]
+
+
+def generate_python_source(node: JQNode) -> str:
+    """Return the Python source of the ``run(input, env=None)`` generator for ``node``."""
+    return _PythonCodegen().generate(node)
+
+
+def compile_to_python(node: JQNode) -> Callable[..., Iterator[Any]]:
+    """Compile ``node`` into ``run(input, env=None)`` yielding the filter outputs.
+
+    Structurally identical programs render to the same source and share one
+    compiled function.
+    """
+    try:
+        return _load(generate_python_source(node))
+    except (SyntaxError, RecursionError) as exc:
+        # Too deep for Python to generate or compile; the bytecode VM handles it.
+        raise NotImplementedError(f"Python codegen cannot compile this filter: {exc}") from exc
+
+
+__all__ = ["compile_to_python", "generate_python_source"]
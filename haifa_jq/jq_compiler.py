@@ -1,9 +1,17 @@
 from __future__ import annotations
 
-from typing import List, Optional, Tuple
+import heapq
+import itertools
+import sys
+import weakref
+from collections import defaultdict
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 # Core 指令使用 Opcode（算术/逻辑/跳转等），jq 专属语义使用 JQOpcode。
 from haifa_jq.jq_bytecode import Instruction, JQOpcode
+from haifa_jq.jq_vm import _BINARY_OPS
 from compiler.bytecode import Opcode
 from haifa_jq.jq_ast import (
     Field,
@@ -32,6 +40,380 @@ from haifa_jq.jq_ast import (
 
 INPUT_REGISTER = "__jq_input"
 CURRENT_REGISTER = "__jq_curr"
+_VAR_PREFIX = "__jq_var_"
+
+# Shared operand constants; fresh lists come from JQOpcode.EMIT_BEGIN instead.
+_ZERO = 0
+_EMPTY = ""
+
+# Operand positions that carry literal payloads rather than register names.
+_LITERAL_OPERANDS = {
+    Opcode.LOAD_CONST: frozenset({1}),
+    JQOpcode.OBJ_GET: frozenset({2}),
+    JQOpcode.OBJ_GET_PATH: frozenset({2}),
+    JQOpcode.OBJ_SET: frozenset({1}),
+    JQOpcode.OBJ_BUILD: frozenset({1}),
+    JQOpcode.REDUCE: frozenset({2}),
+    JQOpcode.ITER_FIELD: frozenset({1}),
+    JQOpcode.ITER_SELECT: frozenset({1, 2, 3}),
+}
+_NO_LITERALS: frozenset = frozenset()
+
+# Operand-less instructions are immutable, so every emission shares one object.
+_HALT = Instruction(Opcode.HALT, ())
+_HALT_NOW = Instruction(JQOpcode.HALT_NOW, ())
+_POP_EMIT = Instruction(JQOpcode.POP_EMIT, ())
+_TRY_END = Instruction(JQOpcode.TRY_END, ())
+_RET_TAIL = Instruction(JQOpcode.RET_TAIL, ())
+
+_TEMP_PREFIX = "__jq_tmp"
+# Temp index -> interned register name, shared by every compile.
+_TEMP_NAMES: Dict[int, str] = {}
+_CONST_PREFIX = "__jq_const"
+_POOLED_CONST_TYPES = (int, float, str, bool, type(None), tuple, frozenset)
+# Only assign their first operand and never raise: dead ones can be dropped.
+_PURE_OPCODES = frozenset(
+    {
+        Opcode.LOAD_CONST,
+        Opcode.MOV,
+        Opcode.EQ,
+        Opcode.NOT,
+        Opcode.AND,
+        Opcode.OR,
+        JQOpcode.LEN_VALUE,
+        JQOpcode.LAST_OR_NULL,
+        JQOpcode.OBJ_GET,
+        JQOpcode.OBJ_GET_PATH,
+        JQOpcode.OBJ_BUILD,
+    }
+)
+# Read every operand before assigning the first, so that can be any register.
+_RETARGETABLE_OPCODES = frozenset(
+    {
+        Opcode.ADD,
+        Opcode.SUB,
+        Opcode.MUL,
+        Opcode.DIV,
+        Opcode.MOD,
+        Opcode.EQ,
+        Opcode.LT,
+        Opcode.GT,
+        Opcode.NOT,
+        JQOpcode.OBJ_GET,
+        JQOpcode.OBJ_GET_PATH,
+        JQOpcode.GET_INDEX,
+        JQOpcode.LEN_VALUE,
+    }
+)
+# Plain assignments of their first operand: a temp they define starts a fresh value.
+_REUSABLE_DEFS = _PURE_OPCODES | _RETARGETABLE_OPCODES
+# Opcodes whose first operand is read rather than (re)assigned.
+_READS_FIRST_OPERAND = frozenset(
+    {JQOpcode.EMIT, JQOpcode.EMIT_RANGE, Opcode.JZ, Opcode.JNZ, JQOpcode.HALT_ERROR, JQOpcode.ITER_FIELD, JQOpcode.ITER_SELECT}
+)
+
+
+def _register_operands(inst: Instruction):
+    literal_positions = _LITERAL_OPERANDS.get(inst.opcode, _NO_LITERALS)
+    for pos, arg in enumerate(inst.args):
+        if type(arg) is str and pos not in literal_positions:
+            yield pos, arg
+
+
+def _writes_register(inst: Instruction, reg: str) -> bool:
+    args = inst.args
+    if args and args[0] == reg and inst.opcode not in _READS_FIRST_OPERAND:
+        return True
+    # TRY_BEGIN's error register is assigned when the catch branch is taken.
+    return inst.opcode == JQOpcode.TRY_BEGIN and len(args) > 1 and args[1] == reg
+
+
+def _clobbers_outer_registers(instructions: Tuple[Instruction, ...], local: set) -> bool:
+    for inst in instructions:
+        if inst.opcode in (Opcode.LABEL, Opcode.JMP) or not inst.args:
+            continue
+        dest = inst.args[0]
+        if type(dest) is str and dest not in local and _writes_register(inst, dest):
+            return True
+    return False
+
+
+# Dataclass field names per AST node type, looked up once.
+_NODE_FIELDS: Dict[type, Tuple[str, ...]] = {}
+
+
+def _child_nodes(value: object) -> Iterator[JQNode]:
+    if isinstance(value, JQNode):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _child_nodes(item)
+
+
+def _field_key(value: object, numbering: Dict[int, Tuple[JQNode, int]]) -> object:
+    if isinstance(value, JQNode):
+        return numbering[id(value)][1]
+    if isinstance(value, (list, tuple)):
+        return tuple(_field_key(item, numbering) for item in value)
+    try:
+        hash(value)
+    except TypeError:
+        return (type(value), repr(value))
+    # Keep the type so 1, 1.0 and true never share a number.
+    return (type(value), value)
+
+
+def _number_subtrees(
+    root: JQNode,
+    numbering: Dict[int, Tuple[JQNode, int]],
+    table: Dict[object, int],
+    counts: Dict[int, int],
+) -> None:
+    """Give each subtree under ``root`` an int shared by structurally identical subtrees.
+
+    Children are numbered before their parent, so a node's key is a flat tuple
+    of its own fields and its children's numbers. ``counts`` records how often
+    each number occurs; numbering entries hold the node so its id cannot be recycled.
+    """
+    pending: List[Tuple[JQNode, bool]] = [(root, False)]
+    push = pending.append
+    while pending:
+        node, children_done = pending.pop()
+        node_type = type(node)
+        names = _NODE_FIELDS.get(node_type)
+        if names is None:
+            names = _NODE_FIELDS[node_type] = tuple(item.name for item in fields(node))
+        if not children_done:
+            entry = numbering.get(id(node))
+            if entry is not None and entry[0] is node:
+                # A subtree shared by several parents occurs once per reference.
+                counts[entry[1]] += 1
+                continue
+            push((node, True))
+            for name in names:
+                value = getattr(node, name)
+                if isinstance(value, JQNode):
+                    push((value, False))
+                elif isinstance(value, (list, tuple)):
+                    pending.extend((child, False) for child in _child_nodes(value))
+            continue
+        key: List[object] = [node_type]
+        for name in names:
+            value = getattr(node, name)
+            key.append(numbering[id(value)][1] if isinstance(value, JQNode) else _field_key(value, numbering))
+        number = table.setdefault(tuple(key), len(table))
+        numbering[id(node)] = (node, number)
+        counts[number] = counts.get(number, 0) + 1
+
+
+# Straight-line code ends here for copy propagation (a routine may write anything).
+_BLOCK_BOUNDARIES = frozenset({Opcode.LABEL, JQOpcode.CALL_TAIL})
+# Operand position of the label each instruction may transfer control to.
+_JUMP_TARGETS = {Opcode.JMP: 0, Opcode.JZ: 1, Opcode.JNZ: 1, JQOpcode.FOR_IN_NEXT: 2, JQOpcode.TRY_BEGIN: 0}
+# Shared continuations at least this long become one CALL_TAIL routine.
+_TAIL_ROUTINE_MIN_SIZE = 8
+# Control leaves the straight-line block after these (jumps, calls, returns, halts).
+_BLOCK_ENDS = frozenset(_JUMP_TARGETS) | {
+    JQOpcode.CALL_TAIL,
+    JQOpcode.RET_TAIL,
+    Opcode.HALT,
+    JQOpcode.HALT_NOW,
+    JQOpcode.HALT_ERROR,
+}
+
+
+def _is_self_contained(instructions: List[Instruction]) -> bool:
+    """True if control only leaves ``instructions`` by running off their end."""
+    labels = {inst.args[0] for inst in instructions if inst.opcode == Opcode.LABEL}
+    for inst in instructions:
+        pos = _JUMP_TARGETS.get(inst.opcode)
+        if pos is not None and inst.args[pos] not in labels:
+            return False
+    return True
+
+
+def _static_int_index(node: JQNode) -> Optional[int]:
+    """Constant int index of an ``Index`` node (``[1]``, ``[-1]``), else ``None``.
+
+    GET_INDEX truncates other numbers and rejects strings, so only exact ints join a path.
+    """
+    if type(node) is not Index:
+        return None
+    value = _fold_constant(node.index)
+    return value if type(value) is int else None
+
+
+def _is_single_lookup(node: JQNode) -> bool:
+    """True for ``$x``, literals and ``.a.b[0]``-style paths: exactly one output, no generators."""
+    if type(node) in (Literal, VarRef):
+        return True
+    while type(node) is Field or _static_int_index(node) is not None:
+        node = node.source
+    return type(node) is Identity
+
+
+_SINGLE_VALUE_STAGES = frozenset(
+    {Identity, Literal, VarRef, Field, Index, Slice, UnaryOp, BinaryOp, ObjectLiteral, AsBinding}
+)
+# Emitted without instructions (or a pooled constant): never worth a template.
+_UNCACHED_NODES = frozenset({Identity, Literal, VarRef})
+_ITER_SELECT_OPS = frozenset({"==", "!=", ">", "<", ">=", "<="})
+_BOOLEAN_BINARY_OPS = _ITER_SELECT_OPS | {"and", "or"}
+# Results safe to share between duplicate subtrees: lookups return existing values
+# and these operators scalars, so a reused register never aliases a fresh container.
+_CSE_NODES = frozenset({Field, Index})
+_CSE_OPS = _BOOLEAN_BINARY_OPS | {"not", "/", "%"}
+
+# Binary operators with a direct VM opcode; the rest are derived or short-circuit.
+_BINOP_MAP: Dict[str, Opcode] = {
+    "+": Opcode.ADD,
+    "-": Opcode.SUB,
+    "*": Opcode.MUL,
+    "/": Opcode.DIV,
+    "%": Opcode.MOD,
+    "==": Opcode.EQ,
+    ">": Opcode.GT,
+    "<": Opcode.LT,
+}
+# Derived comparisons: the negation of a direct comparison of the same operands.
+_NEGATED_BINOP_MAP: Dict[str, Opcode] = {"!=": Opcode.EQ, ">=": Opcode.LT, "<=": Opcode.GT}
+
+_NOT_CONSTANT = object()
+_FOLDABLE_SCALARS = (int, float, str, bool, type(None))
+
+
+def _fold_mul(left, right):
+    # String repetition stays a runtime operation so the bytecode does not balloon.
+    if isinstance(left, str) or isinstance(right, str):
+        raise TypeError("string repetition is not folded")
+    return _BINARY_OPS[Opcode.MUL](left, right)
+
+
+def _fold_negated(compare: Callable[[Any, Any], Any]) -> Callable[[Any, Any], bool]:
+    return lambda left, right: not compare(left, right)
+
+
+# The VM's own handlers for the operators, so folding cannot drift from run time.
+_FOLD_BINARY: Dict[str, Callable[[Any, Any], Any]] = {op: _BINARY_OPS[opcode] for op, opcode in _BINOP_MAP.items()}
+_FOLD_BINARY["*"] = _fold_mul
+_FOLD_BINARY.update({op: _fold_negated(_BINARY_OPS[opcode]) for op, opcode in _NEGATED_BINOP_MAP.items()})
+_FOLD_BINARY.update(
+    {
+        "and": lambda left, right: bool(left) and bool(right),
+        "or": lambda left, right: bool(left) or bool(right),
+        "//": lambda left, right: right if left is None else left,
+    }
+)
+
+
+def _fold_constant(node: JQNode, memo: Optional[Dict[int, Tuple[JQNode, object]]] = None) -> object:
+    """Value of a constant scalar expression, or ``_NOT_CONSTANT``.
+
+    Operations that would raise (``1 / 0``, ``"a" - 1``) are left to the VM so
+    the error still surfaces at run time. ``memo`` (keyed by ``id``, entries
+    hold the node) lets a caller folding every level of a chain visit each node once.
+    """
+    if memo is None:
+        return _fold_node(node, None)
+    cached = memo.get(id(node))
+    if cached is not None and cached[0] is node:
+        return cached[1]
+    value = _fold_node(node, memo)
+    memo[id(node)] = (node, value)
+    return value
+
+
+def _fold_node(node: JQNode, memo: Optional[Dict[int, Tuple[JQNode, object]]]) -> object:
+    if isinstance(node, Literal):
+        return node.value if isinstance(node.value, _FOLDABLE_SCALARS) else _NOT_CONSTANT
+    if isinstance(node, UnaryOp):
+        operand = _fold_constant(node.operand, memo)
+        if operand is _NOT_CONSTANT:
+            return _NOT_CONSTANT
+        if node.op == "not":
+            return not bool(operand)
+        if node.op != "-":
+            return _NOT_CONSTANT
+        try:
+            return -operand
+        except TypeError:
+            return _NOT_CONSTANT
+    if isinstance(node, BinaryOp):
+        fold = _FOLD_BINARY.get(node.op)
+        if fold is None:
+            return _NOT_CONSTANT
+        left = _fold_constant(node.left, memo)
+        if left is _NOT_CONSTANT:
+            return _NOT_CONSTANT
+        # Short-circuited logic is decided by the left side alone.
+        if node.op == "and" and not left:
+            return False
+        if node.op == "or" and left:
+            return True
+        right = _fold_constant(node.right, memo)
+        if right is _NOT_CONSTANT:
+            return _NOT_CONSTANT
+        try:
+            value = fold(left, right)
+        except (ArithmeticError, TypeError, ValueError):
+            return _NOT_CONSTANT
+        return value if isinstance(value, _FOLDABLE_SCALARS) else _NOT_CONSTANT
+    return _NOT_CONSTANT
+
+
+def _fold_length(value):
+    try:
+        return len(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _fold_flatten(value):
+    # Constants are never lists; null flattens to a fresh [] and stays a runtime op.
+    return _NOT_CONSTANT if value is None else value
+
+
+# Same results as the LEN_VALUE/FIRST/LAST/FLATTEN handlers for pooled constants.
+_FOLD_BUILTIN = {
+    "length": _fold_length,
+    "first": lambda value: (value[0] if value else None) if isinstance(value, (list, str)) else None,
+    "last": lambda value: (value[-1] if value else None) if isinstance(value, (list, str)) else None,
+    "flatten": _fold_flatten,
+}
+
+
+@dataclass(frozen=True)
+class _ResumeTry(JQNode):
+    """Pipeline marker between a try body and the stages consuming its outputs."""
+
+    catch_label: str
+    error_reg: str
+
+
+@dataclass(frozen=True, eq=False)
+class _SharedTail(JQNode):
+    """Pipeline marker for stages that several branches continue into.
+
+    The first branch compiles them; later branches replay the recorded code.
+    """
+
+    stages: Tuple[JQNode, ...]
+
+
+@dataclass(frozen=True)
+class _SubtreeTemplate:
+    """Relocatable instructions recorded for one expression subtree."""
+
+    instructions: Tuple[Instruction, ...]
+    base_reg: str
+    result_reg: str
+    # (name, label prefix or None for temps) minted while recording
+    local_names: Tuple[Tuple[str, Optional[str]], ...]
+    # Writes registers it did not mint (``as`` bindings): replaying it invalidates CSE.
+    clobbers: bool
+
+
+_NODE_CACHE: Dict[int, Tuple[Instruction, ...]] = {}
 
 
 class JQCompiler:
@@ -39,633 +421,1032 @@ class JQCompiler:
 
     def __init__(self) -> None:
         self.instructions: List[Instruction] = []
-        self._temp_counter = 0
-        self._label_counter = 0
-        self._label_stack: List[Tuple[str, str]] = []
+        self._temp_counter: Iterator[int] = itertools.count()
+        self._label_counters: Dict[str, Iterator[int]] = defaultdict(itertools.count)
+        # label name -> break targets of the enclosing `label`s, innermost last.
+        self._label_targets: Dict[str, List[str]] = defaultdict(list)
+        self._templates: Dict[int, _SubtreeTemplate] = {}
+        self._tail_templates: Dict[_SharedTail, Optional[_SubtreeTemplate]] = {}
+        # Shared continuations emitted once after HALT: tail -> (entry label, input register).
+        self._tail_routines: Dict[_SharedTail, Tuple[str, str]] = {}
+        self._tail_code: List[Instruction] = []
+        self._minted: List[Tuple[str, Optional[str]]] = []
+        self._context_sensitive: bool = False
+        # Subtree numbers from _number_subtrees: id(node) -> (node, number),
+        # key -> number, and how often each number occurs in the compiled tree.
+        self._numbering: Dict[int, Tuple[JQNode, int]] = {}
+        self._subtree_table: Dict[object, int] = {}
+        self._subtree_counts: Dict[int, int] = {}
+        self._pipe_cache: Dict[int, Tuple[JQNode, List[JQNode]]] = {}
+        # id(node) -> (node, folded value): each level of an operator chain folds once.
+        self._fold_memo: Dict[int, Tuple[JQNode, object]] = {}
+        # Common subexpressions of the expression tree being emitted:
+        # (subtree number, base register) -> result register. None between trees.
+        self._cse: Optional[Dict[Tuple[int, str], str]] = None
+        self._cse_generation: int = 0
+        # Expression node type -> emitter; other nodes go through _compile_expression.
+        self._eval_dispatch: Dict[type, Callable[[Any, str], str]] = {
+            Identity: self._eval_identity,
+            Literal: self._eval_literal,
+            VarRef: self._eval_varref,
+            UnaryOp: self._eval_unary,
+            BinaryOp: self._eval_binary,
+            Field: self._eval_field,
+            ObjectLiteral: self._eval_object,
+            Index: self._eval_index,
+            Slice: self._eval_slice,
+        }
+        # Single-output stage type -> step(stage, current_reg) returning the next
+        # current register; _compile_pipeline runs these in a loop, not recursively.
+        self._linear_stages: Dict[type, Callable[[Any, str], str]] = {
+            Identity: self._step_identity,
+            Literal: self._step_literal,
+            Field: self._step_value,
+            ObjectLiteral: self._step_value,
+            AsBinding: self._step_as_binding,
+            UnaryOp: self._step_expression,
+            BinaryOp: self._step_expression,
+            Index: self._step_expression,
+            Slice: self._step_expression,
+            VarRef: self._step_expression,
+        }
+        # Other pipeline stage types -> handler(stage, current_reg, rest); the
+        # handler compiles ``rest`` itself (once per branch/iteration).
+        self._stage_handlers: Dict[type, Callable[[Any, str, List[JQNode]], None]] = {
+            Sequence: self._stage_sequence,
+            Label: self._stage_label,
+            Break: self._stage_break,
+            UpdateAssignment: self._compile_update,
+            IfElse: self._stage_if,
+            TryCatch: self._stage_try,
+            _ResumeTry: self._stage_resume_try,
+            _SharedTail: self._stage_shared_tail,
+            Reduce: self._compile_reduce,
+            Foreach: self._compile_foreach,
+            IndexAll: self._stage_index_all,
+            FunctionCall: self._stage_function_call,
+        }
+        # Immutable constants loaded once in the program prologue: key -> register.
+        self._const_regs: Dict[Tuple[type, object], str] = {}
+        self._const_values: Dict[str, object] = {}
+
+    def compile_to_python(self, node: JQNode) -> Callable[..., Iterator[Any]]:
+        """Compile ``node`` into a cached Python generator ``run(input, env=None)``.
+
+        Supports a subset of jq (see ``jq_codegen``); raises ``NotImplementedError`` otherwise.
+        """
+        from haifa_jq.jq_codegen import compile_to_python
+
+        return compile_to_python(node)
+
+    @staticmethod
+    def compile_node_cached(node: JQNode) -> Tuple[Instruction, ...]:
+        """Compile ``node`` once while it is alive; the result is shared and read-only."""
+        key = id(node)
+        cached = _NODE_CACHE.get(key)
+        if cached is None:
+            cached = tuple(JQCompiler().compile(node))
+            _NODE_CACHE[key] = cached
+            # Drop the entry with the node so a recycled id never hits stale bytecode.
+            weakref.finalize(node, _NODE_CACHE.pop, key, None)
+        return cached
 
     def compile(self, node: JQNode) -> List[Instruction]:
-        self.instructions.clear()
-        self._temp_counter = 0
-        self._label_counter = 0
-        self._label_stack.clear()
+        # A fresh list each time: the one returned below is handed to the caller.
+        self.instructions = []
+        emit = self.instructions.append
+        self._numbering.clear()
+        self._subtree_table.clear()
+        self._subtree_counts.clear()
+        self._pipe_cache.clear()
+        self._fold_memo.clear()
+        self._temp_counter = itertools.count()
+        self._label_counters.clear()
+        self._label_targets.clear()
+        self._templates.clear()
+        self._tail_templates.clear()
+        self._tail_routines.clear()
+        self._tail_code = []
+        self._minted.clear()
+        self._context_sensitive = False
+        self._cse = None
+        self._cse_generation = 0
+        self._const_regs.clear()
+        self._const_values.clear()
 
         # Seed the current register with the input JSON.
         # Core 控制/算术逻辑继续使用 Opcode.*，jq 语义改以 JQOpcode.* 表达。
-        self.instructions.append(Instruction(Opcode.MOV, [CURRENT_REGISTER, INPUT_REGISTER]))
+        emit(Instruction(Opcode.MOV, (CURRENT_REGISTER, INPUT_REGISTER)))
 
-        stages = flatten_pipe(node)
+        _number_subtrees(node, self._numbering, self._subtree_table, self._subtree_counts)
+        stages = self._flat(node)
         self._compile_pipeline(stages, CURRENT_REGISTER)
-        self.instructions.append(Instruction(Opcode.HALT, []))
-        return list(self.instructions)
+        emit(_HALT)
+        self.instructions.extend(self._tail_code)
+        # The peephole passes may rewrite the emitted list in place; no copy needed.
+        return self._with_const_prologue(self._peephole(self.instructions))
+
+    def _load_const(self, value: object) -> str:
+        """Register holding ``value``; immutable values share one prologue-loaded register."""
+        if type(value) not in _POOLED_CONST_TYPES:
+            dest = self._new_temp()
+            self.instructions.append(Instruction(Opcode.LOAD_CONST, (dest, value)))
+            return dest
+        # repr keeps 0.0/-0.0 apart; True/1 are already apart by type.
+        key = (type(value), repr(value) if type(value) is float else value)
+        reg = self._const_regs.get(key)
+        if reg is None:
+            reg = sys.intern(_CONST_PREFIX + str(len(self._const_regs)))
+            self._const_regs[key] = reg
+            self._const_values[reg] = value
+        return reg
+
+    def _fold_builtin(self, name: str, reg: str) -> Optional[str]:
+        """Pooled register holding builtin ``name`` applied to constant ``reg``, or None."""
+        if not reg.startswith(_CONST_PREFIX):
+            return None
+        value = _FOLD_BUILTIN[name](self._const_values[reg])
+        if value is _NOT_CONSTANT or type(value) not in _POOLED_CONST_TYPES:
+            return None
+        return self._load_const(value)
+
+    def _writable(self, reg: str) -> str:
+        """``reg`` or, for a pooled constant, a fresh temp that later stages may reassign."""
+        if not reg.startswith(_CONST_PREFIX):
+            return reg
+        dest = self._new_temp()
+        self.instructions.append(Instruction(Opcode.LOAD_CONST, (dest, self._const_values[reg])))
+        return dest
+
+    def _with_const_prologue(self, instrs: List[Instruction]) -> List[Instruction]:
+        if not self._const_values:
+            return instrs
+        used = {arg for inst in instrs for _, arg in _register_operands(inst) if arg in self._const_values}
+        prologue = [Instruction(Opcode.LOAD_CONST, (reg, value)) for reg, value in self._const_values.items() if reg in used]
+        # Right after the input MOV, ahead of every label, so each use sees it loaded.
+        instrs[1:1] = prologue
+        return instrs
+
+    def _peephole(self, instrs: List[Instruction]) -> List[Instruction]:
+        """Copy-propagate single-use temps, drop dead stores and thread/drop redundant jumps."""
+        instrs = self._retarget_moves(self._propagate_copies(instrs))
+        return self._reuse_block_temps(self._thread_jumps(self._drop_dead_stores(instrs)))
+
+    def _reuse_block_temps(self, instrs: List[Instruction]) -> List[Instruction]:
+        # A temp that only occurs inside one straight-line block, first as a plain
+        # assignment, is dead after its last read there. Such temps share names
+        # (linear scan per block), so the VM's register table stays small.
+        spans: Dict[str, Optional[List[int]]] = {}
+        block_of: Dict[str, int] = {}
+        block = 0
+        for index, inst in enumerate(instrs):
+            if inst.opcode == Opcode.LABEL:
+                block += 1
+            for pos, arg in _register_operands(inst):
+                if not arg.startswith(_TEMP_PREFIX):
+                    continue
+                if arg not in spans:
+                    defines = pos == 0 and inst.opcode in _REUSABLE_DEFS and arg not in inst.args[1:]
+                    spans[arg] = [index, index] if defines else None
+                    block_of[arg] = block
+                elif block_of[arg] != block:
+                    spans[arg] = None
+                elif spans[arg] is not None:
+                    spans[arg][1] = index
+            if inst.opcode in _BLOCK_ENDS:
+                block += 1
+        rename: Dict[str, str] = {}
+        free: List[str] = []
+        # Heap of (last read, name) for the names live in the current block.
+        active: List[Tuple[int, str]] = []
+        current_block = -1
+        for start, end, temp in sorted((span[0], span[1], temp) for temp, span in spans.items() if span is not None):
+            block = block_of[temp]
+            if block != current_block:
+                # Spans are sorted by start, so an earlier block is finished: all its names are free.
+                free.extend(name for _, name in active)
+                active.clear()
+                current_block = block
+            # A name is free once its last read lies before this definition.
+            while active and active[0][0] < start:
+                free.append(heapq.heappop(active)[1])
+            name = free.pop() if free else temp
+            if name != temp:
+                rename[temp] = name
+            heapq.heappush(active, (end, name))
+        if not rename:
+            return instrs
+        for index, inst in enumerate(instrs):
+            operands = [(pos, rename[arg]) for pos, arg in _register_operands(inst) if arg in rename]
+            if operands:
+                args = list(inst.args)
+                for pos, name in operands:
+                    args[pos] = name
+                instrs[index] = Instruction(inst.opcode, tuple(args))
+        return instrs
+
+    def _retarget_moves(self, instrs: List[Instruction]) -> List[Instruction]:
+        # ``ADD t, a, b; MOV x, t`` with temp ``t`` used nowhere else (the reduce,
+        # foreach and while state updates): compute straight into ``x``.
+        counts: Dict[str, int] = defaultdict(int)
+        for inst in instrs:
+            for _, arg in _register_operands(inst):
+                counts[arg] += 1
+        removed = set()
+        for index in range(1, len(instrs)):
+            inst = instrs[index]
+            if inst.opcode != Opcode.MOV:
+                continue
+            target, temp = inst.args
+            prev = instrs[index - 1]
+            if (
+                prev.opcode not in _RETARGETABLE_OPCODES
+                or prev.args[0] != temp
+                or type(temp) is not str
+                or not temp.startswith(_TEMP_PREFIX)
+                or counts[temp] != 2
+            ):
+                continue
+            instrs[index - 1] = Instruction(prev.opcode, (target,) + tuple(prev.args[1:]))
+            removed.add(index)
+        if not removed:
+            return instrs
+        return [inst for index, inst in enumerate(instrs) if index not in removed]
+
+    def _drop_dead_stores(self, instrs: List[Instruction]) -> List[Instruction]:
+        # A side-effect free instruction whose temp destination is never read
+        # anywhere in the program can go; repeat since its operands may die too.
+        while True:
+            read = set()
+            for inst in instrs:
+                pure = inst.opcode in _PURE_OPCODES
+                for pos, arg in _register_operands(inst):
+                    if pos or not pure:
+                        read.add(arg)
+            kept = [
+                inst
+                for inst in instrs
+                if inst.opcode not in _PURE_OPCODES
+                or not inst.args[0].startswith(_TEMP_PREFIX)
+                or inst.args[0] in read
+            ]
+            if len(kept) == len(instrs):
+                return kept
+            instrs = kept
+
+    def _propagate_copies(self, instrs: List[Instruction]) -> List[Instruction]:
+        # ``MOV t, s`` where temp ``t`` is read exactly once later in the same
+        # straight-line block (no LABEL/CALL_TAIL in between, ``s`` not reassigned):
+        # read ``s`` there instead and drop the MOV.
+        uses: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for index, inst in enumerate(instrs):
+            for pos, arg in _register_operands(inst):
+                uses[arg].append((index, pos))
+        removed = set()
+        for index, inst in enumerate(instrs):
+            if inst.opcode != Opcode.MOV:
+                continue
+            temp, source = inst.args
+            if type(source) is not str or not temp.startswith(_TEMP_PREFIX):
+                continue
+            occurrences = uses[temp]
+            if len(occurrences) != 2 or occurrences[0] != (index, 0):
+                continue
+            use_index, use_pos = occurrences[1]
+            use = instrs[use_index]
+            if use_pos == 0 and use.opcode not in _READS_FIRST_OPERAND:
+                continue
+            if use_pos > 0 and use.opcode == JQOpcode.TRY_BEGIN:
+                continue
+            if any(
+                between.opcode in _BLOCK_BOUNDARIES or _writes_register(between, source)
+                for between in instrs[index + 1:use_index]
+            ):
+                continue
+            args = list(use.args)
+            args[use_pos] = source
+            instrs[use_index] = Instruction(use.opcode, tuple(args))
+            source_uses = uses[source]
+            source_uses.remove((index, 1))
+            source_uses.append((use_index, use_pos))
+            source_uses.sort()
+            occurrences.clear()
+            removed.add(index)
+        if not removed:
+            return instrs
+        return [inst for index, inst in enumerate(instrs) if index not in removed]
+
+    def _thread_jumps(self, instrs: List[Instruction]) -> List[Instruction]:
+        label_at = {inst.args[0]: index for index, inst in enumerate(instrs) if inst.opcode == Opcode.LABEL}
+
+        def final_target(label: str) -> str:
+            seen = set()
+            while label not in seen:
+                seen.add(label)
+                index = label_at.get(label)
+                if index is None:
+                    break
+                index += 1
+                while index < len(instrs) and instrs[index].opcode == Opcode.LABEL:
+                    index += 1
+                if index >= len(instrs) or instrs[index].opcode != Opcode.JMP:
+                    break
+                label = instrs[index].args[0]
+            return label
+
+        def falls_through(index: int, label: str) -> bool:
+            index += 1
+            while index < len(instrs) and instrs[index].opcode == Opcode.LABEL:
+                if instrs[index].args[0] == label:
+                    return True
+                index += 1
+            return False
+
+        result: List[Instruction] = []
+        reachable = True
+        for index, inst in enumerate(instrs):
+            opcode = inst.opcode
+            if opcode == Opcode.LABEL:
+                reachable = True
+            elif not reachable:
+                # Nothing jumps here: the previous JMP skips straight to the next LABEL.
+                continue
+            if opcode == Opcode.JMP:
+                target = final_target(inst.args[0])
+                if falls_through(index, target):
+                    continue
+                if target != inst.args[0]:
+                    inst = Instruction(opcode, (target,))
+                reachable = False
+            elif opcode in (Opcode.JZ, Opcode.JNZ):
+                target = final_target(inst.args[1])
+                if target != inst.args[1]:
+                    inst = Instruction(opcode, (inst.args[0], target))
+            elif opcode == JQOpcode.FOR_IN_NEXT:
+                target = final_target(inst.args[2])
+                if target != inst.args[2]:
+                    inst = Instruction(opcode, (inst.args[0], inst.args[1], target))
+            result.append(inst)
+        return result
 
     def _compile_pipeline(self, stages: List[JQNode], current_reg: str) -> None:
-        if not stages:
-            self.instructions.append(Instruction(JQOpcode.EMIT, [current_reg]))
+        linear = self._linear_stages
+        for index, stage in enumerate(stages):
+            step = linear.get(type(stage))
+            if step is not None:
+                current_reg = step(stage, current_reg)
+                continue
+            if type(stage) is FunctionCall:
+                builtin_step = self._builtin_for(self._BUILTIN_STEPS, stage)
+                if builtin_step is not None:
+                    current_reg = builtin_step(self, stage, current_reg)
+                    continue
+            handler = self._stage_handlers.get(type(stage))
+            if handler is None:
+                raise NotImplementedError(f"Unsupported jq construct: {type(stage).__name__}")
+            handler(stage, current_reg, stages[index + 1 :])
             return
+        self.instructions.append(Instruction(JQOpcode.EMIT, (current_reg,)))
 
-        stage, rest = stages[0], stages[1:]
-
-        if isinstance(stage, Identity):
-            self._compile_pipeline(rest, current_reg)
-            return
+    def _step_identity(self, stage: Identity, current_reg: str) -> str:
+        return current_reg
 
-        if isinstance(stage, Literal):
-            dest = self._new_temp()
-            self.instructions.append(Instruction(Opcode.LOAD_CONST, [dest, stage.value]))
-            self._compile_pipeline(rest, dest)
-            return
+    def _step_literal(self, stage: Literal, current_reg: str) -> str:
+        return self._load_const(stage.value)
 
-        if isinstance(stage, Field):
-            dest = self._eval_expression(stage, current_reg)
-            self._compile_pipeline(rest, dest)
-            return
+    def _step_value(self, stage: JQNode, current_reg: str) -> str:
+        # Field lookups and object literals always land in a fresh register.
+        return self._eval_expression(stage, current_reg)
 
-        if isinstance(stage, ObjectLiteral):
-            dest = self._eval_expression(stage, current_reg)
-            self._compile_pipeline(rest, dest)
-            return
-        if isinstance(stage, AsBinding):
-            value_reg = self._eval_expression(stage.source, current_reg)
-            var_reg = self._var_reg(stage.name)
-            self.instructions.append(Instruction(Opcode.MOV, [var_reg, value_reg]))
-            self._compile_pipeline(rest, current_reg)
-            return
-        if isinstance(stage, Sequence):
-            for expr in stage.expressions:
-                expr_stages = flatten_pipe(expr)
-                self._compile_pipeline(expr_stages + rest, current_reg)
-            return
-        if isinstance(stage, Label):
-            break_label = self._new_label("jq_label_break")
-            self._label_stack.append((stage.name, break_label))
-            body_stages = flatten_pipe(stage.body)
-            self._compile_pipeline(body_stages + rest, current_reg)
-            self._label_stack.pop()
-            self.instructions.append(Instruction(Opcode.LABEL, [break_label]))
-            return
-        if isinstance(stage, Break):
-            target = self._find_label(stage.name)
-            if target is None:
-                raise NotImplementedError(f"break to unknown label ${stage.name}")
-            if stage.value is not None:
-                value_reg = self._eval_expression(stage.value, current_reg)
-                self.instructions.append(Instruction(Opcode.MOV, [current_reg, value_reg]))
-            self.instructions.append(Instruction(Opcode.JMP, [target]))
-            return
-        if isinstance(stage, UpdateAssignment):
-            self._compile_update(stage, current_reg, rest)
-            return
-        if isinstance(stage, IfElse):
-            cond_reg = self._eval_expression(stage.condition, current_reg)
-            false_label = self._new_label("jq_if_false")
-            done_label = self._new_label("jq_if_done")
-            self.instructions.append(Instruction(Opcode.JZ, [cond_reg, false_label]))
-            then_stages = flatten_pipe(stage.then_branch)
-            self._compile_pipeline(then_stages + rest, current_reg)
-            self.instructions.append(Instruction(Opcode.JMP, [done_label]))
-            self.instructions.append(Instruction(Opcode.LABEL, [false_label]))
-            if stage.else_branch is not None:
-                else_stages = flatten_pipe(stage.else_branch)
-                self._compile_pipeline(else_stages + rest, current_reg)
-            self.instructions.append(Instruction(Opcode.LABEL, [done_label]))
-            return
-        if isinstance(stage, TryCatch):
-            buffer_reg = self._new_temp()
-            error_reg = self._new_temp()
-            catch_label = self._new_label("jq_try_catch")
-            done_label = self._new_label("jq_try_done")
-            self.instructions.append(Instruction(Opcode.LOAD_CONST, [buffer_reg, []]))
-            self.instructions.append(Instruction(JQOpcode.PUSH_EMIT, [buffer_reg]))
-            self.instructions.append(Instruction(JQOpcode.TRY_BEGIN, [catch_label, error_reg, buffer_reg]))
-            try_stages = flatten_pipe(stage.try_expr)
-            self._compile_pipeline(try_stages, current_reg)
-            self.instructions.append(Instruction(JQOpcode.TRY_END, []))
-            self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
-
-            index_reg = self._new_temp()
-            length_reg = self._new_temp()
-            cond_reg = self._new_temp()
-            item_reg = self._new_temp()
-            loop_label = self._new_label("jq_try_loop")
-            loop_end = self._new_label("jq_try_loop_end")
-            self.instructions.append(Instruction(Opcode.LOAD_CONST, [index_reg, 0]))
-            self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [length_reg, buffer_reg]))
-            self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
-            self.instructions.append(Instruction(Opcode.LT, [cond_reg, index_reg, length_reg]))
-            self.instructions.append(Instruction(Opcode.JZ, [cond_reg, loop_end]))
-            self.instructions.append(Instruction(JQOpcode.GET_INDEX, [item_reg, buffer_reg, index_reg]))
-            self._compile_pipeline(rest, item_reg)
-            self.instructions.append(Instruction(Opcode.ADD, [index_reg, index_reg, "1"]))
-            self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-            self.instructions.append(Instruction(Opcode.LABEL, [loop_end]))
-            self.instructions.append(Instruction(Opcode.JMP, [done_label]))
-            self.instructions.append(Instruction(Opcode.LABEL, [catch_label]))
-            self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
-            if stage.catch_expr is not None:
-                catch_stages = flatten_pipe(stage.catch_expr)
-                self._compile_pipeline(catch_stages + rest, error_reg)
-            self.instructions.append(Instruction(Opcode.LABEL, [done_label]))
-            return
+    def _step_expression(self, stage: JQNode, current_reg: str) -> str:
         # Generic expression stage limited to expression nodes
-        if isinstance(stage, (UnaryOp, BinaryOp, Index, Slice, VarRef)):
-            dest = self._eval_expression(stage, current_reg)
-            self._compile_pipeline(rest, dest)
-            return
-        if isinstance(stage, Reduce):
-            self._compile_reduce(stage, current_reg, rest)
+        return self._eval_expression(stage, current_reg)
+
+    def _step_as_binding(self, stage: AsBinding, current_reg: str) -> str:
+        value_reg = self._eval_expression(stage.source, current_reg)
+        var_reg = self._var_reg(stage.name)
+        self.instructions.append(Instruction(Opcode.MOV, (var_reg, value_reg)))
+        return current_reg
+
+    def _stage_sequence(self, stage: Sequence, current_reg: str, rest: List[JQNode]) -> None:
+        tail = self._shared_tail(rest) if len(stage.expressions) > 1 else rest
+        for expr in stage.expressions:
+            expr_stages = self._flat(expr)
+            self._compile_pipeline(expr_stages + tail, current_reg)
+
+    @staticmethod
+    def _shared_tail(rest: List[JQNode]) -> List[JQNode]:
+        return [_SharedTail(tuple(rest))] if rest else rest
+
+    def _stage_shared_tail(self, stage: _SharedTail, current_reg: str, rest: List[JQNode]) -> None:
+        routine = self._tail_routines.get(stage)
+        if routine is not None:
+            self._call_tail_routine(routine, current_reg)
             return
-        if isinstance(stage, Foreach):
-            self._compile_foreach(stage, current_reg, rest)
+        template = self._tail_templates.get(stage)
+        if template is not None and not current_reg.startswith((_VAR_PREFIX, _CONST_PREFIX)):
+            self._replay_template(template, current_reg)
             return
+        start = len(self.instructions)
+        minted_mark = len(self._minted)
+        outer_sensitive = self._context_sensitive
+        self._context_sensitive = False
+        self._compile_pipeline(list(stage.stages), current_reg)
+        # Variable/constant registers also appear as operands in their own right,
+        # so code compiled on them is never relocated to another base.
+        if stage not in self._tail_templates and not (
+            self._context_sensitive or current_reg.startswith((_VAR_PREFIX, _CONST_PREFIX))
+        ):
+            body = self.instructions[start:]
+            if len(body) >= _TAIL_ROUTINE_MIN_SIZE and _is_self_contained(body):
+                # Long continuations are emitted once; every branch calls into them.
+                del self.instructions[start:]
+                routine = self._tail_routines[stage] = self._new_tail_routine(body, current_reg)
+                self._call_tail_routine(routine, current_reg)
+            else:
+                self._tail_templates[stage] = _SubtreeTemplate(
+                    tuple(body),
+                    current_reg,
+                    current_reg,
+                    tuple(self._minted[minted_mark:]),
+                    False,
+                )
+        self._context_sensitive = self._context_sensitive or outer_sensitive
+
+    def _new_tail_routine(self, body: List[Instruction], base_reg: str) -> Tuple[str, str]:
+        param_reg = self._new_temp()
+        entry = self._new_label("jq_tail")
+        # Every call site uses these two names, so replaying code that contains
+        # a call must not rename them.
+        del self._minted[-2:]
+        code = self._tail_code
+        code.append(Instruction(Opcode.LABEL, (entry,)))
+        for inst in body:
+            literal_positions = _LITERAL_OPERANDS.get(inst.opcode, _NO_LITERALS)
+            args = tuple(
+                param_reg if arg == base_reg and pos not in literal_positions else arg
+                for pos, arg in enumerate(inst.args)
+            )
+            code.append(Instruction(inst.opcode, args))
+        code.append(_RET_TAIL)
+        return entry, param_reg
+
+    def _call_tail_routine(self, routine: Tuple[str, str], current_reg: str) -> None:
+        entry, param_reg = routine
+        self.instructions.extend(
+            (
+                Instruction(Opcode.MOV, (param_reg, current_reg)),
+                Instruction(JQOpcode.CALL_TAIL, (entry,)),
+            )
+        )
+
+    def _stage_label(self, stage: Label, current_reg: str, rest: List[JQNode]) -> None:
+        break_label = self._new_label("jq_label_break")
+        targets = self._label_targets[stage.name]
+        targets.append(break_label)
+        body_stages = self._flat(stage.body)
+        self._compile_pipeline(body_stages + rest, current_reg)
+        targets.pop()
+        self.instructions.append(Instruction(Opcode.LABEL, (break_label,)))
+
+    def _stage_break(self, stage: Break, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
+        target = self._find_label(stage.name)
+        if target is None:
+            raise NotImplementedError(f"break to unknown label ${stage.name}")
+        if stage.value is not None:
+            value_reg = self._eval_expression(stage.value, current_reg)
+            emit(Instruction(Opcode.MOV, (self._writable(current_reg), value_reg)))
+        emit(Instruction(Opcode.JMP, (target,)))
+
+    def _stage_if(self, stage: IfElse, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
+        cond_reg = self._eval_expression(stage.condition, current_reg)
+        false_label = self._new_label("jq_if_false")
+        done_label = self._new_label("jq_if_done")
+        emit(Instruction(Opcode.JZ, (cond_reg, false_label)))
+        tail = self._shared_tail(rest) if stage.else_branch is not None else rest
+        then_stages = self._flat(stage.then_branch)
+        self._compile_pipeline(then_stages + tail, current_reg)
+        emit(Instruction(Opcode.JMP, (done_label,)))
+        emit(Instruction(Opcode.LABEL, (false_label,)))
+        if stage.else_branch is not None:
+            else_stages = self._flat(stage.else_branch)
+            self._compile_pipeline(else_stages + tail, current_reg)
+        emit(Instruction(Opcode.LABEL, (done_label,)))
+
+    def _stage_try(self, stage: TryCatch, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
+        error_reg = self._new_temp()
+        catch_label = self._new_label("jq_try_catch")
+        done_label = self._new_label("jq_try_done")
+        emit(Instruction(JQOpcode.TRY_BEGIN, (catch_label, error_reg)))
+        # Outputs stream straight into ``rest``; the try is suspended while
+        # ``rest`` runs so its errors are not caught here.
+        try_stages = self._flat(stage.try_expr)
+        if rest:
+            try_stages = try_stages + [_ResumeTry(catch_label, error_reg)] + rest
+        self._compile_pipeline(try_stages, current_reg)
+        self.instructions.extend(
+            (
+                _TRY_END,
+                Instruction(Opcode.JMP, (done_label,)),
+                Instruction(Opcode.LABEL, (catch_label,)),
+            )
+        )
+        if stage.catch_expr is not None:
+            catch_stages = self._flat(stage.catch_expr)
+            self._compile_pipeline(catch_stages + rest, error_reg)
+        emit(Instruction(Opcode.LABEL, (done_label,)))
+
+    def _stage_resume_try(self, stage: _ResumeTry, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
+        emit(_TRY_END)
+        self._compile_pipeline(rest, current_reg)
+        emit(Instruction(JQOpcode.TRY_BEGIN, (stage.catch_label, stage.error_reg)))
 
-        if isinstance(stage, IndexAll):
-            source_reg = self._eval_expression(stage.source, current_reg)
-            index_reg = self._new_temp()
-            length_reg = self._new_temp()
-            cond_reg = self._new_temp()
-            elem_reg = self._new_temp()
-            loop_label = self._new_label("jq_loop")
-            end_label = self._new_label("jq_end")
-
-            self.instructions.append(Instruction(Opcode.LOAD_CONST, [index_reg, 0]))
-            self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [length_reg, source_reg]))
-            self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
-            self.instructions.append(Instruction(Opcode.LT, [cond_reg, index_reg, length_reg]))
-            self.instructions.append(Instruction(Opcode.JZ, [cond_reg, end_label]))
-            self.instructions.append(Instruction(JQOpcode.GET_INDEX, [elem_reg, source_reg, index_reg]))
-
-            self._compile_pipeline(rest, elem_reg)
-
-            self.instructions.append(Instruction(Opcode.ADD, [index_reg, index_reg, "1"]))
-            self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-            self.instructions.append(Instruction(Opcode.LABEL, [end_label]))
+    def _stage_index_all(self, stage: IndexAll, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
+        source_reg = self._eval_expression(stage.source, current_reg)
+        if not rest:
+            emit(Instruction(JQOpcode.EMIT_RANGE, (source_reg, None, None)))
             return
-
-        if isinstance(stage, FunctionCall):
-            if stage.name == "path" and len(stage.args) == 1:
-                values_reg = self._collect_values(stage.args[0], current_reg)
-                paths_reg = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.PATHS_MATCH, [paths_reg, current_reg, values_reg]))
-                self._emit_buffer(paths_reg, rest)
-                return
-            if stage.name == "paths" and len(stage.args) == 0:
-                paths_reg = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.PATHS_ALL, [paths_reg, current_reg]))
-                self._emit_buffer(paths_reg, rest)
-                return
-            if stage.name == "paths" and len(stage.args) == 1:
-                values_reg = self._collect_values(stage.args[0], current_reg)
-                paths_reg = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.PATHS_MATCH, [paths_reg, current_reg, values_reg]))
-                self._emit_buffer(paths_reg, rest)
-                return
-            if stage.name == "setpath" and len(stage.args) == 2:
-                paths_reg = self._collect_values(stage.args[0], current_reg)
-                value_reg = self._eval_expression(stage.args[1], current_reg)
-                self.instructions.append(Instruction(JQOpcode.SET_PATHS, [current_reg, paths_reg, value_reg]))
-                self._compile_pipeline(rest, current_reg)
-                return
-            if stage.name == "del" and len(stage.args) == 1:
-                values_reg = self._collect_values(stage.args[0], current_reg)
-                paths_reg = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.PATHS_MATCH, [paths_reg, current_reg, values_reg]))
-                self.instructions.append(Instruction(JQOpcode.DEL_PATHS, [current_reg, paths_reg]))
-                self._compile_pipeline(rest, current_reg)
-                return
-            if stage.name == "walk" and len(stage.args) == 1:
-                paths_reg = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.PATHS_ALL, [paths_reg, current_reg]))
-                index_reg = self._new_temp()
-                length_reg = self._new_temp()
-                cond_reg = self._new_temp()
-                path_reg = self._new_temp()
-                value_reg = self._new_temp()
-                result_buffer = self._new_temp()
-                zero_reg = self._new_temp()
-                new_value_reg = self._new_temp()
-                single_path_reg = self._new_temp()
-
-                loop_label = self._new_label("jq_walk_loop")
-                end_label = self._new_label("jq_walk_end")
-
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [index_reg, 0]))
-                self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [length_reg, paths_reg]))
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [zero_reg, 0]))
-                self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LT, [cond_reg, index_reg, length_reg]))
-                self.instructions.append(Instruction(Opcode.JZ, [cond_reg, end_label]))
-                self.instructions.append(Instruction(JQOpcode.GET_INDEX, [path_reg, paths_reg, index_reg]))
-                self.instructions.append(Instruction(JQOpcode.GET_PATH_VALUE, [value_reg, current_reg, path_reg]))
-
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [result_buffer, []]))
-                self.instructions.append(Instruction(JQOpcode.PUSH_EMIT, [result_buffer]))
-                expr_stages = flatten_pipe(stage.args[0])
-                self._compile_pipeline(expr_stages, value_reg)
-                self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
-                self.instructions.append(Instruction(JQOpcode.GET_INDEX, [new_value_reg, result_buffer, zero_reg]))
-
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [single_path_reg, []]))
-                self.instructions.append(Instruction(JQOpcode.PUSH_EMIT, [single_path_reg]))
-                self.instructions.append(Instruction(JQOpcode.EMIT, [path_reg]))
-                self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
-                self.instructions.append(Instruction(JQOpcode.SET_PATHS, [current_reg, single_path_reg, new_value_reg]))
-
-                self.instructions.append(Instruction(Opcode.ADD, [index_reg, index_reg, "1"]))
-                self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LABEL, [end_label]))
-                self._compile_pipeline(rest, current_reg)
-                return
-            if stage.name == "input" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.INPUT, [dest]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "inputs" and len(stage.args) == 0:
-                buffer_reg = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.INPUTS, [buffer_reg]))
-                self._emit_buffer(buffer_reg, rest)
-                return
-            if stage.name == "halt" and len(stage.args) == 0:
-                self.instructions.append(Instruction(JQOpcode.HALT_NOW, []))
-                return
-            if stage.name == "halt_error" and len(stage.args) <= 1:
-                message_reg: Optional[str] = None
-                if stage.args:
-                    message_reg = self._eval_expression(stage.args[0], current_reg)
-                self.instructions.append(Instruction(JQOpcode.HALT_ERROR, [message_reg]))
-                return
-            if stage.name == "while" and len(stage.args) == 2:
-                self._compile_while(stage.args[0], stage.args[1], current_reg, rest)
-                return
-            if stage.name == "until" and len(stage.args) == 2:
-                self._compile_until(stage.args[0], stage.args[1], current_reg, rest)
-                return
-            # Milestone 6: string/regex tools
-            if stage.name == "tostring" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.TOSTRING, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "tonumber" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.TONUMBER, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "split" and len(stage.args) == 1:
-                sep_reg = self._eval_expression(stage.args[0], current_reg)
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.SPLIT, [dest, current_reg, sep_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "gsub" and len(stage.args) == 2:
-                pat_reg = self._eval_expression(stage.args[0], current_reg)
-                repl_reg = self._eval_expression(stage.args[1], current_reg)
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.GSUB, [dest, current_reg, pat_reg, repl_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            # Milestone 4: sort & aggregation
-            if stage.name == "sort" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.SORT, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "sort_by" and len(stage.args) == 1:
-                array_reg = self._eval_expression(Identity(), current_reg)
-                keys_buf = self._new_temp()
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [keys_buf, []]))
-                # iterate items
-                index_reg = self._new_temp()
-                length_reg = self._new_temp()
-                cond_reg = self._new_temp()
-                elem_reg = self._new_temp()
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [index_reg, 0]))
-                self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [length_reg, array_reg]))
-                loop_label = self._new_label("jq_sort_by_loop")
-                end_label = self._new_label("jq_sort_by_end")
-                self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LT, [cond_reg, index_reg, length_reg]))
-                self.instructions.append(Instruction(Opcode.JZ, [cond_reg, end_label]))
-                self.instructions.append(Instruction(JQOpcode.GET_INDEX, [elem_reg, array_reg, index_reg]))
-                # compute key for element
-                key_reg = self._eval_expression(stage.args[0], elem_reg)
-                self.instructions.append(Instruction(JQOpcode.PUSH_EMIT, [keys_buf]))
-                self.instructions.append(Instruction(JQOpcode.EMIT, [key_reg]))
-                self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
-                self.instructions.append(Instruction(Opcode.ADD, [index_reg, index_reg, "1"]))
-                self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LABEL, [end_label]))
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.SORT_BY, [dest, array_reg, keys_buf]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "unique" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.UNIQUE, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "unique_by" and len(stage.args) == 1:
-                array_reg = self._eval_expression(Identity(), current_reg)
-                keys_buf = self._new_temp()
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [keys_buf, []]))
-                index_reg = self._new_temp()
-                length_reg = self._new_temp()
-                cond_reg = self._new_temp()
-                elem_reg = self._new_temp()
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [index_reg, 0]))
-                self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [length_reg, array_reg]))
-                loop_label = self._new_label("jq_unique_by_loop")
-                end_label = self._new_label("jq_unique_by_end")
-                self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LT, [cond_reg, index_reg, length_reg]))
-                self.instructions.append(Instruction(Opcode.JZ, [cond_reg, end_label]))
-                self.instructions.append(Instruction(JQOpcode.GET_INDEX, [elem_reg, array_reg, index_reg]))
-                key_reg = self._eval_expression(stage.args[0], elem_reg)
-                self.instructions.append(Instruction(JQOpcode.PUSH_EMIT, [keys_buf]))
-                self.instructions.append(Instruction(JQOpcode.EMIT, [key_reg]))
-                self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
-                self.instructions.append(Instruction(Opcode.ADD, [index_reg, index_reg, "1"]))
-                self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LABEL, [end_label]))
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.UNIQUE_BY, [dest, array_reg, keys_buf]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "min" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.MIN, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "max" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.MAX, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "min_by" and len(stage.args) == 1:
-                array_reg = self._eval_expression(Identity(), current_reg)
-                keys_buf = self._new_temp()
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [keys_buf, []]))
-                index_reg = self._new_temp()
-                length_reg = self._new_temp()
-                cond_reg = self._new_temp()
-                elem_reg = self._new_temp()
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [index_reg, 0]))
-                self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [length_reg, array_reg]))
-                loop_label = self._new_label("jq_min_by_loop")
-                end_label = self._new_label("jq_min_by_end")
-                self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LT, [cond_reg, index_reg, length_reg]))
-                self.instructions.append(Instruction(Opcode.JZ, [cond_reg, end_label]))
-                self.instructions.append(Instruction(JQOpcode.GET_INDEX, [elem_reg, array_reg, index_reg]))
-                key_reg = self._eval_expression(stage.args[0], elem_reg)
-                self.instructions.append(Instruction(JQOpcode.PUSH_EMIT, [keys_buf]))
-                self.instructions.append(Instruction(JQOpcode.EMIT, [key_reg]))
-                self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
-                self.instructions.append(Instruction(Opcode.ADD, [index_reg, index_reg, "1"]))
-                self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LABEL, [end_label]))
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.MIN_BY, [dest, array_reg, keys_buf]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "max_by" and len(stage.args) == 1:
-                array_reg = self._eval_expression(Identity(), current_reg)
-                keys_buf = self._new_temp()
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [keys_buf, []]))
-                index_reg = self._new_temp()
-                length_reg = self._new_temp()
-                cond_reg = self._new_temp()
-                elem_reg = self._new_temp()
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [index_reg, 0]))
-                self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [length_reg, array_reg]))
-                loop_label = self._new_label("jq_max_by_loop")
-                end_label = self._new_label("jq_max_by_end")
-                self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LT, [cond_reg, index_reg, length_reg]))
-                self.instructions.append(Instruction(Opcode.JZ, [cond_reg, end_label]))
-                self.instructions.append(Instruction(JQOpcode.GET_INDEX, [elem_reg, array_reg, index_reg]))
-                key_reg = self._eval_expression(stage.args[0], elem_reg)
-                self.instructions.append(Instruction(JQOpcode.PUSH_EMIT, [keys_buf]))
-                self.instructions.append(Instruction(JQOpcode.EMIT, [key_reg]))
-                self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
-                self.instructions.append(Instruction(Opcode.ADD, [index_reg, index_reg, "1"]))
-                self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LABEL, [end_label]))
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.MAX_BY, [dest, array_reg, keys_buf]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "group_by" and len(stage.args) == 1:
-                array_reg = self._eval_expression(Identity(), current_reg)
-                keys_buf = self._new_temp()
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [keys_buf, []]))
-                index_reg = self._new_temp()
-                length_reg = self._new_temp()
-                cond_reg = self._new_temp()
-                elem_reg = self._new_temp()
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [index_reg, 0]))
-                self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [length_reg, array_reg]))
-                loop_label = self._new_label("jq_group_by_loop")
-                end_label = self._new_label("jq_group_by_end")
-                self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LT, [cond_reg, index_reg, length_reg]))
-                self.instructions.append(Instruction(Opcode.JZ, [cond_reg, end_label]))
-                self.instructions.append(Instruction(JQOpcode.GET_INDEX, [elem_reg, array_reg, index_reg]))
-                key_reg = self._eval_expression(stage.args[0], elem_reg)
-                self.instructions.append(Instruction(JQOpcode.PUSH_EMIT, [keys_buf]))
-                self.instructions.append(Instruction(JQOpcode.EMIT, [key_reg]))
-                self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
-                self.instructions.append(Instruction(Opcode.ADD, [index_reg, index_reg, "1"]))
-                self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LABEL, [end_label]))
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.GROUP_BY, [dest, array_reg, keys_buf]))
-                self._compile_pipeline(rest, dest)
-                return
-            # Milestone 3 core filters
-            if stage.name == "keys" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.KEYS, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "has" and len(stage.args) == 1:
-                needle = self._eval_expression(stage.args[0], current_reg)
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.HAS, [dest, current_reg, needle]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "contains" and len(stage.args) == 1:
-                needle = self._eval_expression(stage.args[0], current_reg)
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.CONTAINS, [dest, current_reg, needle]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "add" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.AGG_ADD, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "join" and len(stage.args) in (0, 1):
-                if stage.args:
-                    sep = self._eval_expression(stage.args[0], current_reg)
-                else:
-                    sep = self._new_temp()
-                    self.instructions.append(Instruction(Opcode.LOAD_CONST, [sep, ""]))
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.JOIN, [dest, current_reg, sep]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "reverse" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.REVERSE, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "first" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.FIRST, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "last" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.LAST, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "any" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.ANY, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "all" and len(stage.args) == 0:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.ALL, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "length" and not stage.args:
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [dest, current_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "flatten":
-                if stage.args:
-                    array_reg = self._eval_expression(stage.args[0], current_reg)
-                else:
-                    array_reg = current_reg
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.FLATTEN, [dest, array_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "reduce":
-                array_expr = Identity()
-                op_literal = None
-                init_expr = None
-                arg_count = len(stage.args)
-                if arg_count == 0:
-                    pass
-                elif arg_count == 1:
-                    if isinstance(stage.args[0], Literal) and isinstance(stage.args[0].value, str):
-                        op_literal = stage.args[0]
-                    else:
-                        array_expr = stage.args[0]
-                elif arg_count == 2:
-                    array_expr = stage.args[0]
-                    op_literal = stage.args[1]
-                else:
-                    array_expr = stage.args[0]
-                    op_literal = stage.args[1]
-                    init_expr = stage.args[2]
-
-                array_reg = self._eval_expression(array_expr, current_reg)
-                op_name = "sum"
-                if op_literal is not None:
-                    if isinstance(op_literal, Literal) and isinstance(op_literal.value, str):
-                        op_name = op_literal.value.lower()
-                    else:
-                        raise NotImplementedError("reduce aggregator must be a string literal")
-                init_reg = ""
-                if init_expr is not None:
-                    init_reg = self._eval_expression(init_expr, current_reg)
-
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.REDUCE, [dest, array_reg, op_name, init_reg]))
-                self._compile_pipeline(rest, dest)
-                return
-            if stage.name == "map" and len(stage.args) == 1:
-                result_reg = self._new_temp()
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [result_reg, []]))
-                self.instructions.append(Instruction(JQOpcode.PUSH_EMIT, [result_reg]))
-
-                source_reg = self._eval_expression(Identity(), current_reg)
-                index_reg = self._new_temp()
-                length_reg = self._new_temp()
-                cond_reg = self._new_temp()
-                elem_reg = self._new_temp()
-                loop_label = self._new_label("jq_map_loop")
-                end_label = self._new_label("jq_map_end")
-
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [index_reg, 0]))
-                self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [length_reg, source_reg]))
-                self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LT, [cond_reg, index_reg, length_reg]))
-                self.instructions.append(Instruction(Opcode.JZ, [cond_reg, end_label]))
-                self.instructions.append(Instruction(JQOpcode.GET_INDEX, [elem_reg, source_reg, index_reg]))
-
-                expr_stages = flatten_pipe(stage.args[0])
-                self._compile_pipeline(expr_stages, elem_reg)
-
-                self.instructions.append(Instruction(Opcode.ADD, [index_reg, index_reg, "1"]))
-                self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LABEL, [end_label]))
-                self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
-                self._compile_pipeline(rest, result_reg)
-                return
-
-            if stage.name == "select" and len(stage.args) == 1:
-                cond_buffer = self._new_temp()
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [cond_buffer, []]))
-                self.instructions.append(Instruction(JQOpcode.PUSH_EMIT, [cond_buffer]))
-                expr_stages = flatten_pipe(stage.args[0])
-                self._compile_pipeline(expr_stages, current_reg)
-                self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
-
-                # Flatten one level so that array results (e.g., from map(.))
-                # become multiple items for truth checking.
-                flat_buffer = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.FLATTEN, [flat_buffer, cond_buffer]))
-
-                len_reg = self._new_temp()
-                index_reg = self._new_temp()
-                cond_reg = self._new_temp()
-                item_reg = self._new_temp()
-                truth_reg = self._new_temp()
-                loop_label = self._new_label("jq_select_loop")
-                skip_item_label = self._new_label("jq_select_skip_item")
-                done_label = self._new_label("jq_select_done")
-                skip_label = self._new_label("jq_select_skip")
-                cont_label = self._new_label("jq_select_cont")
-
-                self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [len_reg, flat_buffer]))
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [truth_reg, 0]))
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [index_reg, 0]))
-                self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LT, [cond_reg, index_reg, len_reg]))
-                self.instructions.append(Instruction(Opcode.JZ, [cond_reg, done_label]))
-                self.instructions.append(Instruction(JQOpcode.GET_INDEX, [item_reg, flat_buffer, index_reg]))
-                self.instructions.append(Instruction(Opcode.JZ, [item_reg, skip_item_label]))
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [truth_reg, 1]))
-                self.instructions.append(Instruction(Opcode.JMP, [done_label]))
-                self.instructions.append(Instruction(Opcode.LABEL, [skip_item_label]))
-                self.instructions.append(Instruction(Opcode.ADD, [index_reg, index_reg, "1"]))
-                self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-                self.instructions.append(Instruction(Opcode.LABEL, [done_label]))
-                self.instructions.append(Instruction(Opcode.JZ, [truth_reg, skip_label]))
-                self._compile_pipeline(rest, current_reg)
-                self.instructions.append(Instruction(Opcode.JMP, [cont_label]))
-                self.instructions.append(Instruction(Opcode.LABEL, [skip_label]))
-                self.instructions.append(Instruction(Opcode.LABEL, [cont_label]))
+        if len(rest) == 1:
+            last = rest[0]
+            if type(last) is _SharedTail and len(last.stages) == 1:
+                last = last.stages[0]
+            if self._compile_fused_iteration(source_reg, last):
                 return
+        self._emit_index_loop(source_reg, "jq", lambda elem_reg: self._compile_pipeline(rest, elem_reg))
+
+    @staticmethod
+    def _builtin_for(
+        table: Dict[Tuple[str, Optional[int]], Callable[..., Any]], stage: FunctionCall
+    ) -> Optional[Callable[..., Any]]:
+        return table.get((stage.name, len(stage.args))) or table.get((stage.name, None))
+
+    def _stage_function_call(self, stage: FunctionCall, current_reg: str, rest: List[JQNode]) -> None:
+        # Single-output builtins never get here: _compile_pipeline runs them as steps.
+        handler = self._builtin_for(self._BUILTINS, stage)
+        if handler is None:
             raise NotImplementedError(f"Unsupported jq function: {stage.name}")
-
-        raise NotImplementedError(f"Unsupported jq construct: {type(stage).__name__}")
+        handler(self, stage, current_reg, rest)
+
+    def _builtin_path(self, stage: FunctionCall, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
+        values_reg = self._collect_values(stage.args[0], current_reg)
+        paths_reg = self._new_temp()
+        emit(Instruction(JQOpcode.PATHS_MATCH, (paths_reg, current_reg, values_reg)))
+        self._emit_buffer(paths_reg, rest)
+
+    def _builtin_paths(self, stage: FunctionCall, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
+        paths_reg = self._new_temp()
+        emit(Instruction(JQOpcode.PATHS_ALL, (paths_reg, current_reg)))
+        self._emit_buffer(paths_reg, rest)
+
+    def _builtin_paths_matching(self, stage: FunctionCall, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
+        values_reg = self._collect_values(stage.args[0], current_reg)
+        paths_reg = self._new_temp()
+        emit(Instruction(JQOpcode.PATHS_MATCH, (paths_reg, current_reg, values_reg)))
+        self._emit_buffer(paths_reg, rest)
+
+    def _builtin_setpath(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        current_reg = self._writable(current_reg)
+        paths_reg = self._collect_values(stage.args[0], current_reg)
+        value_reg = self._eval_expression(stage.args[1], current_reg)
+        emit(Instruction(JQOpcode.SET_PATHS, (current_reg, paths_reg, value_reg)))
+        return current_reg
+
+    def _builtin_del(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        current_reg = self._writable(current_reg)
+        values_reg = self._collect_values(stage.args[0], current_reg)
+        paths_reg = self._new_temp()
+        emit(Instruction(JQOpcode.PATHS_MATCH, (paths_reg, current_reg, values_reg)))
+        emit(Instruction(JQOpcode.DEL_PATHS, (current_reg, paths_reg)))
+        return current_reg
+
+    def _builtin_walk(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        current_reg = self._writable(current_reg)
+        new_temp = self._new_temp
+        paths_reg = new_temp()
+        emit(Instruction(JQOpcode.PATHS_ALL, (paths_reg, current_reg)))
+        zero_reg = self._load_const(_ZERO)
+        expr_stages = self._flat(stage.args[0])
+
+        def rewrite(path_reg: str) -> None:
+            value_reg = new_temp()
+            result_buffer = new_temp()
+            new_value_reg = new_temp()
+            single_path_reg = new_temp()
+            emit(Instruction(JQOpcode.GET_PATH_VALUE, (value_reg, current_reg, path_reg)))
+
+            emit(Instruction(JQOpcode.EMIT_BEGIN, (result_buffer,)))
+            self._compile_pipeline(expr_stages, value_reg)
+            self.instructions.extend(
+                (
+                    _POP_EMIT,
+                    Instruction(JQOpcode.GET_INDEX, (new_value_reg, result_buffer, zero_reg)),
+                    Instruction(JQOpcode.EMIT_BEGIN, (single_path_reg,)),
+                    Instruction(JQOpcode.EMIT, (path_reg,)),
+                    _POP_EMIT,
+                    Instruction(JQOpcode.SET_PATHS, (current_reg, single_path_reg, new_value_reg)),
+                )
+            )
+
+        self._emit_index_loop(paths_reg, "jq_walk", rewrite)
+        return current_reg
+
+    def _builtin_input(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.INPUT, (dest,)))
+        return dest
+
+    def _builtin_inputs(self, stage: FunctionCall, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
+        buffer_reg = self._new_temp()
+        emit(Instruction(JQOpcode.INPUTS, (buffer_reg,)))
+        self._emit_buffer(buffer_reg, rest)
+
+    def _builtin_halt(self, stage: FunctionCall, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
+        emit(_HALT_NOW)
+
+    def _builtin_halt_error(self, stage: FunctionCall, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
+        message_reg: Optional[str] = None
+        if stage.args:
+            message_reg = self._eval_expression(stage.args[0], current_reg)
+        emit(Instruction(JQOpcode.HALT_ERROR, (message_reg,)))
+
+    def _builtin_while(self, stage: FunctionCall, current_reg: str, rest: List[JQNode]) -> None:
+        self._compile_while(stage.args[0], stage.args[1], current_reg, rest)
+
+    def _builtin_until(self, stage: FunctionCall, current_reg: str, rest: List[JQNode]) -> None:
+        self._compile_until(stage.args[0], stage.args[1], current_reg, rest)
+
+    # Milestone 6: string/regex tools
+    def _builtin_tostring(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.TOSTRING, (dest, current_reg)))
+        return dest
+
+    def _builtin_tonumber(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.TONUMBER, (dest, current_reg)))
+        return dest
+
+    def _builtin_split(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        sep_reg = self._eval_expression(stage.args[0], current_reg)
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.SPLIT, (dest, current_reg, sep_reg)))
+        return dest
+
+    def _builtin_gsub(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        pat_reg = self._eval_expression(stage.args[0], current_reg)
+        repl_reg = self._eval_expression(stage.args[1], current_reg)
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.GSUB, (dest, current_reg, pat_reg, repl_reg)))
+        return dest
+
+    # Milestone 4: sort & aggregation
+    def _builtin_sort(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.SORT, (dest, current_reg)))
+        return dest
+
+    def _builtin_sort_by(self, stage: FunctionCall, current_reg: str) -> str:
+        return self._compile_keyed(JQOpcode.SORT_BY, "jq_sort_by", stage.args[0], current_reg)
+
+    def _builtin_unique(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.UNIQUE, (dest, current_reg)))
+        return dest
+
+    def _builtin_unique_by(self, stage: FunctionCall, current_reg: str) -> str:
+        return self._compile_keyed(JQOpcode.UNIQUE_BY, "jq_unique_by", stage.args[0], current_reg)
+
+    def _builtin_min(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.MIN, (dest, current_reg)))
+        return dest
+
+    def _builtin_max(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.MAX, (dest, current_reg)))
+        return dest
+
+    def _builtin_min_by(self, stage: FunctionCall, current_reg: str) -> str:
+        return self._compile_keyed(JQOpcode.MIN_BY, "jq_min_by", stage.args[0], current_reg)
+
+    def _builtin_max_by(self, stage: FunctionCall, current_reg: str) -> str:
+        return self._compile_keyed(JQOpcode.MAX_BY, "jq_max_by", stage.args[0], current_reg)
+
+    def _builtin_group_by(self, stage: FunctionCall, current_reg: str) -> str:
+        return self._compile_keyed(JQOpcode.GROUP_BY, "jq_group_by", stage.args[0], current_reg)
+
+    # Milestone 3 core filters
+    def _builtin_keys(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.KEYS, (dest, current_reg)))
+        return dest
+
+    def _builtin_has(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        needle = self._eval_expression(stage.args[0], current_reg)
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.HAS, (dest, current_reg, needle)))
+        return dest
+
+    def _builtin_contains(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        needle = self._eval_expression(stage.args[0], current_reg)
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.CONTAINS, (dest, current_reg, needle)))
+        return dest
+
+    def _builtin_add(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.AGG_ADD, (dest, current_reg)))
+        return dest
+
+    def _builtin_join(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        if stage.args:
+            sep = self._eval_expression(stage.args[0], current_reg)
+        else:
+            sep = self._load_const(_EMPTY)
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.JOIN, (dest, current_reg, sep)))
+        return dest
+
+    def _builtin_reverse(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.REVERSE, (dest, current_reg)))
+        return dest
+
+    def _builtin_first(self, stage: FunctionCall, current_reg: str) -> str:
+        folded = self._fold_builtin("first", current_reg)
+        if folded is not None:
+            return folded
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.FIRST, (dest, current_reg)))
+        return dest
+
+    def _builtin_last(self, stage: FunctionCall, current_reg: str) -> str:
+        folded = self._fold_builtin("last", current_reg)
+        if folded is not None:
+            return folded
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.LAST, (dest, current_reg)))
+        return dest
+
+    def _builtin_any(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.ANY, (dest, current_reg)))
+        return dest
+
+    def _builtin_all(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.ALL, (dest, current_reg)))
+        return dest
+
+    def _builtin_length(self, stage: FunctionCall, current_reg: str) -> str:
+        folded = self._fold_builtin("length", current_reg)
+        if folded is not None:
+            return folded
+        emit = self.instructions.append
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.LEN_VALUE, (dest, current_reg)))
+        return dest
+
+    def _builtin_flatten(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        if stage.args:
+            array_reg = self._eval_expression(stage.args[0], current_reg)
+        else:
+            array_reg = current_reg
+        folded = self._fold_builtin("flatten", array_reg)
+        if folded is not None:
+            return folded
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.FLATTEN, (dest, array_reg)))
+        return dest
+
+    def _builtin_reduce(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        array_expr = Identity()
+        op_literal = None
+        init_expr = None
+        arg_count = len(stage.args)
+        if arg_count == 0:
+            pass
+        elif arg_count == 1:
+            if isinstance(stage.args[0], Literal) and isinstance(stage.args[0].value, str):
+                op_literal = stage.args[0]
+            else:
+                array_expr = stage.args[0]
+        elif arg_count == 2:
+            array_expr = stage.args[0]
+            op_literal = stage.args[1]
+        else:
+            array_expr = stage.args[0]
+            op_literal = stage.args[1]
+            init_expr = stage.args[2]
+
+        array_reg = self._eval_expression(array_expr, current_reg)
+        op_name = "sum"
+        if op_literal is not None:
+            if isinstance(op_literal, Literal) and isinstance(op_literal.value, str):
+                op_name = op_literal.value.lower()
+            else:
+                raise NotImplementedError("reduce aggregator must be a string literal")
+        init_reg = ""
+        if init_expr is not None:
+            init_reg = self._eval_expression(init_expr, current_reg)
+
+        dest = self._new_temp()
+        emit(Instruction(JQOpcode.REDUCE, (dest, array_reg, op_name, init_reg)))
+        return dest
+
+    def _builtin_map(self, stage: FunctionCall, current_reg: str) -> str:
+        emit = self.instructions.append
+        result_reg = self._new_temp()
+        emit(Instruction(JQOpcode.EMIT_BEGIN, (result_reg,)))
+
+        expr_stages = self._flat(stage.args[0])
+        self._emit_index_loop(
+            current_reg, "jq_map", lambda elem_reg: self._compile_pipeline(expr_stages, elem_reg)
+        )
+        emit(_POP_EMIT)
+        return result_reg
+
+    def _builtin_select(self, stage: FunctionCall, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
+        pred = stage.args[0]
+        if (isinstance(pred, BinaryOp) and pred.op in _BOOLEAN_BINARY_OPS) or (
+            isinstance(pred, UnaryOp) and pred.op == "not"
+        ):
+            # A single boolean result: no capture buffer or truth scan needed.
+            cond_reg = self._eval_expression(pred, current_reg)
+            skip_label = self._new_label("jq_select_skip")
+            emit(Instruction(Opcode.JZ, (cond_reg, skip_label)))
+            self._compile_pipeline(rest, current_reg)
+            emit(Instruction(Opcode.LABEL, (skip_label,)))
+            return
+        if _is_single_lookup(pred):
+            # One value: ANY gives the same truth as the flattened buffer scan below.
+            value_reg = self._eval_expression(pred, current_reg)
+            truth_reg = self._new_temp()
+            skip_label = self._new_label("jq_select_skip")
+            self.instructions.extend(
+                (
+                    Instruction(JQOpcode.ANY, (truth_reg, value_reg)),
+                    Instruction(Opcode.JZ, (truth_reg, skip_label)),
+                )
+            )
+            self._compile_pipeline(rest, current_reg)
+            emit(Instruction(Opcode.LABEL, (skip_label,)))
+            return
+        new_temp = self._new_temp
+        cond_buffer = new_temp()
+        emit(Instruction(JQOpcode.EMIT_BEGIN, (cond_buffer,)))
+        expr_stages = self._flat(stage.args[0])
+        self._compile_pipeline(expr_stages, current_reg)
+        emit(_POP_EMIT)
+
+        # Flatten one level so that array results (e.g., from map(.))
+        # become multiple items for truth checking.
+        flat_buffer = new_temp()
+        emit(Instruction(JQOpcode.FLATTEN, (flat_buffer, cond_buffer)))
+
+        # One ANY over the flattened outputs: true as soon as an item is truthy.
+        truth_reg = new_temp()
+        skip_label = self._new_label("jq_select_skip")
+        cont_label = self._new_label("jq_select_cont")
+        self.instructions.extend(
+            (
+                Instruction(JQOpcode.ANY, (truth_reg, flat_buffer)),
+                Instruction(Opcode.JZ, (truth_reg, skip_label)),
+            )
+        )
+        self._compile_pipeline(rest, current_reg)
+        self.instructions.extend(
+            (
+                Instruction(Opcode.JMP, (cont_label,)),
+                Instruction(Opcode.LABEL, (skip_label,)),
+                Instruction(Opcode.LABEL, (cont_label,)),
+            )
+        )
+
+    def _compile_fused_iteration(self, source_reg: str, stage: JQNode) -> bool:
+        """Emit ITER_FIELD/ITER_SELECT for `.[] | .key` / `.[] | select(...)` tails."""
+        emit = self.instructions.append
+        if isinstance(stage, Field) and isinstance(stage.source, Identity):
+            emit(Instruction(JQOpcode.ITER_FIELD, (source_reg, stage.name)))
+            return True
+        if not (isinstance(stage, FunctionCall) and stage.name == "select" and len(stage.args) == 1):
+            return False
+        pred = stage.args[0]
+        if isinstance(pred, Field) and isinstance(pred.source, Identity):
+            emit(Instruction(JQOpcode.ITER_SELECT, (source_reg, pred.name, None, None)))
+            return True
+        if (
+            isinstance(pred, BinaryOp)
+            and pred.op in _ITER_SELECT_OPS
+            and isinstance(pred.left, Field)
+            and isinstance(pred.left.source, Identity)
+            and isinstance(pred.right, Literal)
+        ):
+            emit(
+                Instruction(JQOpcode.ITER_SELECT, (source_reg, pred.left.name, pred.op, pred.right.value))
+            )
+            return True
+        return False
+
+    def _compile_by_key_path(self, opcode: JQOpcode, key_expr: JQNode, current_reg: str) -> Optional[str]:
+        """*_by with a static key (`.a.b`, `.[0]`, `.`): the VM derives keys itself."""
+        path: List[object] = []
+        node = key_expr
+        while not isinstance(node, Identity):
+            if isinstance(node, Field):
+                path.append(node.name)
+                node = node.source
+            elif (
+                isinstance(node, Index)
+                and isinstance(node.index, Literal)
+                and type(node.index.value) is int
+            ):
+                path.append(node.index.value)
+                node = node.source
+            else:
+                return None
+        dest = self._new_temp()
+        self.instructions.append(Instruction(opcode, (dest, current_reg, None, tuple(reversed(path)))))
+        return dest
+
+    def _compile_keyed(self, opcode: JQOpcode, prefix: str, key_expr: JQNode, current_reg: str) -> str:
+        """sort_by/unique_by/min_by/max_by/group_by: ``opcode [dest, array, keys]``."""
+        dest = self._compile_by_key_path(opcode, key_expr, current_reg)
+        if dest is not None:
+            return dest
+        keys_buf = self._emit_keys_buffer(current_reg, key_expr, prefix)
+        dest = self._new_temp()
+        self.instructions.append(Instruction(opcode, (dest, current_reg, keys_buf)))
+        return dest
+
+    def _emit_keys_buffer(self, array_reg: str, key_expr: JQNode, prefix: str) -> str:
+        """Collect ``key_expr`` evaluated on every element of ``array_reg`` into a new list."""
+        emit = self.instructions.append
+        keys_buf = self._new_temp()
+        # Nested captures inside key_expr push/pop their own buffers, so one
+        # capture around the whole loop collects exactly the keys.
+        emit(Instruction(JQOpcode.EMIT_BEGIN, (keys_buf,)))
+
+        def push_key(elem_reg: str) -> None:
+            key_reg = self._eval_expression(key_expr, elem_reg)
+            emit(Instruction(JQOpcode.EMIT, (key_reg,)))
+
+        self._emit_index_loop(array_reg, prefix, push_key)
+        emit(_POP_EMIT)
+        return keys_buf
+
+    def _emit_index_loop(self, source_reg: str, prefix: str, body: Callable[[str], None]) -> None:
+        """Emit ``body(elem_reg)`` once per element of ``source_reg`` (FOR_IN_BEGIN/FOR_IN_NEXT loop)."""
+        iter_reg = self._new_temp()
+        elem_reg = self._new_temp()
+        loop_label = self._new_label(prefix + "_loop")
+        end_label = self._new_label(prefix + "_end")
+
+        self.instructions.extend(
+            (
+                Instruction(JQOpcode.FOR_IN_BEGIN, (iter_reg, source_reg)),
+                Instruction(Opcode.LABEL, (loop_label,)),
+                Instruction(JQOpcode.FOR_IN_NEXT, (elem_reg, iter_reg, end_label)),
+            )
+        )
+        body(elem_reg)
+        self.instructions.extend((Instruction(Opcode.JMP, (loop_label,)), Instruction(Opcode.LABEL, (end_label,))))
 
     def _decompose_path(self, node: JQNode) -> tuple[JQNode, List[tuple[str, object]]]:
         steps: List[tuple[str, object]] = []
@@ -683,7 +1464,18 @@ class JQCompiler:
         steps.reverse()
         return current, steps
 
+    def _update_index(self, index: JQNode, base_reg: str) -> object:
+        """Index operand shared by a path step's GET_INDEX and SET_INDEX; constant ints are immediates."""
+        folded = _fold_constant(index)
+        if type(folded) is int:
+            return folded
+        return self._eval_expression(index, base_reg)
+
     def _compile_update(self, stage: UpdateAssignment, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
+        current_reg = self._writable(current_reg)
+        new_temp = self._new_temp
+        eval_expression = self._eval_expression
         base, steps = self._decompose_path(stage.target)
         if not isinstance(base, Identity):
             raise NotImplementedError("update assignment currently supports paths starting from .")
@@ -692,14 +1484,14 @@ class JQCompiler:
         container_reg = current_reg
         for kind, data in steps[:-1]:
             if kind == "field":
-                child_reg = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.OBJ_GET, [child_reg, container_reg, data]))
+                child_reg = new_temp()
+                emit(Instruction(JQOpcode.OBJ_GET, (child_reg, container_reg, data)))
                 parent_links.append(("field", container_reg, data))
                 container_reg = child_reg
             else:
-                index_reg = self._eval_expression(data, current_reg)
-                child_reg = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.GET_INDEX, [child_reg, container_reg, index_reg]))
+                index_reg = self._update_index(data, current_reg)
+                child_reg = new_temp()
+                emit(Instruction(JQOpcode.GET_INDEX, (child_reg, container_reg, index_reg)))
                 parent_links.append(("index", container_reg, index_reg))
                 container_reg = child_reg
 
@@ -709,127 +1501,100 @@ class JQCompiler:
         if steps:
             last_kind, last_data = steps[-1]
             if last_kind == "field":
-                old_value_reg = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.OBJ_GET, [old_value_reg, container_reg, last_data]))
+                old_value_reg = new_temp()
+                emit(Instruction(JQOpcode.OBJ_GET, (old_value_reg, container_reg, last_data)))
                 assign_kind = "field"
                 assign_target = container_reg
                 assign_key = last_data
             else:
-                index_reg = self._eval_expression(last_data, current_reg)
-                old_value_reg = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.GET_INDEX, [old_value_reg, container_reg, index_reg]))
+                index_reg = self._update_index(last_data, current_reg)
+                old_value_reg = new_temp()
+                emit(Instruction(JQOpcode.GET_INDEX, (old_value_reg, container_reg, index_reg)))
                 assign_kind = "index"
                 assign_target = container_reg
                 assign_key = index_reg
         else:
             old_value_reg = current_reg
 
-        new_value_reg = self._eval_expression(stage.expr, old_value_reg)
+        new_value_reg = eval_expression(stage.expr, old_value_reg)
 
         if assign_kind == "identity":
-            self.instructions.append(Instruction(Opcode.MOV, [current_reg, new_value_reg]))
+            emit(Instruction(Opcode.MOV, (current_reg, new_value_reg)))
             updated_reg = current_reg
         elif assign_kind == "field":
             assert assign_key is not None
-            self.instructions.append(Instruction(JQOpcode.OBJ_SET, [assign_target, assign_key, new_value_reg]))
+            emit(Instruction(JQOpcode.OBJ_SET, (assign_target, assign_key, new_value_reg)))
             updated_reg = assign_target
         else:
             assert assign_key is not None
-            self.instructions.append(Instruction(JQOpcode.SET_INDEX, [assign_target, assign_key, new_value_reg]))
+            emit(Instruction(JQOpcode.SET_INDEX, (assign_target, assign_key, new_value_reg)))
             updated_reg = assign_target
 
         child_reg = updated_reg
         for kind, parent_reg, key in reversed(parent_links):
             if kind == "field":
-                self.instructions.append(Instruction(JQOpcode.OBJ_SET, [parent_reg, key, child_reg]))
+                emit(Instruction(JQOpcode.OBJ_SET, (parent_reg, key, child_reg)))
             else:
-                self.instructions.append(Instruction(JQOpcode.SET_INDEX, [parent_reg, key, child_reg]))
+                emit(Instruction(JQOpcode.SET_INDEX, (parent_reg, key, child_reg)))
             child_reg = parent_reg
 
         self._compile_pipeline(rest, current_reg)
 
+    def _flat(self, node: JQNode) -> List[JQNode]:
+        """``flatten_pipe`` memoized per node; callers must not mutate the result."""
+        cached = self._pipe_cache.get(id(node))
+        if cached is None or cached[0] is not node:
+            cached = (node, flatten_pipe(node))
+            self._pipe_cache[id(node)] = cached
+        return cached[1]
+
     def _collect_values(self, node: JQNode, input_reg: str) -> str:
+        emit = self.instructions.append
         buffer_reg = self._new_temp()
-        self.instructions.append(Instruction(Opcode.LOAD_CONST, [buffer_reg, []]))
-        self.instructions.append(Instruction(JQOpcode.PUSH_EMIT, [buffer_reg]))
-        stages = flatten_pipe(node)
+        emit(Instruction(JQOpcode.EMIT_BEGIN, (buffer_reg,)))
+        stages = self._flat(node)
         self._compile_pipeline(stages, input_reg)
-        self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
+        emit(_POP_EMIT)
         return buffer_reg
 
     def _emit_buffer(self, buffer_reg: str, rest: List[JQNode]) -> None:
-        index_reg = self._new_temp()
-        length_reg = self._new_temp()
-        cond_reg = self._new_temp()
-        item_reg = self._new_temp()
-        loop_label = self._new_label("jq_iter_loop")
-        end_label = self._new_label("jq_iter_end")
-        self.instructions.append(Instruction(Opcode.LOAD_CONST, [index_reg, 0]))
-        self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [length_reg, buffer_reg]))
-        self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
-        self.instructions.append(Instruction(Opcode.LT, [cond_reg, index_reg, length_reg]))
-        self.instructions.append(Instruction(Opcode.JZ, [cond_reg, end_label]))
-        self.instructions.append(Instruction(JQOpcode.GET_INDEX, [item_reg, buffer_reg, index_reg]))
-        self._compile_pipeline(rest, item_reg)
-        self.instructions.append(Instruction(Opcode.ADD, [index_reg, index_reg, "1"]))
-        self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-        self.instructions.append(Instruction(Opcode.LABEL, [end_label]))
+        if not rest:
+            self.instructions.append(Instruction(JQOpcode.EMIT_RANGE, (buffer_reg, None, None)))
+            return
+        self._emit_index_loop(buffer_reg, "jq_iter", lambda item_reg: self._compile_pipeline(rest, item_reg))
 
     def _compile_reduce(self, stage: Reduce, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
         values_buffer = self._collect_values(stage.source, current_reg)
-        acc_reg = self._eval_expression(stage.init, current_reg)
-        len_reg = self._new_temp()
-        index_reg = self._new_temp()
-        cond_reg = self._new_temp()
-        item_reg = self._new_temp()
-        loop_label = self._new_label("jq_reduce_loop")
-        end_label = self._new_label("jq_reduce_end")
-
-        self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [len_reg, values_buffer]))
-        self.instructions.append(Instruction(Opcode.LOAD_CONST, [index_reg, 0]))
-        self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
-        self.instructions.append(Instruction(Opcode.LT, [cond_reg, index_reg, len_reg]))
-        self.instructions.append(Instruction(Opcode.JZ, [cond_reg, end_label]))
-        self.instructions.append(Instruction(JQOpcode.GET_INDEX, [item_reg, values_buffer, index_reg]))
+        acc_reg = self._writable(self._eval_expression(stage.init, current_reg))
         var_reg = self._var_reg(stage.var_name)
-        self.instructions.append(Instruction(Opcode.MOV, [var_reg, item_reg]))
-        new_acc = self._eval_expression(stage.update, acc_reg)
-        self.instructions.append(Instruction(Opcode.MOV, [acc_reg, new_acc]))
-        self.instructions.append(Instruction(Opcode.ADD, [index_reg, index_reg, "1"]))
-        self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-        self.instructions.append(Instruction(Opcode.LABEL, [end_label]))
 
+        def step(item_reg: str) -> None:
+            emit(Instruction(Opcode.MOV, (var_reg, item_reg)))
+            new_acc = self._eval_expression(stage.update, acc_reg)
+            emit(Instruction(Opcode.MOV, (acc_reg, new_acc)))
+
+        self._emit_index_loop(values_buffer, "jq_reduce", step)
         self._compile_pipeline(rest, acc_reg)
 
     def _compile_foreach(self, stage: Foreach, current_reg: str, rest: List[JQNode]) -> None:
+        emit = self.instructions.append
         values_buffer = self._collect_values(stage.source, current_reg)
-        state_reg = self._eval_expression(stage.init, current_reg)
-        len_reg = self._new_temp()
-        index_reg = self._new_temp()
-        cond_reg = self._new_temp()
-        item_reg = self._new_temp()
-        loop_label = self._new_label("jq_foreach_loop")
-        end_label = self._new_label("jq_foreach_end")
-
-        self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [len_reg, values_buffer]))
-        self.instructions.append(Instruction(Opcode.LOAD_CONST, [index_reg, 0]))
-        self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
-        self.instructions.append(Instruction(Opcode.LT, [cond_reg, index_reg, len_reg]))
-        self.instructions.append(Instruction(Opcode.JZ, [cond_reg, end_label]))
-        self.instructions.append(Instruction(JQOpcode.GET_INDEX, [item_reg, values_buffer, index_reg]))
+        state_reg = self._writable(self._eval_expression(stage.init, current_reg))
         var_reg = self._var_reg(stage.var_name)
-        self.instructions.append(Instruction(Opcode.MOV, [var_reg, item_reg]))
-        new_state = self._eval_expression(stage.update, state_reg)
-        self.instructions.append(Instruction(Opcode.MOV, [state_reg, new_state]))
-        if stage.extract is not None:
-            output_reg = self._eval_expression(stage.extract, state_reg)
-        else:
-            output_reg = self._new_temp()
-            self.instructions.append(Instruction(Opcode.MOV, [output_reg, state_reg]))
-        self._compile_pipeline(rest, output_reg)
-        self.instructions.append(Instruction(Opcode.ADD, [index_reg, index_reg, "1"]))
-        self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-        self.instructions.append(Instruction(Opcode.LABEL, [end_label]))
+
+        def step(item_reg: str) -> None:
+            emit(Instruction(Opcode.MOV, (var_reg, item_reg)))
+            new_state = self._eval_expression(stage.update, state_reg)
+            emit(Instruction(Opcode.MOV, (state_reg, new_state)))
+            if stage.extract is not None:
+                output_reg = self._writable(self._eval_expression(stage.extract, state_reg))
+            else:
+                output_reg = self._new_temp()
+                emit(Instruction(Opcode.MOV, (output_reg, state_reg)))
+            self._compile_pipeline(rest, output_reg)
+
+        self._emit_index_loop(values_buffer, "jq_foreach", step)
 
     def _compile_while(
         self,
@@ -838,17 +1603,22 @@ class JQCompiler:
         current_reg: str,
         rest: List[JQNode],
     ) -> None:
-        value_reg = current_reg
+        emit = self.instructions.append
+        value_reg = self._writable(current_reg)
         loop_label = self._new_label("jq_while_loop")
         done_label = self._new_label("jq_while_done")
-        self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
+        emit(Instruction(Opcode.LABEL, (loop_label,)))
         cond_reg = self._eval_expression(cond_expr, value_reg)
-        self.instructions.append(Instruction(Opcode.JZ, [cond_reg, done_label]))
+        emit(Instruction(Opcode.JZ, (cond_reg, done_label)))
         self._compile_pipeline(rest, value_reg)
         new_value = self._eval_expression(update_expr, value_reg)
-        self.instructions.append(Instruction(Opcode.MOV, [value_reg, new_value]))
-        self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-        self.instructions.append(Instruction(Opcode.LABEL, [done_label]))
+        self.instructions.extend(
+            (
+                Instruction(Opcode.MOV, (value_reg, new_value)),
+                Instruction(Opcode.JMP, (loop_label,)),
+                Instruction(Opcode.LABEL, (done_label,)),
+            )
+        )
 
     def _compile_until(
         self,
@@ -857,249 +1627,413 @@ class JQCompiler:
         current_reg: str,
         rest: List[JQNode],
     ) -> None:
-        value_reg = current_reg
-        loop_label = self._new_label("jq_until_loop")
-        exit_label = self._new_label("jq_until_exit")
-        done_label = self._new_label("jq_until_done")
-        self.instructions.append(Instruction(Opcode.LABEL, [loop_label]))
+        emit = self.instructions.append
+        new_label = self._new_label
+        value_reg = self._writable(current_reg)
+        loop_label = new_label("jq_until_loop")
+        exit_label = new_label("jq_until_exit")
+        done_label = new_label("jq_until_done")
+        emit(Instruction(Opcode.LABEL, (loop_label,)))
         cond_reg = self._eval_expression(cond_expr, value_reg)
-        self.instructions.append(Instruction(Opcode.JNZ, [cond_reg, exit_label]))
+        emit(Instruction(Opcode.JNZ, (cond_reg, exit_label)))
         self._compile_pipeline(rest, value_reg)
         new_value = self._eval_expression(update_expr, value_reg)
-        self.instructions.append(Instruction(Opcode.MOV, [value_reg, new_value]))
-        self.instructions.append(Instruction(Opcode.JMP, [loop_label]))
-        self.instructions.append(Instruction(Opcode.LABEL, [exit_label]))
+        self.instructions.extend(
+            (
+                Instruction(Opcode.MOV, (value_reg, new_value)),
+                Instruction(Opcode.JMP, (loop_label,)),
+                Instruction(Opcode.LABEL, (exit_label,)),
+            )
+        )
         self._compile_pipeline(rest, value_reg)
-        self.instructions.append(Instruction(Opcode.LABEL, [done_label]))
+        emit(Instruction(Opcode.LABEL, (done_label,)))
 
     def _new_temp(self) -> str:
-        name = f"__jq_tmp{self._temp_counter}"
-        self._temp_counter += 1
+        index = next(self._temp_counter)
+        name = _TEMP_NAMES.get(index)
+        if name is None:
+            name = _TEMP_NAMES.setdefault(index, sys.intern(_TEMP_PREFIX + str(index)))
+        self._minted.append((name, None))
         return name
 
     def _new_label(self, prefix: str) -> str:
-        name = f"__{prefix}_{self._label_counter}"
-        self._label_counter += 1
+        # Numbered per prefix; no prefix ends in "_<digits>", so names stay unique.
+        name = sys.intern("__" + prefix + "_" + str(next(self._label_counters[prefix])))
+        self._minted.append((name, prefix))
         return name
 
     def _find_label(self, name: str) -> Optional[str]:
-        for label_name, target in reversed(self._label_stack):
-            if label_name == name:
-                return target
-        return None
+        # break targets depend on the enclosing label stack, so the code being
+        # emitted can no longer be replayed elsewhere as a subtree template.
+        self._context_sensitive = True
+        targets = self._label_targets.get(name)
+        return targets[-1] if targets else None
 
     def _var_reg(self, name: str) -> str:
-        return f"__jq_var_{name}"
+        return sys.intern(_VAR_PREFIX + name)
 
     def _eval_expression(self, node: JQNode, base_reg: str) -> str:
-        if isinstance(node, Identity):
-            return base_reg
-        if isinstance(node, Literal):
+        if type(node) in _UNCACHED_NODES or base_reg.startswith((_VAR_PREFIX, _CONST_PREFIX)):
+            # Var/const registers are also operands in their own right, so code
+            # built on them cannot be relocated to another base.
+            return self._eval_node(node, base_reg)
+        if self._cse is not None:
+            return self._eval_subtree(node, base_reg)
+        # Outermost expression of a stage: CSE entries live until it is emitted.
+        self._cse = {}
+        try:
+            return self._eval_subtree(node, base_reg)
+        finally:
+            self._cse = None
+
+    def _eval_subtree(self, node: JQNode, base_reg: str) -> str:
+        entry = self._numbering.get(id(node))
+        if entry is None or entry[0] is not node:
+            # Built during compilation (not part of the input tree).
+            _number_subtrees(node, self._numbering, self._subtree_table, self._subtree_counts)
+            entry = self._numbering[id(node)]
+        key = entry[1]
+        cse_key = None
+        if type(node) in _CSE_NODES or getattr(node, "op", None) in _CSE_OPS:
+            cse_key = (key, base_reg)
+            reused = self._cse.get(cse_key)
+            if reused is not None:
+                return reused
+
+        template = self._templates.get(key)
+        if template is not None:
+            result = self._replay_template(template, base_reg)
+            if template.clobbers:
+                self._invalidate_cse()
+        elif self._subtree_counts[key] > 1:
+            # Only subtrees that occur again are worth recording for replay.
+            result = self._record_template(key, node, base_reg)
+        else:
+            result = self._eval_node(node, base_reg)
+        if cse_key is not None:
+            self._cse[cse_key] = result
+        return result
+
+    def _record_template(self, key: int, node: JQNode, base_reg: str) -> str:
+        start = len(self.instructions)
+        minted_mark = len(self._minted)
+        outer_sensitive = self._context_sensitive
+        self._context_sensitive = False
+        # A template may only reference registers it mints, so entries from
+        # outside the recording are hidden until it ends.
+        outer_cse, generation = self._cse, self._cse_generation
+        self._cse = {}
+        result = self._eval_node(node, base_reg)
+        if generation == self._cse_generation:
+            self._cse = {**outer_cse, **self._cse}
+        if not self._context_sensitive:
+            instructions = tuple(self.instructions[start:])
+            local_names = tuple(self._minted[minted_mark:])
+            self._templates[key] = _SubtreeTemplate(
+                instructions,
+                base_reg,
+                result,
+                local_names,
+                _clobbers_outer_registers(instructions, {name for name, _ in local_names}),
+            )
+        self._context_sensitive = self._context_sensitive or outer_sensitive
+        return result
+
+    def _invalidate_cse(self) -> None:
+        """Forget common subexpressions after a register they may depend on is reassigned."""
+        if self._cse is not None:
+            self._cse = {}
+        self._cse_generation += 1
+
+    def _eval_branch(self, node: JQNode, base_reg: str) -> str:
+        """Evaluate code that may be skipped at runtime; its CSE entries end with it."""
+        if self._cse is None:
+            return self._eval_expression(node, base_reg)
+        saved, generation = dict(self._cse), self._cse_generation
+        result = self._eval_expression(node, base_reg)
+        self._cse = saved if generation == self._cse_generation else {}
+        return result
+
+    def _replay_template(self, template: _SubtreeTemplate, base_reg: str) -> str:
+        """Re-emit a recorded subtree with fresh temps/labels bound to ``base_reg``."""
+        emit = self.instructions.append
+        mapping = {template.base_reg: base_reg}
+        for name, prefix in template.local_names:
+            mapping[name] = self._new_temp() if prefix is None else self._new_label(prefix)
+        for inst in template.instructions:
+            literal_positions = _LITERAL_OPERANDS.get(inst.opcode, _NO_LITERALS)
+            args = tuple(
+                mapping.get(arg, arg) if isinstance(arg, str) and pos not in literal_positions else arg
+                for pos, arg in enumerate(inst.args)
+            )
+            emit(Instruction(inst.opcode, args))
+        return mapping.get(template.result_reg, template.result_reg)
+
+    def _eval_node(self, node: JQNode, base_reg: str) -> str:
+        handler = self._eval_dispatch.get(type(node))
+        if handler is not None:
+            return handler(node, base_reg)
+        return self._compile_expression(node, base_reg)
+
+    def _eval_identity(self, node: Identity, base_reg: str) -> str:
+        return base_reg
+
+    def _eval_literal(self, node: Literal, base_reg: str) -> str:
+        return self._load_const(node.value)
+
+    def _eval_varref(self, node: VarRef, base_reg: str) -> str:
+        return self._var_reg(node.name)
+
+    def _eval_unary(self, node: UnaryOp, base_reg: str) -> str:
+        folded = _fold_constant(node, self._fold_memo)
+        if folded is not _NOT_CONSTANT:
+            return self._load_const(folded)
+        operand = self._eval_expression(node.operand, base_reg)
+        dest = self._new_temp()
+        if node.op == "-":
+            self.instructions.append(Instruction(Opcode.NEG, (dest, operand)))
+            return dest
+        if node.op == "not":
+            self.instructions.append(Instruction(Opcode.NOT, (dest, operand)))
+            return dest
+        raise NotImplementedError(f"Unsupported unary operator: {node.op}")
+
+    def _eval_binary(self, node: BinaryOp, base_reg: str) -> str:
+        folded = _fold_constant(node, self._fold_memo)
+        if folded is not _NOT_CONSTANT:
+            return self._load_const(folded)
+        emit = self.instructions.append
+        if node.op in ("and", "or"):
+            return self._eval_short_circuit(node, base_reg)
+        # Arithmetic and comparisons directly mapped
+        opcode = _BINOP_MAP.get(node.op)
+        if opcode is not None:
+            left = self._eval_expression(node.left, base_reg)
+            right = self._eval_expression(node.right, base_reg)
             dest = self._new_temp()
-            self.instructions.append(Instruction(Opcode.LOAD_CONST, [dest, node.value]))
+            emit(Instruction(opcode, (dest, left, right)))
             return dest
-        if isinstance(node, VarRef):
-            return self._var_reg(node.name)
-        if isinstance(node, UnaryOp):
-            operand = self._eval_expression(node.operand, base_reg)
+        opcode = _NEGATED_BINOP_MAP.get(node.op)
+        if opcode is not None:
+            left = self._eval_expression(node.left, base_reg)
+            right = self._eval_expression(node.right, base_reg)
+            cmp_reg = self._new_temp()
             dest = self._new_temp()
-            if node.op == "-":
-                self.instructions.append(Instruction(Opcode.NEG, [dest, operand]))
-                return dest
-            if node.op == "not":
-                self.instructions.append(Instruction(Opcode.NOT, [dest, operand]))
-                return dest
-            raise NotImplementedError(f"Unsupported unary operator: {node.op}")
-        if isinstance(node, BinaryOp):
-            # Arithmetic and logic directly mapped
-            if node.op in {"+", "-", "*", "/", "%", "==", ">", "<", "and", "or"}:
-                left = self._eval_expression(node.left, base_reg)
-                right = self._eval_expression(node.right, base_reg)
-                dest = self._new_temp()
-                opmap = {
-                    "+": Opcode.ADD,
-                    "-": Opcode.SUB,
-                    "*": Opcode.MUL,
-                    "/": Opcode.DIV,
-                    "%": Opcode.MOD,
-                    "==": Opcode.EQ,
-                    ">": Opcode.GT,
-                    "<": Opcode.LT,
-                    "and": Opcode.AND,
-                    "or": Opcode.OR,
-                }
-                self.instructions.append(Instruction(opmap[node.op], [dest, left, right]))
-                return dest
-            # Derived comparisons: !=, >=, <=
-            if node.op == "!=":
-                eq_reg = self._eval_expression(BinaryOp("==", node.left, node.right), base_reg)
-                dest = self._new_temp()
-                self.instructions.append(Instruction(Opcode.NOT, [dest, eq_reg]))
-                return dest
-            if node.op == ">=":
-                # not (left < right)
-                lt_reg = self._eval_expression(BinaryOp("<", node.left, node.right), base_reg)
-                dest = self._new_temp()
-                self.instructions.append(Instruction(Opcode.NOT, [dest, lt_reg]))
-                return dest
-            if node.op == "<=":
-                # not (left > right)
-                gt_reg = self._eval_expression(BinaryOp(">", node.left, node.right), base_reg)
-                dest = self._new_temp()
-                self.instructions.append(Instruction(Opcode.NOT, [dest, gt_reg]))
-                return dest
-            if node.op == "//":
-                # Coalesce: return left if not null, else right
-                left_reg = self._eval_expression(node.left, base_reg)
-                dest = self._new_temp()
-                null_reg = self._new_temp()
-                cond_reg = self._new_temp()
-                notnull_label = self._new_label("jq_coalesce_use_left")
-                done_label = self._new_label("jq_coalesce_done")
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [null_reg, None]))
-                self.instructions.append(Instruction(Opcode.EQ, [cond_reg, left_reg, null_reg]))
-                self.instructions.append(Instruction(Opcode.JZ, [cond_reg, notnull_label]))
-                right_reg = self._eval_expression(node.right, base_reg)
-                self.instructions.append(Instruction(Opcode.MOV, [dest, right_reg]))
-                self.instructions.append(Instruction(Opcode.JMP, [done_label]))
-                self.instructions.append(Instruction(Opcode.LABEL, [notnull_label]))
-                self.instructions.append(Instruction(Opcode.MOV, [dest, left_reg]))
-                self.instructions.append(Instruction(Opcode.LABEL, [done_label]))
-                return dest
-            raise NotImplementedError(f"Unsupported binary operator: {node.op}")
-        if isinstance(node, Field):
-            names: List[str] = []
-            source = node
-            while isinstance(source, Field):
-                names.append(source.name)
-                source = source.source
-
-            current = self._eval_expression(source, base_reg)
-            for name in reversed(names):
-                dest = self._new_temp()
-                self.instructions.append(Instruction(JQOpcode.OBJ_GET, [dest, current, name]))
-                current = dest
-            return current
-        if isinstance(node, ObjectLiteral):
-            obj_reg = self._new_temp()
-            self.instructions.append(Instruction(Opcode.LOAD_CONST, [obj_reg, {}]))
-            for key, value_expr in node.pairs:
-                value_reg = self._eval_expression(value_expr, base_reg)
-                self.instructions.append(Instruction(JQOpcode.OBJ_SET, [obj_reg, key, value_reg]))
-            return obj_reg
-        if isinstance(node, Index):
-            container = self._eval_expression(node.source, base_reg)
-            idx = self._eval_expression(node.index, base_reg)
+            self.instructions.extend(
+                (
+                    Instruction(opcode, (cmp_reg, left, right)),
+                    Instruction(Opcode.NOT, (dest, cmp_reg)),
+                )
+            )
+            return dest
+        if node.op == "//":
+            # Coalesce: return left if not null, else right
+            left_reg = self._eval_expression(node.left, base_reg)
             dest = self._new_temp()
-            self.instructions.append(Instruction(JQOpcode.GET_INDEX, [dest, container, idx]))
+            null_reg = self._load_const(None)
+            cond_reg = self._new_temp()
+            notnull_label = self._new_label("jq_coalesce_use_left")
+            done_label = self._new_label("jq_coalesce_done")
+            emit(Instruction(Opcode.EQ, (cond_reg, left_reg, null_reg)))
+            emit(Instruction(Opcode.JZ, (cond_reg, notnull_label)))
+            right_reg = self._eval_branch(node.right, base_reg)
+            self.instructions.extend(
+                (
+                    Instruction(Opcode.MOV, (dest, right_reg)),
+                    Instruction(Opcode.JMP, (done_label,)),
+                    Instruction(Opcode.LABEL, (notnull_label,)),
+                    Instruction(Opcode.MOV, (dest, left_reg)),
+                    Instruction(Opcode.LABEL, (done_label,)),
+                )
+            )
             return dest
-        if isinstance(node, Slice):
-            src = self._eval_expression(node.source, base_reg)
-            result = self._new_temp()
-            self.instructions.append(Instruction(Opcode.LOAD_CONST, [result, []]))
-
-            length = self._new_temp()
-            self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [length, src]))
-
-            start_reg = self._new_temp()
-            if node.start is None:
-                self.instructions.append(Instruction(Opcode.LOAD_CONST, [start_reg, 0]))
+        raise NotImplementedError(f"Unsupported binary operator: {node.op}")
+
+    def _eval_short_circuit(self, node: BinaryOp, base_reg: str) -> str:
+        # `and` skips the right side when the left is falsy, `or` when it is truthy;
+        # the result stays a boolean either way.
+        emit = self.instructions.append
+        is_and = node.op == "and"
+        left = self._eval_expression(node.left, base_reg)
+        dest = self._new_temp()
+        short_label = self._new_label("jq_logic_short")
+        done_label = self._new_label("jq_logic_done")
+        emit(Instruction(Opcode.JZ if is_and else Opcode.JNZ, (left, short_label)))
+        right = self._eval_branch(node.right, base_reg)
+        self.instructions.extend(
+            (
+                Instruction(Opcode.AND if is_and else Opcode.OR, (dest, left, right)),
+                Instruction(Opcode.JMP, (done_label,)),
+                Instruction(Opcode.LABEL, (short_label,)),
+                Instruction(Opcode.LOAD_CONST, (dest, not is_and)),
+                Instruction(Opcode.LABEL, (done_label,)),
+            )
+        )
+        return dest
+
+    def _eval_field(self, node: JQNode, base_reg: str) -> str:
+        # A run of .name / [<constant int>] steps becomes one OBJ_GET(_PATH).
+        path: List[object] = []
+        source = node
+        while True:
+            if type(source) is Field:
+                path.append(source.name)
             else:
-                start_val = self._eval_expression(node.start, base_reg)
-                self.instructions.append(Instruction(Opcode.MOV, [start_reg, start_val]))
-
-            end_reg = self._new_temp()
-            if node.end is None:
-                self.instructions.append(Instruction(Opcode.MOV, [end_reg, length]))
+                index = _static_int_index(source)
+                if index is None:
+                    break
+                path.append(index)
+            source = source.source
+
+        current = self._eval_expression(source, base_reg)
+        dest = self._new_temp()
+        if len(path) == 1 and type(path[0]) is str:
+            self.instructions.append(Instruction(JQOpcode.OBJ_GET, (dest, current, path[0])))
+        else:
+            self.instructions.append(Instruction(JQOpcode.OBJ_GET_PATH, (dest, current, tuple(reversed(path)))))
+        return dest
+
+    def _eval_object(self, node: ObjectLiteral, base_reg: str) -> str:
+        value_regs = [self._eval_expression(value_expr, base_reg) for _, value_expr in node.pairs]
+        obj_reg = self._new_temp()
+        keys = tuple(key for key, _ in node.pairs)
+        self.instructions.append(Instruction(JQOpcode.OBJ_BUILD, (obj_reg, keys, *value_regs)))
+        return obj_reg
+
+    def _eval_index(self, node: Index, base_reg: str) -> str:
+        if _static_int_index(node) is not None:
+            return self._eval_field(node, base_reg)
+        container = self._eval_expression(node.source, base_reg)
+        idx = self._eval_expression(node.index, base_reg)
+        dest = self._new_temp()
+        self.instructions.append(Instruction(JQOpcode.GET_INDEX, (dest, container, idx)))
+        return dest
+
+    def _eval_slice(self, node: Slice, base_reg: str) -> str:
+        src = self._eval_expression(node.source, base_reg)
+        start = self._slice_bound(node.start, base_reg)
+        end = self._slice_bound(node.end, base_reg)
+        dest = self._new_temp()
+        self.instructions.append(Instruction(JQOpcode.SLICE, (dest, src, start, end)))
+        return dest
+
+    def _slice_bound(self, bound: Optional[JQNode], base_reg: str) -> object:
+        """SLICE operand: ``None`` when omitted, an int immediate for constant ints (``-2``), else a register."""
+        if bound is None:
+            return None
+        folded = _fold_constant(bound)
+        if type(folded) is int:
+            return folded
+        return self._eval_expression(bound, base_reg)
+
+    @staticmethod
+    def _emits_single_value(stages: List[JQNode]) -> bool:
+        # Expression stages always produce exactly one value (nested generators
+        # inside them are already reduced to their last output).
+        return all(type(stage) in _SINGLE_VALUE_STAGES for stage in stages)
+
+    def _eval_single_value(self, stages: List[JQNode], base_reg: str) -> str:
+        emit = self.instructions.append
+        reg = base_reg
+        for stage in stages:
+            if type(stage) is AsBinding:
+                value_reg = self._eval_expression(stage.source, reg)
+                emit(Instruction(Opcode.MOV, (self._var_reg(stage.name), value_reg)))
+                self._invalidate_cse()
             else:
-                end_val = self._eval_expression(node.end, base_reg)
-                self.instructions.append(Instruction(Opcode.MOV, [end_reg, end_val]))
-
-            # Normalize start: if start < 0 => start += length; clamp to [0, length]
-            zero = "0"
-            cond = self._new_temp()
-            neg_label = self._new_label("jq_slice_start_neg")
-            cont1 = self._new_label("jq_slice_start_cont1")
-            self.instructions.append(Instruction(Opcode.LT, [cond, start_reg, zero]))
-            self.instructions.append(Instruction(Opcode.JZ, [cond, cont1]))
-            self.instructions.append(Instruction(Opcode.ADD, [start_reg, start_reg, length]))
-            self.instructions.append(Instruction(Opcode.LABEL, [cont1]))
-            # start < 0 => start = 0
-            cont2 = self._new_label("jq_slice_start_cont2")
-            self.instructions.append(Instruction(Opcode.LT, [cond, start_reg, zero]))
-            self.instructions.append(Instruction(Opcode.JZ, [cond, cont2]))
-            self.instructions.append(Instruction(Opcode.LOAD_CONST, [start_reg, 0]))
-            self.instructions.append(Instruction(Opcode.LABEL, [cont2]))
-            # start > length => start = length
-            cont3 = self._new_label("jq_slice_start_cont3")
-            self.instructions.append(Instruction(Opcode.GT, [cond, start_reg, length]))
-            self.instructions.append(Instruction(Opcode.JZ, [cond, cont3]))
-            self.instructions.append(Instruction(Opcode.MOV, [start_reg, length]))
-            self.instructions.append(Instruction(Opcode.LABEL, [cont3]))
-
-            # Normalize end: if end < 0 => end += length; clamp to [0, length]
-            cont4 = self._new_label("jq_slice_end_cont1")
-            self.instructions.append(Instruction(Opcode.LT, [cond, end_reg, zero]))
-            self.instructions.append(Instruction(Opcode.JZ, [cond, cont4]))
-            self.instructions.append(Instruction(Opcode.ADD, [end_reg, end_reg, length]))
-            self.instructions.append(Instruction(Opcode.LABEL, [cont4]))
-            cont5 = self._new_label("jq_slice_end_cont2")
-            self.instructions.append(Instruction(Opcode.LT, [cond, end_reg, zero]))
-            self.instructions.append(Instruction(Opcode.JZ, [cond, cont5]))
-            self.instructions.append(Instruction(Opcode.LOAD_CONST, [end_reg, 0]))
-            self.instructions.append(Instruction(Opcode.LABEL, [cont5]))
-            cont6 = self._new_label("jq_slice_end_cont3")
-            self.instructions.append(Instruction(Opcode.GT, [cond, end_reg, length]))
-            self.instructions.append(Instruction(Opcode.JZ, [cond, cont6]))
-            self.instructions.append(Instruction(Opcode.MOV, [end_reg, length]))
-            self.instructions.append(Instruction(Opcode.LABEL, [cont6]))
-
-            # Loop i from start to end-1
-            i = self._new_temp()
-            self.instructions.append(Instruction(Opcode.MOV, [i, start_reg]))
-            self.instructions.append(Instruction(JQOpcode.PUSH_EMIT, [result]))
-            loop = self._new_label("jq_slice_loop")
-            done = self._new_label("jq_slice_done")
-            self.instructions.append(Instruction(Opcode.LABEL, [loop]))
-            self.instructions.append(Instruction(Opcode.LT, [cond, i, end_reg]))
-            self.instructions.append(Instruction(Opcode.JZ, [cond, done]))
-            item = self._new_temp()
-            self.instructions.append(Instruction(JQOpcode.GET_INDEX, [item, src, i]))
-            self.instructions.append(Instruction(JQOpcode.EMIT, [item]))
-            self.instructions.append(Instruction(Opcode.ADD, [i, i, "1"]))
-            self.instructions.append(Instruction(Opcode.JMP, [loop]))
-            self.instructions.append(Instruction(Opcode.LABEL, [done]))
-            self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
-            return result
-        return self._compile_expression(node, base_reg)
+                reg = self._eval_expression(stage, reg)
+        if reg == base_reg or reg.startswith(_VAR_PREFIX):
+            # Callers may reassign the result (reduce/foreach state); keep it private.
+            dest = self._new_temp()
+            emit(Instruction(Opcode.MOV, (dest, reg)))
+            return dest
+        return reg
 
     def _compile_expression(self, expr: JQNode, base_reg: str) -> str:
+        stages = self._flat(expr)
+        if self._emits_single_value(stages):
+            return self._eval_single_value(stages, base_reg)
+        emit = self.instructions.append
         buffer_reg = self._new_temp()
-        self.instructions.append(Instruction(Opcode.LOAD_CONST, [buffer_reg, []]))
-        self.instructions.append(Instruction(JQOpcode.PUSH_EMIT, [buffer_reg]))
-        stages = flatten_pipe(expr)
+        emit(Instruction(JQOpcode.EMIT_BEGIN, (buffer_reg,)))
+        # The nested pipeline loops and rebinds variables: its stages start their
+        # own CSE scopes and nothing cached before it is trusted afterwards.
+        outer_cse, self._cse = self._cse, None
         self._compile_pipeline(stages, base_reg)
-        self.instructions.append(Instruction(JQOpcode.POP_EMIT, []))
+        self._cse = outer_cse
+        self._invalidate_cse()
+        emit(_POP_EMIT)
 
-        len_reg = self._new_temp()
-        index_reg = self._new_temp()
         value_reg = self._new_temp()
-        empty_label = self._new_label("jq_expr_empty")
-        done_label = self._new_label("jq_expr_done")
-
-        self.instructions.append(Instruction(JQOpcode.LEN_VALUE, [len_reg, buffer_reg]))
-        self.instructions.append(Instruction(Opcode.JZ, [len_reg, empty_label]))
-        self.instructions.append(Instruction(Opcode.SUB, [index_reg, len_reg, "1"]))
-        self.instructions.append(Instruction(JQOpcode.GET_INDEX, [value_reg, buffer_reg, index_reg]))
-        self.instructions.append(Instruction(Opcode.JMP, [done_label]))
-        self.instructions.append(Instruction(Opcode.LABEL, [empty_label]))
-        self.instructions.append(Instruction(Opcode.LOAD_CONST, [value_reg, None]))
-        self.instructions.append(Instruction(Opcode.LABEL, [done_label]))
+        emit(Instruction(JQOpcode.LAST_OR_NULL, (value_reg, buffer_reg)))
         return value_reg
 
 
+    # (name, arity) -> builtin compiler; arity None accepts any argument count.
+    # Steps emit one output value and return its register, like _linear_stages.
+    _BUILTIN_STEPS: Dict[Tuple[str, Optional[int]], Callable[..., str]] = {
+        ("setpath", 2): _builtin_setpath,
+        ("del", 1): _builtin_del,
+        ("walk", 1): _builtin_walk,
+        ("input", 0): _builtin_input,
+        ("tostring", 0): _builtin_tostring,
+        ("tonumber", 0): _builtin_tonumber,
+        ("split", 1): _builtin_split,
+        ("gsub", 2): _builtin_gsub,
+        ("sort", 0): _builtin_sort,
+        ("sort_by", 1): _builtin_sort_by,
+        ("unique", 0): _builtin_unique,
+        ("unique_by", 1): _builtin_unique_by,
+        ("min", 0): _builtin_min,
+        ("max", 0): _builtin_max,
+        ("min_by", 1): _builtin_min_by,
+        ("max_by", 1): _builtin_max_by,
+        ("group_by", 1): _builtin_group_by,
+        ("keys", 0): _builtin_keys,
+        ("has", 1): _builtin_has,
+        ("contains", 1): _builtin_contains,
+        ("add", 0): _builtin_add,
+        ("join", 0): _builtin_join,
+        ("join", 1): _builtin_join,
+        ("reverse", 0): _builtin_reverse,
+        ("first", 0): _builtin_first,
+        ("last", 0): _builtin_last,
+        ("any", 0): _builtin_any,
+        ("all", 0): _builtin_all,
+        ("length", 0): _builtin_length,
+        ("flatten", None): _builtin_flatten,
+        ("reduce", None): _builtin_reduce,
+        ("map", 1): _builtin_map,
+    }
+    # The rest compile the remaining stages themselves.
+    _BUILTINS: Dict[Tuple[str, Optional[int]], Callable[..., None]] = {
+        ("path", 1): _builtin_path,
+        ("paths", 0): _builtin_paths,
+        ("paths", 1): _builtin_paths_matching,
+        ("inputs", 0): _builtin_inputs,
+        ("halt", 0): _builtin_halt,
+        ("halt_error", 0): _builtin_halt_error,
+        ("halt_error", 1): _builtin_halt_error,
+        ("while", 2): _builtin_while,
+        ("until", 2): _builtin_until,
+        ("select", 1): _builtin_select,
+    }
+
+
 def compile_to_bytecode(node: JQNode) -> List[Instruction]:
     return JQCompiler().compile(node)
 
 
-__all__ = ["JQCompiler", "compile_to_bytecode", "INPUT_REGISTER", "CURRENT_REGISTER"]
+@lru_cache(maxsize=512)
+def compile_cached(source: str) -> Tuple[Instruction, ...]:
+    """Parse and compile ``source`` once per distinct program text.
+
+    The returned tuple (and its ``Instruction`` objects) is shared between
+    callers and must not be mutated; ``JQVM`` only reads it.
+    """
+    from haifa_jq.jq_parser import parse_jq_program
+
+    return tuple(JQCompiler().compile(parse_jq_program(source)))
+
+
+__all__ = ["JQCompiler", "compile_to_bytecode", "compile_cached", "INPUT_REGISTER", "CURRENT_REGISTER"]
@@ -1,12 +1,12 @@
 from __future__ import annotations
 
-import copy
 import json
 import ast
 import re
-from contextlib import contextmanager
+import operator
+from functools import lru_cache
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Set
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Set, Tuple
 
 
 from haifa_jq.jq_ast import (
@@ -34,56 +34,124 @@ from haifa_jq.jq_ast import (
     Break,
 )
 
-# Order matters: multi-char operators first
-_TOKEN_REGEX = re.compile(
-    r"""
-    (?P<WS>\s+)
-  | (?P<COALESCE_ASSIGN>//=)
-  | (?P<COALESCE>//)
-  | (?P<EQEQ>==)
-  | (?P<NEQ>!=)
-  | (?P<GTE>>=)
-  | (?P<LTE><=)
-  | (?P<PIPE_ASSIGN>\|=)
-  | (?P<PIPE>\|)
-  | (?P<DOT>\.)
-  | (?P<LBRACKET>\[)
-  | (?P<RBRACKET>\])
-  | (?P<LPAREN>\()
-  | (?P<RPAREN>\))
-  | (?P<COMMA>,)
-  | (?P<VAR>\$[A-Za-z_][A-Za-z0-9_]*)
-  | (?P<PLUS_ASSIGN>\+=)
-  | (?P<PLUS>\+)
-  | (?P<MINUS_ASSIGN>-=)
-  | (?P<MINUS>-)
-  | (?P<STAR_ASSIGN>\*=)
-  | (?P<STAR>\*)
-  | (?P<SLASH_ASSIGN>/=)
-  | (?P<SLASH>/)
-  | (?P<PERCENT_ASSIGN>%=)
-  | (?P<PERCENT>%)
-  | (?P<GT>>)
-  | (?P<LT><)
-  | (?P<NUMBER>-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?)
-  | (?P<STRING>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')
-  | (?P<IDENT>[A-Za-z_][A-Za-z0-9_]*)
-  | (?P<LBRACE>\{)
-  | (?P<RBRACE>\})
-  | (?P<COLON>:)
-  | (?P<SEMICOLON>;)
-    """,
-    re.VERBOSE,
-)
+# Token types are small ints (cheap to hash in the stop sets); _TOKEN_NAMES
+# spells them for error messages.
+T_EOF = 0
+T_DOT = 1
+T_PIPE = 2
+T_LBRACKET = 3
+T_RBRACKET = 4
+T_LPAREN = 5
+T_RPAREN = 6
+T_LBRACE = 7
+T_RBRACE = 8
+T_COMMA = 9
+T_COLON = 10
+T_SEMICOLON = 11
+T_PLUS = 12
+T_MINUS = 13
+T_STAR = 14
+T_SLASH = 15
+T_PERCENT = 16
+T_GT = 17
+T_LT = 18
+T_COALESCE = 19
+T_EQEQ = 20
+T_NEQ = 21
+T_GTE = 22
+T_LTE = 23
+T_PIPE_ASSIGN = 24
+T_PLUS_ASSIGN = 25
+T_MINUS_ASSIGN = 26
+T_STAR_ASSIGN = 27
+T_SLASH_ASSIGN = 28
+T_PERCENT_ASSIGN = 29
+T_COALESCE_ASSIGN = 30
+T_NUMBER = 31
+T_STRING = 32
+T_IDENT = 33
+T_VAR = 34
+_TOKEN_NAMES = {value: name[2:] for name, value in list(globals().items()) if name.startswith("T_")}
+
+# Punctuation is dispatched on its first character; only names, numbers and
+# strings go through a regex.
+_ONE_CHAR_TOKENS = {
+    ".": T_DOT,
+    "|": T_PIPE,
+    "[": T_LBRACKET,
+    "]": T_RBRACKET,
+    "(": T_LPAREN,
+    ")": T_RPAREN,
+    "{": T_LBRACE,
+    "}": T_RBRACE,
+    ",": T_COMMA,
+    ":": T_COLON,
+    ";": T_SEMICOLON,
+    "+": T_PLUS,
+    "-": T_MINUS,
+    "*": T_STAR,
+    "/": T_SLASH,
+    "%": T_PERCENT,
+    ">": T_GT,
+    "<": T_LT,
+}
+_TWO_CHAR_TOKENS = {
+    "//": T_COALESCE,
+    "==": T_EQEQ,
+    "!=": T_NEQ,
+    ">=": T_GTE,
+    "<=": T_LTE,
+    "|=": T_PIPE_ASSIGN,
+    "+=": T_PLUS_ASSIGN,
+    "-=": T_MINUS_ASSIGN,
+    "*=": T_STAR_ASSIGN,
+    "/=": T_SLASH_ASSIGN,
+    "%=": T_PERCENT_ASSIGN,
+}
+_OPERATOR_STARTS = frozenset(pair[0] for pair in _TWO_CHAR_TOKENS)
+_NUMBER_REGEX = re.compile(r"(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+# Unrolled-loop form with possessive runs: each stretch between escapes is one
+# character-class scan, and an unterminated literal fails without backtracking.
+_STRING_REGEX = re.compile(r""""[^"\\]*+(?:\\.[^"\\]*+)*+"|'[^'\\]*+(?:\\.[^'\\]*+)*+'""")
+_NAME_REGEX = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
 
 _KEYWORDS = {"true": True, "false": False, "null": None}
-
-
-@dataclass(frozen=True)
-class Token:
-    type: str
-    value: str
-    position: int
+_KEYWORD_SET = frozenset(_KEYWORDS)
+# Identifiers that start their own construct in _parse_primary.
+_CONTROL_KEYWORDS = frozenset({"if", "try", "label", "break", "reduce", "foreach"})
+
+# Binary operator token -> BinaryOp.op, one table per precedence level.
+_EQUALITY_OPS = {T_EQEQ: "==", T_NEQ: "!="}
+_COMPARISON_OPS = {T_GTE: ">=", T_LTE: "<=", T_GT: ">", T_LT: "<"}
+_ADDITIVE_OPS = {T_PLUS: "+", T_MINUS: "-"}
+_MULTIPLICATIVE_OPS = {T_STAR: "*", T_SLASH: "/", T_PERCENT: "%"}
+_POSTFIX_STARTS = frozenset({T_DOT, T_IDENT, T_LBRACKET})
+_LITERAL_TOKENS = frozenset({T_NUMBER, T_STRING})
+_COMPOUND_ASSIGN_OPS = {
+    T_PLUS_ASSIGN: "+",
+    T_MINUS_ASSIGN: "-",
+    T_STAR_ASSIGN: "*",
+    T_SLASH_ASSIGN: "/",
+    T_PERCENT_ASSIGN: "%",
+    T_COALESCE_ASSIGN: "//",
+}
+
+# Stop sets passed to _parse_expression (token types, or keywords for *_idents).
+_STOP_PIPE = frozenset({T_PIPE})
+_STOP_SEMICOLON = frozenset({T_SEMICOLON})
+_STOP_RPAREN = frozenset({T_RPAREN})
+_STOP_SEMICOLON_RPAREN = frozenset({T_SEMICOLON, T_RPAREN})
+_STOP_ARGUMENT = frozenset({T_COMMA, T_SEMICOLON, T_RPAREN})
+_STOP_OBJECT_VALUE = frozenset({T_COMMA, T_RBRACE})
+_STOP_AS = frozenset({"as"})
+_STOP_THEN = frozenset({"then"})
+_STOP_BRANCH = frozenset({"elif", "else", "end"})
+_STOP_END = frozenset({"end"})
+_STOP_CATCH = frozenset({"catch"})
+
+
+# (type, value, position, bracket nesting depth before the token)
+Token = Tuple[int, str, int, int]
 
 
 class JQSyntaxError(ValueError):
@@ -99,159 +167,247 @@ class FunctionDefinition:
 
 
 def _tokenize(source: str) -> List[Token]:
-    pos = 0
     tokens: List[Token] = []
+    append = tokens.append
+    pos = 0
+    depth = 0
     length = len(source)
     while pos < length:
-        match = _TOKEN_REGEX.match(source, pos)
-        if not match:
-            raise JQSyntaxError(f"Unexpected character at position {pos}: {source[pos]!r}")
-        kind = match.lastgroup
-        text = match.group()
-        pos = match.end()
-        if kind == "WS":
+        char = source[pos]
+        if char in " \t\n\r":
+            pos += 1
             continue
-        tokens.append(Token(kind, text, match.start()))
-    tokens.append(Token("EOF", "", pos))
+        if char in _OPERATOR_STARTS:
+            pair = source[pos : pos + 2]
+            kind = _TWO_CHAR_TOKENS.get(pair)
+            if kind is not None:
+                if kind == T_COALESCE and source.startswith("=", pos + 2):
+                    append((T_COALESCE_ASSIGN, "//=", pos, depth))
+                    pos += 3
+                else:
+                    append((kind, pair, pos, depth))
+                    pos += 2
+                continue
+        kind = _ONE_CHAR_TOKENS.get(char)
+        if kind is not None:
+            append((kind, char, pos, depth))
+            # Depth is computed here once so the parser never tracks it.
+            if char in "([{":
+                depth += 1
+            elif char in ")]}" and depth:
+                depth -= 1
+            pos += 1
+            continue
+        if "0" <= char <= "9":
+            match = _NUMBER_REGEX.match(source, pos)
+            kind = T_NUMBER
+        elif char == '"' or char == "'":
+            match = _STRING_REGEX.match(source, pos)
+            kind = T_STRING
+        elif char == "$":
+            match = _NAME_REGEX.match(source, pos + 1)
+            kind = T_VAR
+        else:
+            match = _NAME_REGEX.match(source, pos)
+            kind = T_IDENT
+        if match is None:
+            if char.isspace():
+                pos += 1
+                continue
+            raise JQSyntaxError(f"Unexpected character at position {pos}: {char!r}")
+        end = match.end()
+        append((kind, source[pos:end], pos, depth))
+        pos = end
+    append((T_EOF, "", pos, depth))
     return tokens
 
 
+# Node type -> (children(node), rebuild(node, new_children)) for the def
+# inlining walker. Leaf types (and Label/Break bodies, as before) are kept as is.
+_NODE_CHILDREN: Dict[type, Tuple[Callable[[Any], Any], Callable[[Any, List[Any]], JQNode]]] = {
+    Pipe: (lambda node: (node.left, node.right), lambda node, c: Pipe(c[0], c[1])),
+    Sequence: (lambda node: node.expressions, lambda node, c: Sequence(c)),
+    IfElse: (
+        lambda node: (node.condition, node.then_branch, node.else_branch),
+        lambda node, c: IfElse(c[0], c[1], c[2]),
+    ),
+    TryCatch: (lambda node: (node.try_expr, node.catch_expr), lambda node, c: TryCatch(c[0], c[1])),
+    ObjectLiteral: (
+        lambda node: [value for _, value in node.pairs],
+        lambda node, c: ObjectLiteral([(key, value) for (key, _), value in zip(node.pairs, c)]),
+    ),
+    Field: (lambda node: (node.source,), lambda node, c: Field(node.name, c[0])),
+    UnaryOp: (lambda node: (node.operand,), lambda node, c: UnaryOp(node.op, c[0])),
+    BinaryOp: (lambda node: (node.left, node.right), lambda node, c: BinaryOp(node.op, c[0], c[1])),
+    UpdateAssignment: (
+        lambda node: (node.target, node.expr),
+        lambda node, c: UpdateAssignment(c[0], node.op, c[1]),
+    ),
+    Index: (lambda node: (node.source, node.index), lambda node, c: Index(c[0], c[1])),
+    Slice: (lambda node: (node.source, node.start, node.end), lambda node, c: Slice(c[0], c[1], c[2])),
+    IndexAll: (lambda node: (node.source,), lambda node, c: IndexAll(c[0])),
+    AsBinding: (lambda node: (node.source,), lambda node, c: AsBinding(c[0], node.name)),
+    Reduce: (
+        lambda node: (node.source, node.init, node.update),
+        lambda node, c: Reduce(c[0], node.var_name, c[1], c[2]),
+    ),
+    Foreach: (
+        lambda node: (node.source, node.init, node.update, node.extract),
+        lambda node, c: Foreach(c[0], node.var_name, c[1], c[2], c[3]),
+    ),
+}
+
+# Work items of JQParser._expand.
+_VISIT, _REBUILD, _CALL, _RETURN = range(4)
+
+
 class JQParser:
     def __init__(self, tokens: List[Token]):
-        self.tokens = tokens
-        self.index = 0
+        self.tokens: List[Token] = tokens
+        # Token types again as a flat list: most checks only need the type.
+        self.types: List[int] = [token[0] for token in tokens]
+        self.index: int = 0
         self.definitions: Dict[str, FunctionDefinition] = {}
         self.user_function_names: Set[str] = set()
-        self._stop_ident_stack: List[Set[str]] = [set()]
-        self._stop_type_stack: List[Set[str]] = [set()]
-        self._stop_same_depth_stack: List[Dict[str, Set[int]]] = [dict()]
-        self._inlining_stack: List[str] = []
-        self._nesting_depth = 0
-
+        # Names of every FunctionCall built since the last reset.
+        self.called_names: Set[str] = set()
+        # One entry per open expression: (token types, token type -> nesting
+        # depths, keywords) that end it.
+        self._stops: List[Tuple[FrozenSet[int], Dict[int, FrozenSet[int]], FrozenSet[str]]] = [
+            (frozenset(), {}, frozenset())
+        ]
 
     @classmethod
     def parse(cls, source: str) -> JQNode:
         parser = cls(_tokenize(source))
         expr = parser._parse_program()
-        parser._expect("EOF")
+        parser._expect(T_EOF)
         return expr
 
     def _parse_program(self) -> JQNode:
-        while self._current().type == "IDENT" and self._current().value == "def":
+        while self._current()[0] == T_IDENT and self._current()[1] == "def":
             self._parse_definition()
+        # Definitions only matter if the body calls one of them.
+        self.called_names.clear()
         body = self._parse_expression()
+        if self.called_names.isdisjoint(self.definitions):
+            return body
         return self._inline_node(body)
 
     def _parse_definition(self) -> None:
         self._advance()  # consume 'def'
-        name_token = self._expect("IDENT")
+        name_token = self._expect(T_IDENT)
         params: List[str] = []
-        if self._match("LPAREN"):
-            if self._current().type != "RPAREN":
+        if self._match(T_LPAREN):
+            if self._current()[0] != T_RPAREN:
                 while True:
-                    var_token = self._expect("VAR")
-                    params.append(var_token.value[1:])
-                    if not self._match("SEMICOLON"):
+                    var_token = self._expect(T_VAR)
+                    params.append(var_token[1][1:])
+                    if not self._match(T_SEMICOLON):
                         break
-            self._expect("RPAREN")
-        self._expect("COLON")
-        self.user_function_names.add(name_token.value)
-        body = self._parse_expression(stop_types={"SEMICOLON"})
-        self._expect("SEMICOLON")
-        self.definitions[name_token.value] = FunctionDefinition(name_token.value, params, body)
+            self._expect(T_RPAREN)
+        self._expect(T_COLON)
+        self.user_function_names.add(name_token[1])
+        body = self._parse_expression(stop_types=_STOP_SEMICOLON)
+        self._expect(T_SEMICOLON)
+        self.definitions[name_token[1]] = FunctionDefinition(name_token[1], params, body)
 
     # Parsing helpers -------------------------------------------------
     def _current(self) -> Token:
         return self.tokens[self.index]
 
     def _peek(self, offset: int = 1) -> Token:
-        idx = self.index + offset
-        if idx >= len(self.tokens):
-            return self.tokens[-1]
-        return self.tokens[idx]
+        # Only called on non-EOF tokens, so the EOF sentinel keeps this in range.
+        return self.tokens[self.index + offset]
 
     def _advance(self) -> Token:
         token = self.tokens[self.index]
         self.index += 1
-        if token.type in {"LPAREN", "LBRACKET", "LBRACE"}:
-            self._nesting_depth += 1
-        elif token.type in {"RPAREN", "RBRACKET", "RBRACE"}:
-            self._nesting_depth = max(0, self._nesting_depth - 1)
         return token
 
-    def _match(self, *types: str) -> Optional[Token]:
-        if self._current().type in types:
+    def _match(self, *types: int) -> Optional[Token]:
+        if self.types[self.index] in types:
             return self._advance()
         return None
 
-    def _expect(self, type_: str) -> Token:
+    def _expect(self, type_: int) -> Token:
         token = self._current()
-        if token.type != type_:
-            raise JQSyntaxError(f"Expected {type_} at position {token.position}, got {token.type}")
+        if token[0] != type_:
+            raise JQSyntaxError(
+                f"Expected {_TOKEN_NAMES[type_]} at position {token[2]}, got {_TOKEN_NAMES[token[0]]}"
+            )
         return self._advance()
 
     def _expect_keyword(self, keyword: str) -> Token:
         token = self._current()
-        if token.type != "IDENT" or token.value != keyword:
+        if token[0] != T_IDENT or token[1] != keyword:
             raise JQSyntaxError(
-                f"Expected keyword '{keyword}' at position {token.position}, got {token.value!r}"
+                f"Expected keyword '{keyword}' at position {token[2]}, got {token[1]!r}"
             )
         return self._advance()
 
     def _current_is_keyword(self, keyword: str) -> bool:
         token = self._current()
-        return token.type == "IDENT" and token.value == keyword
+        return token[0] == T_IDENT and token[1] == keyword
 
-    @contextmanager
-    def _with_stop(
+    def _push_stop(
         self,
-        stop_idents: Optional[Set[str]] = None,
-        stop_types: Optional[Set[str]] = None,
-        stop_same_depth_types: Optional[Set[str]] = None,
-    ):
-        new_idents = set(stop_idents or [])
-        new_types = set(stop_types or [])
-        prev_same_depth = self._stop_same_depth_stack[-1]
-        new_same_depth = {tok: set(depths) for tok, depths in prev_same_depth.items()}
+        stop_idents: Optional[FrozenSet[str]],
+        stop_types: Optional[FrozenSet[int]],
+        stop_same_depth_types: Optional[FrozenSet[int]],
+    ) -> None:
+        # Entries are immutable, so an expression without new stops reuses its parent's.
+        top = self._stops[-1]
+        if not (stop_idents or stop_types or stop_same_depth_types):
+            self._stops.append(top)
+            return
+        types, same_depth, idents = top
+        if stop_idents:
+            idents = idents | stop_idents
+        if stop_types:
+            types = types | stop_types
         if stop_same_depth_types:
-            base_depth = self._nesting_depth
+            base_depth = frozenset((self.tokens[self.index][3],))
+            same_depth = dict(same_depth)
             for tok in stop_same_depth_types:
-                new_same_depth.setdefault(tok, set()).add(base_depth)
-        self._stop_ident_stack.append(self._stop_ident_stack[-1] | new_idents)
-        self._stop_type_stack.append(self._stop_type_stack[-1] | new_types)
-        self._stop_same_depth_stack.append(new_same_depth)
-        try:
-            yield
-        finally:
-            self._stop_ident_stack.pop()
-            self._stop_type_stack.pop()
-            self._stop_same_depth_stack.pop()
+                same_depth[tok] = same_depth.get(tok, frozenset()) | base_depth
+        self._stops.append((types, same_depth, idents))
+
+    def _pop_stop(self) -> None:
+        self._stops.pop()
 
     def _should_stop(self) -> bool:
-        token = self._current()
-        if token.type in self._stop_type_stack[-1]:
+        kind, value, _, depth = self.tokens[self.index]
+        types, same_depth, idents = self._stops[-1]
+        if kind in types:
             return True
-        depths = self._stop_same_depth_stack[-1].get(token.type)
-        if depths is not None and self._nesting_depth in depths:
+        depths = same_depth.get(kind)
+        if depths is not None and depth in depths:
             return True
-        if token.type == "IDENT" and token.value in self._stop_ident_stack[-1]:
-            return True
-        return False
+        return kind == T_IDENT and value in idents
 
     # Grammar ---------------------------------------------------------
     def _parse_expression(
         self,
-        stop_idents: Optional[Set[str]] = None,
-        stop_types: Optional[Set[str]] = None,
-        stop_same_depth_types: Optional[Set[str]] = None,
+        stop_idents: Optional[FrozenSet[str]] = None,
+        stop_types: Optional[FrozenSet[int]] = None,
+        stop_same_depth_types: Optional[FrozenSet[int]] = None,
     ) -> JQNode:
-        with self._with_stop(stop_idents, stop_types, stop_same_depth_types):
+        # Plain push/pop: a @contextmanager costs a generator per sub-expression.
+        self._push_stop(stop_idents, stop_types, stop_same_depth_types)
+        try:
             return self._parse_union()
+        finally:
+            self._pop_stop()
 
+    # The loops below read self.tokens[self.index] directly and step over
+    # tokens with `self.index += 1` instead of calling _advance().
     def _parse_union(self) -> JQNode:
         node = self._parse_pipe()
         expressions = [node]
-        while not self._should_stop() and self._match("COMMA"):
+        types = self.types
+        while types[self.index] == T_COMMA and not self._should_stop():
+            self.index += 1
             expressions.append(self._parse_pipe())
         if len(expressions) == 1:
             return node
@@ -259,19 +415,21 @@ class JQParser:
 
     def _parse_pipe(self) -> JQNode:
         node = self._parse_term()
+        tokens = self.tokens
         while True:
             if self._should_stop():
                 break
+            kind, value, _, _ = tokens[self.index]
             # as-binding: term 'as' $var (then continue)
-            if self._current().type == "IDENT" and self._current().value == "as":
-                self._advance()
-                var_tok = self._expect("VAR")
-                node = AsBinding(node, var_tok.value[1:])
+            if kind == T_IDENT and value == "as":
+                self.index += 1
+                var_tok = self._expect(T_VAR)
+                node = AsBinding(node, var_tok[1][1:])
                 # Continue to allow further 'as' or pipes
                 continue
-            if self._match("PIPE"):
-                right = self._parse_term()
-                node = Pipe(node, right)
+            if kind == T_PIPE:
+                self.index += 1
+                node = Pipe(node, self._parse_term())
                 continue
             break
         return node
@@ -282,247 +440,213 @@ class JQParser:
 
     def _parse_update(self) -> JQNode:
         node = self._parse_or()
+        types = self.types
         while True:
             if self._should_stop():
                 break
-            if self._match("PIPE_ASSIGN"):
-                rhs = self._parse_expression(stop_same_depth_types={"PIPE"})
+            kind = types[self.index]
+            if kind == T_PIPE_ASSIGN:
+                self.index += 1
+                rhs = self._parse_expression(stop_same_depth_types=_STOP_PIPE)
                 node = UpdateAssignment(node, "|=", rhs)
                 continue
-            if self._match("PLUS_ASSIGN"):
-                rhs = self._parse_expression(stop_same_depth_types={"PIPE"})
-                node = UpdateAssignment(node, "|=", BinaryOp("+", Identity(), rhs))
-                continue
-            if self._match("MINUS_ASSIGN"):
-                rhs = self._parse_expression(stop_same_depth_types={"PIPE"})
-                node = UpdateAssignment(node, "|=", BinaryOp("-", Identity(), rhs))
-                continue
-            if self._match("STAR_ASSIGN"):
-                rhs = self._parse_expression(stop_same_depth_types={"PIPE"})
-                node = UpdateAssignment(node, "|=", BinaryOp("*", Identity(), rhs))
-                continue
-            if self._match("SLASH_ASSIGN"):
-                rhs = self._parse_expression(stop_same_depth_types={"PIPE"})
-                node = UpdateAssignment(node, "|=", BinaryOp("/", Identity(), rhs))
-                continue
-            if self._match("PERCENT_ASSIGN"):
-                rhs = self._parse_expression(stop_same_depth_types={"PIPE"})
-                node = UpdateAssignment(node, "|=", BinaryOp("%", Identity(), rhs))
-                continue
-            if self._match("COALESCE_ASSIGN"):
-                rhs = self._parse_expression(stop_same_depth_types={"PIPE"})
-                node = UpdateAssignment(node, "|=", BinaryOp("//", Identity(), rhs))
-                continue
-            break
+            op = _COMPOUND_ASSIGN_OPS.get(kind)
+            if op is None:
+                break
+            self.index += 1
+            # `.a op= rhs` is `.a |= . op rhs`.
+            rhs = self._parse_expression(stop_same_depth_types=_STOP_PIPE)
+            node = UpdateAssignment(node, "|=", BinaryOp(op, Identity(), rhs))
         return node
 
     # Precedence climbing (low -> high)
     def _parse_or(self) -> JQNode:
         node = self._parse_and()
-        while self._current().type == "IDENT" and self._current().value == "or":
-            if self._should_stop():
+        tokens = self.tokens
+        while True:
+            kind, value, _, _ = tokens[self.index]
+            if kind != T_IDENT or value != "or" or self._should_stop():
                 break
-            self._advance()
-            right = self._parse_and()
-            node = BinaryOp("or", node, right)
+            self.index += 1
+            node = BinaryOp("or", node, self._parse_and())
         return node
 
     def _parse_and(self) -> JQNode:
         node = self._parse_coalesce()
-        while self._current().type == "IDENT" and self._current().value == "and":
-            if self._should_stop():
+        tokens = self.tokens
+        while True:
+            kind, value, _, _ = tokens[self.index]
+            if kind != T_IDENT or value != "and" or self._should_stop():
                 break
-            self._advance()
-            right = self._parse_coalesce()
-            node = BinaryOp("and", node, right)
+            self.index += 1
+            node = BinaryOp("and", node, self._parse_coalesce())
         return node
 
     def _parse_coalesce(self) -> JQNode:
         node = self._parse_equality()
-        while self._match("COALESCE"):
+        types = self.types
+        while types[self.index] == T_COALESCE:
+            # The operator is consumed before the stop check, as it always was.
+            self.index += 1
             if self._should_stop():
                 break
-            right = self._parse_equality()
-            node = BinaryOp("//", node, right)
+            node = BinaryOp("//", node, self._parse_equality())
         return node
 
     def _parse_equality(self) -> JQNode:
         node = self._parse_comparison()
+        types = self.types
         while True:
-            if self._should_stop():
+            op = _EQUALITY_OPS.get(types[self.index])
+            if op is None or self._should_stop():
                 break
-            if self._match("EQEQ"):
-                right = self._parse_comparison()
-                node = BinaryOp("==", node, right)
-                continue
-            if self._match("NEQ"):
-                right = self._parse_comparison()
-                node = BinaryOp("!=", node, right)
-                continue
-            break
+            self.index += 1
+            node = BinaryOp(op, node, self._parse_comparison())
         return node
 
     def _parse_comparison(self) -> JQNode:
         node = self._parse_additive()
+        types = self.types
         while True:
-            if self._should_stop():
+            op = _COMPARISON_OPS.get(types[self.index])
+            if op is None or self._should_stop():
                 break
-            if self._match("GTE"):
-                right = self._parse_additive()
-                node = BinaryOp(">=", node, right)
-                continue
-            if self._match("LTE"):
-                right = self._parse_additive()
-                node = BinaryOp("<=", node, right)
-                continue
-            if self._match("GT"):
-                right = self._parse_additive()
-                node = BinaryOp(">", node, right)
-                continue
-            if self._match("LT"):
-                right = self._parse_additive()
-                node = BinaryOp("<", node, right)
-                continue
-            break
+            self.index += 1
+            node = BinaryOp(op, node, self._parse_additive())
         return node
 
     def _parse_additive(self) -> JQNode:
         node = self._parse_multiplicative()
+        types = self.types
         while True:
-            if self._should_stop():
+            op = _ADDITIVE_OPS.get(types[self.index])
+            if op is None or self._should_stop():
                 break
-            if self._match("PLUS"):
-                right = self._parse_multiplicative()
-                node = BinaryOp("+", node, right)
-                continue
-            if self._match("MINUS"):
-                right = self._parse_multiplicative()
-                node = BinaryOp("-", node, right)
-                continue
-            break
+            self.index += 1
+            node = BinaryOp(op, node, self._parse_multiplicative())
         return node
 
     def _parse_multiplicative(self) -> JQNode:
         node = self._parse_unary()
+        types = self.types
         while True:
-            if self._should_stop():
+            op = _MULTIPLICATIVE_OPS.get(types[self.index])
+            if op is None or self._should_stop():
                 break
-            if self._match("STAR"):
-                right = self._parse_unary()
-                node = BinaryOp("*", node, right)
-                continue
-            if self._match("SLASH"):
-                right = self._parse_unary()
-                node = BinaryOp("/", node, right)
-                continue
-            if self._match("PERCENT"):
-                right = self._parse_unary()
-                node = BinaryOp("%", node, right)
-                continue
-            break
+            self.index += 1
+            node = BinaryOp(op, node, self._parse_unary())
         return node
 
     def _parse_unary(self) -> JQNode:
         # not, unary minus
-        token = self._current()
-        if token.type == "IDENT" and token.value == "not":
-            self._advance()
+        kind, value, _, _ = self.tokens[self.index]
+        if kind == T_IDENT and value == "not":
+            self.index += 1
             return UnaryOp("not", self._parse_unary())
-        if token.type == "MINUS":
-            self._advance()
+        if kind == T_MINUS:
+            self.index += 1
             return UnaryOp("-", self._parse_unary())
         return self._parse_postfix()
 
     def _parse_postfix(self) -> JQNode:
         node = self._parse_primary()
+        tokens = self.tokens
+        types = self.types
         while True:
-            if self._should_stop():
+            kind = types[self.index]
+            if kind not in _POSTFIX_STARTS or self._should_stop():
                 break
-            if self._match("DOT"):
-                ident = self._expect("IDENT")
-                node = Field(ident.value, node)
+            if kind == T_DOT:
+                self.index += 1
+                ident = self._expect(T_IDENT)
+                node = Field(ident[1], node)
                 continue
-            if (
-                self._current().type == "IDENT"
-                and self._current().value not in _KEYWORDS
-                and isinstance(node, Identity)
-            ):
-                ident = self._advance()
-                node = Field(ident.value, node)
+            if kind == T_IDENT:
+                value = tokens[self.index][1]
+                if value in _KEYWORD_SET or not isinstance(node, Identity):
+                    break
+                self.index += 1
+                node = Field(value, node)
                 continue
-            if self._match("LBRACKET"):
-                # Empty [] means IndexAll
-                if self._current().type == "RBRACKET":
-                    self._advance()
-                    node = IndexAll(node)
-                    continue
-                # Slice form with leading ':' => [:end]
-                if self._current().type == "COLON":
-                    self._advance()
-                    end_expr = None
-                    if self._current().type != "RBRACKET":
-                        end_expr = self._parse_expression()
-                    self._expect("RBRACKET")
-                    node = Slice(node, None, end_expr)
-                    continue
-                # First expression
-                first_expr = self._parse_expression()
-                # Single index: expr]
-                if self._match("RBRACKET"):
-                    node = Index(node, first_expr)
-                    continue
-                # Otherwise must be a slice: expr : expr? ]
-                self._expect("COLON")
+            self._advance()  # '['
+            kind = types[self.index]
+            # Empty [] means IndexAll
+            if kind == T_RBRACKET:
+                self._advance()
+                node = IndexAll(node)
+                continue
+            # Slice form with leading ':' => [:end]
+            if kind == T_COLON:
+                self.index += 1
                 end_expr = None
-                if self._current().type != "RBRACKET":
+                if types[self.index] != T_RBRACKET:
                     end_expr = self._parse_expression()
-                self._expect("RBRACKET")
-                node = Slice(node, first_expr, end_expr)
+                self._expect(T_RBRACKET)
+                node = Slice(node, None, end_expr)
                 continue
-            break
+            # First expression
+            first_expr = self._parse_expression()
+            # Single index: expr]
+            if self._match(T_RBRACKET):
+                node = Index(node, first_expr)
+                continue
+            # Otherwise must be a slice: expr : expr? ]
+            self._expect(T_COLON)
+            end_expr = None
+            if types[self.index] != T_RBRACKET:
+                end_expr = self._parse_expression()
+            self._expect(T_RBRACKET)
+            node = Slice(node, first_expr, end_expr)
         return node
 
     def _parse_primary(self) -> JQNode:
         token = self._current()
-        if token.type == "DOT":
-            self._advance()
-            return Identity()
-        if token.type == "VAR":
-            self._advance()
-            return VarRef(token.value[1:])
-        if token.type == "IDENT" and token.value == "if":
-            return self._parse_if()
-        if token.type == "IDENT" and token.value == "try":
-            return self._parse_try()
-        if token.type == "IDENT" and token.value == "label":
-            return self._parse_label()
-        if token.type == "IDENT" and token.value == "break":
-            return self._parse_break()
-        if token.type == "IDENT" and token.value == "reduce" and self._peek().type != "LPAREN":
-            return self._parse_reduce()
-        if token.type == "IDENT" and token.value == "foreach":
-            return self._parse_foreach()
-        if token.type == "IDENT" and token.value not in _KEYWORDS:
-            ident = self._advance()
-            if self._match("LPAREN"):
+        kind, value, position, _ = token
+        if kind == T_IDENT:
+            if value in _KEYWORD_SET:
+                self.index += 1
+                return Literal(_KEYWORDS[value])
+            if value in _CONTROL_KEYWORDS:
+                if value == "if":
+                    return self._parse_if()
+                if value == "try":
+                    return self._parse_try()
+                if value == "label":
+                    return self._parse_label()
+                if value == "break":
+                    return self._parse_break()
+                if value == "foreach":
+                    return self._parse_foreach()
+                # `reduce(...)` is the builtin function, not the reduce syntax.
+                if self.types[self.index + 1] != T_LPAREN:
+                    return self._parse_reduce()
+            self.index += 1
+            if self._match(T_LPAREN):
                 args = self._parse_arguments()
-                self._expect("RPAREN")
-                return FunctionCall(ident.value, args)
-            if ident.value in self.user_function_names:
-                return FunctionCall(ident.value, [])
-            return Field(ident.value, Identity())
-        if token.type in {"NUMBER", "STRING"} or token.value in _KEYWORDS:
-            literal_token = self._advance()
-            value = self._parse_literal_value(literal_token)
-            return Literal(value)
-        if token.type == "LBRACE":
+                self._expect(T_RPAREN)
+                self.called_names.add(value)
+                return FunctionCall(value, args)
+            if value in self.user_function_names:
+                self.called_names.add(value)
+                return FunctionCall(value, [])
+            return Field(value, Identity())
+        if kind == T_DOT:
+            self.index += 1
+            return Identity()
+        if kind == T_VAR:
+            self.index += 1
+            return VarRef(value[1:])
+        if kind in _LITERAL_TOKENS:
+            self.index += 1
+            return Literal(self._parse_literal_value(token))
+        if kind == T_LBRACE:
             return self._parse_object_literal()
-        if token.type == "LPAREN":
+        if kind == T_LPAREN:
             self._advance()
             expr = self._parse_expression()
-            self._expect("RPAREN")
+            self._expect(T_RPAREN)
             return expr
-        raise JQSyntaxError(f"Unexpected token {token.type} at position {token.position}")
+        raise JQSyntaxError(f"Unexpected token {_TOKEN_NAMES[kind]} at position {position}")
 
     def _parse_if(self) -> JQNode:
         self._expect_keyword("if")
@@ -530,50 +654,50 @@ class JQParser:
 
     def _parse_reduce(self) -> JQNode:
         self._expect_keyword("reduce")
-        source = self._parse_expression(stop_idents={"as"})
+        source = self._parse_expression(stop_idents=_STOP_AS)
         self._expect_keyword("as")
-        var_tok = self._expect("VAR")
-        self._expect("LPAREN")
-        init_expr = self._parse_expression(stop_same_depth_types={"SEMICOLON"})
-        self._expect("SEMICOLON")
-        update_expr = self._parse_expression(stop_same_depth_types={"RPAREN"})
-        self._expect("RPAREN")
-        return Reduce(source, var_tok.value[1:], init_expr, update_expr)
+        var_tok = self._expect(T_VAR)
+        self._expect(T_LPAREN)
+        init_expr = self._parse_expression(stop_same_depth_types=_STOP_SEMICOLON)
+        self._expect(T_SEMICOLON)
+        update_expr = self._parse_expression(stop_same_depth_types=_STOP_RPAREN)
+        self._expect(T_RPAREN)
+        return Reduce(source, var_tok[1][1:], init_expr, update_expr)
 
     def _parse_foreach(self) -> JQNode:
         self._expect_keyword("foreach")
-        source = self._parse_expression(stop_idents={"as"})
+        source = self._parse_expression(stop_idents=_STOP_AS)
         self._expect_keyword("as")
-        var_tok = self._expect("VAR")
-        self._expect("LPAREN")
-        init_expr = self._parse_expression(stop_same_depth_types={"SEMICOLON"})
-        self._expect("SEMICOLON")
-        update_expr = self._parse_expression(stop_same_depth_types={"SEMICOLON", "RPAREN"})
+        var_tok = self._expect(T_VAR)
+        self._expect(T_LPAREN)
+        init_expr = self._parse_expression(stop_same_depth_types=_STOP_SEMICOLON)
+        self._expect(T_SEMICOLON)
+        update_expr = self._parse_expression(stop_same_depth_types=_STOP_SEMICOLON_RPAREN)
         extract_expr = None
-        if self._current().type == "SEMICOLON":
+        if self._current()[0] == T_SEMICOLON:
             self._advance()
-            extract_expr = self._parse_expression(stop_same_depth_types={"RPAREN"})
-        self._expect("RPAREN")
-        return Foreach(source, var_tok.value[1:], init_expr, update_expr, extract_expr)
+            extract_expr = self._parse_expression(stop_same_depth_types=_STOP_RPAREN)
+        self._expect(T_RPAREN)
+        return Foreach(source, var_tok[1][1:], init_expr, update_expr, extract_expr)
 
     def _parse_if_chain(self, expect_end: bool) -> JQNode:
-        condition = self._parse_expression(stop_idents={"then"})
+        condition = self._parse_expression(stop_idents=_STOP_THEN)
         self._expect_keyword("then")
-        then_branch = self._parse_expression(stop_idents={"elif", "else", "end"})
+        then_branch = self._parse_expression(stop_idents=_STOP_BRANCH)
         else_branch: Optional[JQNode] = None
         if self._current_is_keyword("elif"):
             self._advance()
             else_branch = self._parse_if_chain(expect_end=False)
         elif self._current_is_keyword("else"):
             self._advance()
-            else_branch = self._parse_expression(stop_idents={"end"})
+            else_branch = self._parse_expression(stop_idents=_STOP_END)
         if expect_end:
             self._expect_keyword("end")
         return IfElse(condition, then_branch, else_branch)
 
     def _parse_try(self) -> JQNode:
         self._expect_keyword("try")
-        expr = self._parse_expression(stop_idents={"catch"})
+        expr = self._parse_expression(stop_idents=_STOP_CATCH)
         catch_expr = None
         if self._current_is_keyword("catch"):
             self._advance()
@@ -582,24 +706,24 @@ class JQParser:
 
     def _parse_label(self) -> JQNode:
         self._expect_keyword("label")
-        var_tok = self._expect("VAR")
-        self._expect("PIPE")
+        var_tok = self._expect(T_VAR)
+        self._expect(T_PIPE)
         body = self._parse_pipe()
-        return Label(var_tok.value[1:], body)
+        return Label(var_tok[1][1:], body)
 
     def _parse_break(self) -> JQNode:
         self._expect_keyword("break")
-        var_tok = self._expect("VAR")
-        return Break(var_tok.value[1:], None)
+        var_tok = self._expect(T_VAR)
+        return Break(var_tok[1][1:], None)
 
 
     def _parse_arguments(self) -> List[JQNode]:
         args: List[JQNode] = []
-        if self._current().type == "RPAREN":
+        if self._current()[0] == T_RPAREN:
             return args
         while True:
-            args.append(self._parse_expression(stop_types={"COMMA", "SEMICOLON", "RPAREN"}))
-            if self._match("COMMA") or self._match("SEMICOLON"):
+            args.append(self._parse_expression(stop_types=_STOP_ARGUMENT))
+            if self._match(T_COMMA) or self._match(T_SEMICOLON):
                 continue
             break
         return args
@@ -607,196 +731,148 @@ class JQParser:
     def _inline_node(self, node: JQNode) -> JQNode:
         if not self.definitions:
             return node
-        if isinstance(node, Pipe):
-            return Pipe(self._inline_node(node.left), self._inline_node(node.right))
-        if isinstance(node, Sequence):
-            return Sequence([self._inline_node(expr) for expr in node.expressions])
-        if isinstance(node, IfElse):
-            else_branch = self._inline_node(node.else_branch) if node.else_branch else None
-            return IfElse(
-                self._inline_node(node.condition),
-                self._inline_node(node.then_branch),
-                else_branch,
-            )
-        if isinstance(node, TryCatch):
-            return TryCatch(
-                self._inline_node(node.try_expr),
-                self._inline_node(node.catch_expr) if node.catch_expr else None,
-            )
-        if isinstance(node, FunctionCall):
-            inlined_args = [self._inline_node(arg) for arg in node.args]
-            if node.name in self.definitions:
-                definition = self.definitions[node.name]
-                if len(definition.params) != len(inlined_args):
-                    raise JQSyntaxError(
-                        f"Function {node.name} expects {len(definition.params)} args, got {len(inlined_args)}"
-                    )
-                if node.name in self._inlining_stack:
-                    raise NotImplementedError("Recursive function definitions are not supported")
-                mapping = {param: arg for param, arg in zip(definition.params, inlined_args)}
-                self._inlining_stack.append(node.name)
-                try:
-                    substituted = self._substitute(copy.deepcopy(definition.body), mapping)
-                    return self._inline_node(substituted)
-                finally:
-                    self._inlining_stack.pop()
-            return FunctionCall(node.name, inlined_args)
-        if isinstance(node, ObjectLiteral):
-            return ObjectLiteral([(key, self._inline_node(value)) for key, value in node.pairs])
-        if isinstance(node, Field):
-            return Field(node.name, self._inline_node(node.source))
-        if isinstance(node, UnaryOp):
-            return UnaryOp(node.op, self._inline_node(node.operand))
-        if isinstance(node, BinaryOp):
-            return BinaryOp(
-                node.op,
-                self._inline_node(node.left),
-                self._inline_node(node.right),
-            )
-        if isinstance(node, UpdateAssignment):
-            return UpdateAssignment(
-                self._inline_node(node.target),
-                node.op,
-                self._inline_node(node.expr),
-            )
-        if isinstance(node, Index):
-            return Index(self._inline_node(node.source), self._inline_node(node.index))
-        if isinstance(node, Slice):
-            start = self._inline_node(node.start) if node.start else None
-            end = self._inline_node(node.end) if node.end else None
-            return Slice(self._inline_node(node.source), start, end)
-        if isinstance(node, IndexAll):
-            return IndexAll(self._inline_node(node.source))
-        if isinstance(node, AsBinding):
-            return AsBinding(self._inline_node(node.source), node.name)
-        if isinstance(node, Reduce):
-            return Reduce(
-                self._inline_node(node.source),
-                node.var_name,
-                self._inline_node(node.init),
-                self._inline_node(node.update),
-            )
-        if isinstance(node, Foreach):
-            extract = self._inline_node(node.extract) if node.extract else None
-            return Foreach(
-                self._inline_node(node.source),
-                node.var_name,
-                self._inline_node(node.init),
-                self._inline_node(node.update),
-                extract,
-            )
-        return node
-
-    def _substitute(self, node: JQNode, mapping: Dict[str, JQNode]) -> JQNode:
-        if isinstance(node, VarRef) and node.name in mapping:
-            return copy.deepcopy(mapping[node.name])
-        if isinstance(node, Pipe):
-            return Pipe(self._substitute(node.left, mapping), self._substitute(node.right, mapping))
-        if isinstance(node, Sequence):
-            return Sequence([self._substitute(expr, mapping) for expr in node.expressions])
-        if isinstance(node, IfElse):
-            else_branch = (
-                self._substitute(node.else_branch, mapping) if node.else_branch else None
-            )
-            return IfElse(
-                self._substitute(node.condition, mapping),
-                self._substitute(node.then_branch, mapping),
-                else_branch,
-            )
-        if isinstance(node, TryCatch):
-            return TryCatch(
-                self._substitute(node.try_expr, mapping),
-                self._substitute(node.catch_expr, mapping) if node.catch_expr else None,
-            )
-        if isinstance(node, FunctionCall):
-            return FunctionCall(node.name, [self._substitute(arg, mapping) for arg in node.args])
-        if isinstance(node, ObjectLiteral):
-            return ObjectLiteral([(key, self._substitute(value, mapping)) for key, value in node.pairs])
-        if isinstance(node, Field):
-            return Field(node.name, self._substitute(node.source, mapping))
-        if isinstance(node, UnaryOp):
-            return UnaryOp(node.op, self._substitute(node.operand, mapping))
-        if isinstance(node, BinaryOp):
-            return BinaryOp(
-                node.op,
-                self._substitute(node.left, mapping),
-                self._substitute(node.right, mapping),
-            )
-        if isinstance(node, UpdateAssignment):
-            return UpdateAssignment(
-                self._substitute(node.target, mapping),
-                node.op,
-                self._substitute(node.expr, mapping),
-            )
-        if isinstance(node, Index):
-            return Index(self._substitute(node.source, mapping), self._substitute(node.index, mapping))
-        if isinstance(node, Slice):
-            start = self._substitute(node.start, mapping) if node.start else None
-            end = self._substitute(node.end, mapping) if node.end else None
-            return Slice(self._substitute(node.source, mapping), start, end)
-        if isinstance(node, IndexAll):
-            return IndexAll(self._substitute(node.source, mapping))
-        if isinstance(node, AsBinding):
-            return AsBinding(self._substitute(node.source, mapping), node.name)
-        if isinstance(node, Reduce):
-            return Reduce(
-                self._substitute(node.source, mapping),
-                node.var_name,
-                self._substitute(node.init, mapping),
-                self._substitute(node.update, mapping),
-            )
-        if isinstance(node, Foreach):
-            extract = self._substitute(node.extract, mapping) if node.extract else None
-            return Foreach(
-                self._substitute(node.source, mapping),
-                node.var_name,
-                self._substitute(node.init, mapping),
-                self._substitute(node.update, mapping),
-                extract,
-            )
-        return node
+        return self._expand(node)
+
+    def _expand(self, root: JQNode) -> JQNode:
+        """Inline user function calls under ``root`` without recursing in Python.
+
+        A call's arguments are expanded first, then the function body is walked
+        once with its parameters mapped to them, so substitution and inlining
+        share one pass instead of copy + substitute + re-inline.
+
+        A body without parameters expands the same way at every call site, so
+        it is walked once per parse and then shared.
+        """
+        definitions = self.definitions
+        inlining: List[str] = []
+        # id(body) -> expanded body, for definitions without parameters.
+        memo: Dict[int, JQNode] = {}
+        results: List[Optional[JQNode]] = []
+        # (_VISIT, node, param mapping) pushes the node's children; _REBUILD and
+        # _CALL (node, child count) then combine them from the top of `results`.
+        work: List[Tuple[int, Any, Any]] = [(_VISIT, root, None)]
+        while work:
+            action, node, extra = work.pop()
+            if action == _VISIT:
+                if node is None:
+                    results.append(None)
+                    continue
+                node_type = type(node)
+                if node_type is VarRef:
+                    # AST nodes are frozen, so every use shares the expanded argument.
+                    if extra is not None and node.name in extra:
+                        node = extra[node.name]
+                    results.append(node)
+                    continue
+                if node_type is FunctionCall:
+                    children = node.args
+                    action = _CALL
+                else:
+                    entry = _NODE_CHILDREN.get(node_type)
+                    if entry is None:
+                        results.append(node)
+                        continue
+                    children = entry[0](node)
+                    action = _REBUILD
+                work.append((action, node, len(children)))
+                for child in reversed(children):
+                    work.append((_VISIT, child, extra))
+                continue
+            if action == _RETURN:
+                inlining.pop()
+                if node is not None:
+                    memo[id(node)] = results[-1]
+                continue
+            children = results[len(results) - extra :]
+            del results[len(results) - extra :]
+            if action == _REBUILD:
+                entry = _NODE_CHILDREN[type(node)]
+                # Subtrees without inlined calls or mapped params come back as-is.
+                if not all(map(operator.is_, children, entry[0](node))):
+                    node = entry[1](node, children)
+                results.append(node)
+                continue
+            definition = definitions.get(node.name)
+            if definition is None:
+                if not all(map(operator.is_, children, node.args)):
+                    node = FunctionCall(node.name, children)
+                results.append(node)
+                continue
+            if len(definition.params) != len(children):
+                raise JQSyntaxError(
+                    f"Function {node.name} expects {len(definition.params)} args, got {len(children)}"
+                )
+            if node.name in inlining:
+                raise NotImplementedError("Recursive function definitions are not supported")
+            body = definition.body
+            if not children:
+                expanded = memo.get(id(body))
+                if expanded is not None:
+                    results.append(expanded)
+                    continue
+            inlining.append(node.name)
+            if children:
+                work.append((_RETURN, None, None))
+                work.append((_VISIT, body, dict(zip(definition.params, children))))
+            else:
+                work.append((_RETURN, body, None))
+                work.append((_VISIT, body, None))
+        return results[0]
 
     def _parse_literal_value(self, token: Token):
-        if token.type == "NUMBER" or token.type == "STRING":
+        text = token[1]
+        # NUMBER tokens are JSON number syntax, which int()/float() read the same
+        # way as json.loads; non-ASCII digits (matched by \d) keep the old path.
+        if token[0] == T_NUMBER and text.isascii():
+            if "." in text or "e" in text or "E" in text:
+                return float(text)
+            return int(text)
+        if token[0] == T_NUMBER or token[0] == T_STRING:
             # Accept both JSON-style (double-quoted) and single-quoted strings.
             # Fallback to ast.literal_eval for Python literal semantics.
             try:
-                return json.loads(token.value)
+                return json.loads(token[1])
             except json.JSONDecodeError:
                 try:
-                    return ast.literal_eval(token.value)
+                    return ast.literal_eval(token[1])
                 except Exception as exc:
-                    raise JQSyntaxError(f"Invalid literal {token.value!r}") from exc
-        lowered = token.value.lower()
+                    raise JQSyntaxError(f"Invalid literal {token[1]!r}") from exc
+        lowered = token[1].lower()
         if lowered in _KEYWORDS:
             return _KEYWORDS[lowered]
-        raise JQSyntaxError(f"Unsupported literal token {token.value!r}")
+        raise JQSyntaxError(f"Unsupported literal token {token[1]!r}")
 
     def _parse_object_literal(self) -> JQNode:
         pairs = []
         self._advance()  # consume '{'
-        if self._current().type != "RBRACE":
+        if self._current()[0] != T_RBRACE:
             while True:
                 key_token = self._current()
-                if key_token.type == "STRING":
-                    key = json.loads(key_token.value)
+                if key_token[0] == T_STRING:
+                    key = json.loads(key_token[1])
                     self._advance()
-                elif key_token.type == "IDENT":
-                    key = key_token.value
+                elif key_token[0] == T_IDENT:
+                    key = key_token[1]
                     self._advance()
                 else:
-                    raise JQSyntaxError(f"Invalid object key at position {key_token.position}")
-                self._expect("COLON")
-                value_expr = self._parse_expression(stop_types={"COMMA", "RBRACE"})
+                    raise JQSyntaxError(f"Invalid object key at position {key_token[2]}")
+                self._expect(T_COLON)
+                value_expr = self._parse_expression(stop_types=_STOP_OBJECT_VALUE)
                 pairs.append((key, value_expr))
-                if not self._match("COMMA"):
+                if not self._match(T_COMMA):
                     break
-        self._expect("RBRACE")
+        self._expect(T_RBRACE)
         return ObjectLiteral(pairs)
 
 
+@lru_cache(maxsize=256)
 def parse_jq_program(source: str) -> JQNode:
-    """Parse a jq expression into an AST."""
+    """Parse a jq expression into an AST.
+
+    Results are cached per source text, so the returned tree is shared between
+    callers and must not be mutated; ``parse_jq_program.cache_clear()`` empties
+    the cache.
+    """
     return JQParser.parse(source)
 
 
@@ -1,27 +1,33 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Iterable, Iterator, List, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
 
 import json
 import subprocess
+import sys
 from functools import lru_cache
 
 from haifa_jq.jq_vm import JQVM as _VM
-from haifa_jq.jq_compiler import INPUT_REGISTER, compile_to_bytecode
-from haifa_jq.jq_parser import parse_jq_program, JQSyntaxError
+from haifa_jq.jq_compiler import INPUT_REGISTER, JQCompiler, compile_cached
+from haifa_jq.jq_parser import JQSyntaxError, parse_jq_program
 
 class JQRuntimeError(RuntimeError):
     """Raised when jq compilation or execution fails."""
 
 
+@lru_cache(maxsize=1024)
 def _var_reg(name: str) -> str:
-    return f"__jq_var_{name}"
+    # Interned like the compiler's register names, so VM lookups compare by identity.
+    return sys.intern(f"__jq_var_{name}")
 
 
-@lru_cache(maxsize=128)
-def _compile_expression(expression: str) -> List[Any]:
-    ast = parse_jq_program(expression)
-    return compile_to_bytecode(ast)
+@lru_cache(maxsize=256)
+def _python_program(expression: str) -> Optional[Callable[..., Iterator[Any]]]:
+    # Generated Python for the jq subset jq_codegen supports; None means use the VM.
+    try:
+        return JQCompiler().compile_to_python(parse_jq_program(expression))
+    except NotImplementedError:
+        return None
 
 
 def run_filter_stream(
@@ -30,26 +36,41 @@ def run_filter_stream(
     env: Optional[Dict[str, Any]] = None,
 ) -> Iterator[Any]:
     try:
-        instructions = _compile_expression(expression)
+        instructions = compile_cached(expression)
     except (JQSyntaxError, ValueError, NotImplementedError) as exc:
         yield from _system_jq_stream(expression, inputs, env, exc)
         return
     except Exception as exc:  # pragma: no cover - defensive
         raise JQRuntimeError(f"Failed to compile jq expression: {exc}") from exc
 
+    program = _python_program(expression)
+    if program is not None:
+        for index, item in enumerate(inputs):
+            try:
+                # Collected first so a failing input yields nothing, as with the VM.
+                results = list(program(item, env))
+            except Exception as exc:
+                raise JQRuntimeError(f"jq execution failed on input #{index}: {exc}") from exc
+            yield from results
+        return
+
+    env_bindings = tuple((_var_reg(k), v) for k, v in env.items()) if env else ()
     inputs_iter = iter(inputs)
+    # One VM for the whole stream, reset between inputs.
+    vm = _VM(instructions)
+    vm.input_iterator = inputs_iter
     index = 0
     while True:
         try:
             item = next(inputs_iter)
         except StopIteration:
             break
-        vm = _VM(instructions)
-        vm.registers[INPUT_REGISTER] = item
-        vm.input_iterator = inputs_iter
-        if env:
-            for k, v in env.items():
-                vm.registers[_var_reg(k)] = v
+        if index:
+            vm.reset()
+        registers = vm.registers
+        registers[INPUT_REGISTER] = item
+        for reg, value in env_bindings:
+            registers[reg] = value
         try:
             results = vm.run()
         except Exception as exc:  # pragma: no cover - defensive
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
 import json
+import math
+import operator
 import re
 from typing import Iterable, List
 
+from compiler.bytecode import Opcode
 from compiler.bytecode_vm import BytecodeVM
+from compiler.vm_errors import VMRuntimeError
 from haifa_jq.jq_bytecode import JQOpcode
 
 
@@ -120,6 +124,139 @@ def _delete_path(value, path):
         return new_arr
 
 
+# End marker for FOR_IN_NEXT; element values may be null.
+_EXHAUSTED = object()
+
+
+def _index_items(value):
+    """Elements visited by a LEN_VALUE/GET_INDEX loop over ``value``."""
+    if isinstance(value, (list, tuple)):
+        return value
+    try:
+        return [None] * len(value)
+    except (TypeError, ValueError):
+        return []
+
+
+def _slice_bound(value, rounding):
+    if value is None or isinstance(value, int):
+        return value
+    return rounding(value)
+
+
+def _field_of(value, key):
+    if isinstance(value, dict) and key in value:
+        return value[key]
+    return None
+
+
+def _lookup_path(value, path):
+    """Follow literal field names / integer indexes the way OBJ_GET/GET_INDEX do."""
+    for component in path:
+        if isinstance(component, str):
+            value = _field_of(value, component)
+        elif isinstance(value, (list, tuple)) and -len(value) <= component < len(value):
+            value = value[component]
+        else:
+            value = None
+    return value
+
+
+def _truthy(value):
+    # Same outcome as select's flattened truth scan over a single output.
+    if isinstance(value, list):
+        return any(bool(item) for item in value)
+    return bool(value)
+
+
+_SELECT_TESTS = {
+    None: lambda value, operand: _truthy(value),
+    "==": lambda value, operand: value == operand,
+    "!=": lambda value, operand: not (value == operand),
+    ">": lambda value, operand: value > operand,
+    "<": lambda value, operand: value < operand,
+    ">=": lambda value, operand: not (value < operand),
+    "<=": lambda value, operand: not (value > operand),
+}
+
+
+def _reduce_sum(items, has_initial, initial):
+    acc = initial if has_initial else 0
+    for item in items:
+        if item is not None:
+            acc += item
+    return acc
+
+
+def _reduce_product(items, has_initial, initial):
+    acc = initial if has_initial else 1
+    for item in items:
+        if item is not None:
+            acc *= item
+    return acc
+
+
+def _reduce_extreme(better):
+    def reduce(items, has_initial, initial):
+        if has_initial:
+            acc = initial
+        elif items:
+            acc = items[0]
+            items = items[1:]
+        else:
+            acc = None
+        for item in items:
+            if acc is None or (item is not None and better(item, acc)):
+                acc = item
+        return acc
+
+    return reduce
+
+
+def _reduce_concat(items, has_initial, initial):
+    acc = initial if has_initial else []
+    if acc is None:
+        acc = []
+    if not isinstance(acc, list):
+        acc = [acc]
+    for item in items:
+        if isinstance(item, list):
+            acc.extend(item)
+        elif item is not None:
+            acc.append(item)
+    return acc
+
+
+def _divide(left, right):
+    if isinstance(left, int) and isinstance(right, int):
+        return left // right
+    return left / right
+
+
+# Core arithmetic/comparison opcodes the jq compiler emits. jq values are plain
+# JSON, so these skip BytecodeVM's Lua metamethod lookups.
+_BINARY_OPS = {
+    Opcode.ADD: operator.add,
+    Opcode.SUB: operator.sub,
+    Opcode.MUL: operator.mul,
+    Opcode.DIV: _divide,
+    Opcode.MOD: operator.mod,
+    Opcode.EQ: operator.eq,
+    Opcode.LT: operator.lt,
+    Opcode.GT: operator.gt,
+}
+
+
+# REDUCE operation name -> reducer(items, has_initial, initial).
+_REDUCERS = {
+    "sum": _reduce_sum,
+    "product": _reduce_product,
+    "min": _reduce_extreme(operator.lt),
+    "max": _reduce_extreme(operator.gt),
+    "concat": _reduce_concat,
+}
+
+
 def _paths_matching(value, targets: Iterable[object]) -> List[List[object]]:
     target_list = list(targets)
     if not target_list:
@@ -147,17 +284,32 @@ class JQVM(BytecodeVM):
         super().__init__(instructions)
         self.input_iterator = iter(())
         self._jq_force_stop = False
+        # Return addresses of active CALL_TAIL routines, and the depth each try began at.
+        self.tail_returns: List[int] = []
+        self._try_tail_depths: List[int] = []
+        # (instructions, decoded handlers) from the last run.
+        self._program = None
         # Override/extend handlers for jq-only opcodes
         self._handlers.update(
             {
                 JQOpcode.OBJ_GET: self._op_OBJ_GET,
+                JQOpcode.OBJ_GET_PATH: self._op_OBJ_GET_PATH,
                 JQOpcode.OBJ_SET: self._op_OBJ_SET,
+                JQOpcode.OBJ_BUILD: self._op_OBJ_BUILD,
                 JQOpcode.SET_INDEX: self._op_SET_INDEX,
                 JQOpcode.GET_INDEX: self._op_GET_INDEX,
                 JQOpcode.LEN_VALUE: self._op_LEN_VALUE,
+                JQOpcode.ITER_FIELD: self._op_ITER_FIELD,
+                JQOpcode.ITER_SELECT: self._op_ITER_SELECT,
+                JQOpcode.FOR_IN_BEGIN: self._op_FOR_IN_BEGIN,
+                JQOpcode.FOR_IN_NEXT: self._op_FOR_IN_NEXT,
+                JQOpcode.LAST_OR_NULL: self._op_LAST_OR_NULL,
+                JQOpcode.SLICE: self._op_SLICE,
                 JQOpcode.PUSH_EMIT: self._op_PUSH_EMIT,
+                JQOpcode.EMIT_BEGIN: self._op_EMIT_BEGIN,
                 JQOpcode.POP_EMIT: self._op_POP_EMIT,
                 JQOpcode.EMIT: self._op_EMIT,
+                JQOpcode.EMIT_RANGE: self._op_EMIT_RANGE,
                 JQOpcode.TRY_BEGIN: self._op_TRY_BEGIN,
                 JQOpcode.TRY_END: self._op_TRY_END,
                 JQOpcode.FLATTEN: self._op_FLATTEN,
@@ -194,8 +346,116 @@ class JQVM(BytecodeVM):
                 JQOpcode.INPUTS: self._op_INPUTS,
                 JQOpcode.HALT_NOW: self._op_HALT_NOW,
                 JQOpcode.HALT_ERROR: self._op_HALT_ERROR,
+                JQOpcode.CALL_TAIL: self._op_CALL_TAIL,
+                JQOpcode.RET_TAIL: self._op_RET_TAIL,
             }
         )
+        self._handlers.update({opcode: self._binary_handler(fn) for opcode, fn in _BINARY_OPS.items()})
+
+    def reset(self):
+        """Clear per-run state so the same VM can run its program on another input."""
+        self.registers.clear()
+        self.stack.clear()
+        self.arrays.clear()
+        self.call_stack.clear()
+        self.param_stack.clear()
+        self.pending_params.clear()
+        self.emit_stack.clear()
+        self.try_stack.clear()
+        self.tail_returns.clear()
+        self._try_tail_depths.clear()
+        self.last_return.clear()
+        self.yield_values.clear()
+        self.return_value = None
+        self._last_traceback = None
+        self._non_yieldable_depth = 0
+        self._jq_force_stop = False
+        self.pc = 0
+        # run() hands this list to the caller, so start a new one.
+        self.output = []
+
+    def _decode(self):
+        handlers = self._handlers
+        decoded = [(handlers.get(inst.opcode), inst.args) for inst in self.instructions]
+        if any(handler is None for handler, _ in decoded):
+            return None
+        self.index_labels()
+        labels = self.labels
+        for pos, inst in enumerate(self.instructions):
+            if inst.opcode is Opcode.JMP and inst.args[0] in labels:
+                # Unconditional jumps become a direct pc assignment in the loop below.
+                decoded[pos] = (None, labels[inst.args[0]])
+        return decoded
+
+    def run(self, debug=False, stop_on_yield=False):
+        # Decoded once per instruction list, so a reset() VM skips it on later inputs.
+        program = self._program
+        if program is None or program[0] is not self.instructions:
+            program = self._program = (self.instructions, self._decode())
+        decoded = program[1]
+        if debug or stop_on_yield or decoded is None:
+            return super().run(debug=debug, stop_on_yield=stop_on_yield)
+        # Same semantics as BytecodeVM.run/step, with each instruction's handler
+        # resolved once up front instead of per execution.
+        self.last_event = None
+        end = len(decoded)
+        pc = self.pc
+        while pc < end:
+            handler, args = decoded[pc]
+            if handler is None:
+                pc = args
+                continue
+            self.pc = pc
+            try:
+                control = handler(args)
+            except VMRuntimeError as exc:
+                if not self._handle_exception(exc):
+                    raise
+                pc = self.pc
+                continue
+            except Exception as exc:
+                if not self._handle_exception(exc):
+                    raise self._wrap_runtime_error(exc) from exc
+                pc = self.pc
+                continue
+            if control is None:
+                pc += 1
+            elif control == "jump":
+                pc = self.pc
+            elif control == "halt":
+                break
+            elif control == "yield":
+                self.pc = pc + 1
+                raise self._wrap_runtime_error(RuntimeError("coroutine.yield called outside coroutine"))
+            else:
+                pc += 1
+        else:
+            self.pc = pc
+        self.last_event = "halt"
+        return self.output
+
+    def _binary_handler(self, fn):
+        def handler(args):
+            registers = self.registers
+            try:
+                left = registers[args[1]]
+                right = registers[args[2]]
+            except KeyError:
+                # An immediate operand (or an unset register): resolve it the slow way.
+                left = self.val(args[1])
+                right = self.val(args[2])
+            registers[args[0]] = fn(left, right)
+
+        return handler
+
+    def val(self, x):
+        # jq operands are almost always register names; look them up before
+        # the core literal parsing (json.loads) that resolve_value tries first.
+        if type(x) is str:
+            registers = self.registers
+            if x in registers:
+                return registers[x]
+        return super().val(x)
 
     # ---------- jq helpers ----------
     def _sort_key(self, x):
@@ -222,12 +482,25 @@ class JQVM(BytecodeVM):
 
     # ---------- jq opcode handlers ----------
     def _op_OBJ_GET(self, args):
-        source = self.val(args[1])
+        registers = self.registers
+        try:
+            source = registers[args[1]]
+        except KeyError:
+            source = self.val(args[1])
         key = args[2]
         if isinstance(source, dict) and key in source:
-            self.registers[args[0]] = source[key]
+            registers[args[0]] = source[key]
         else:
-            self.registers[args[0]] = None
+            registers[args[0]] = None
+
+    def _op_OBJ_GET_PATH(self, args):
+        # [dest, src, (key, ...)]: a whole .a.b.c chain in one dispatch.
+        registers = self.registers
+        try:
+            source = registers[args[1]]
+        except KeyError:
+            source = self.val(args[1])
+        registers[args[0]] = _lookup_path(source, args[2])
 
     def _op_OBJ_SET(self, args):
         obj = self.registers.get(args[0])
@@ -236,18 +509,20 @@ class JQVM(BytecodeVM):
             self.registers[args[0]] = obj
         obj[args[1]] = self.val(args[2])
 
+    def _op_OBJ_BUILD(self, args):
+        # [dest, (key, ...), value_reg, ...]: a whole object literal in one step.
+        val = self.val
+        self.registers[args[0]] = dict(zip(args[1], [val(reg) for reg in args[2:]]))
+
     def _op_SET_INDEX(self, args):
         container = self.registers.get(args[0])
         index_value = self.val(args[1])
         value = self.val(args[2])
         if isinstance(container, list):
-            try:
-                idx = int(index_value)
-            except Exception:
-                return
             length = len(container)
-            if idx < 0:
-                idx += length
+            idx = _coerce_index(index_value, length)
+            if idx is None:
+                return
             if 0 <= idx < length:
                 container[idx] = value
             elif idx == length:
@@ -268,33 +543,105 @@ class JQVM(BytecodeVM):
         except (TypeError, ValueError):
             self.registers[args[0]] = 0
 
+    def _op_FOR_IN_BEGIN(self, args):
+        # [iter, src]: start a loop over the elements a LEN_VALUE/GET_INDEX walk would visit.
+        self.registers[args[0]] = iter(_index_items(self.val(args[1])))
+
+    def _op_FOR_IN_NEXT(self, args):
+        # [elem, iter, end_label]: bind the next element, or leave the loop when exhausted.
+        value = next(self.registers[args[1]], _EXHAUSTED)
+        if value is _EXHAUSTED:
+            self.pc = self.labels[args[2]]
+            return "jump"
+        self.registers[args[0]] = value
+
+    def _op_LAST_OR_NULL(self, args):
+        # Value of a single-output sub-expression: the last captured output, or null.
+        values = self.val(args[1])
+        self.registers[args[0]] = values[-1] if values else None
+
+    def _op_SLICE(self, args):
+        # [dest, src, start, end]; None bounds are open, fractional ones widen (floor/ceil).
+        source = self.val(args[1])
+        items = source if isinstance(source, str) else _index_items(source)
+        start = _slice_bound(self.val(args[2]), math.floor)
+        end = _slice_bound(self.val(args[3]), math.ceil)
+        result = items[start:end]
+        self.registers[args[0]] = list(result) if isinstance(result, tuple) else result
+
     def _op_PUSH_EMIT(self, args):
         self.emit_stack.append(args[0])
 
+    def _op_EMIT_BEGIN(self, args):
+        # Capture the following EMITs into a fresh list.
+        self.registers[args[0]] = []
+        self.emit_stack.append(args[0])
+
     def _op_POP_EMIT(self, args):
         if self.emit_stack:
             self.emit_stack.pop()
 
     def _op_EMIT(self, args):
-        value = self.val(args[0])
+        self._emit_values((self.val(args[0]),))
+
+    def _op_EMIT_RANGE(self, args):
+        # [src, start, end]: emit a contiguous run of the source's elements at once.
+        items = _index_items(self.val(args[0]))
+        self._emit_values(items[self.val(args[1]):self.val(args[2])])
+
+    def _emit_values(self, values):
         if self.emit_stack:
             target = self.emit_stack[-1]
             container = self.registers.get(target)
             if not isinstance(container, list):
                 container = [] if container is None else list(container if isinstance(container, list) else [container])
-            container.append(value)
+            container.extend(values)
             self.registers[target] = container
         else:
-            self.output.append(value)
+            self.output.extend(values)
+
+    def _op_ITER_FIELD(self, args):
+        # Fused `.[] | .key` as the last stage of a pipeline.
+        key = args[1]
+        self._emit_values([_field_of(item, key) for item in _index_items(self.val(args[0]))])
+
+    def _op_ITER_SELECT(self, args):
+        # Fused `.[] | select(.key <op> literal)` (op None: select(.key)).
+        key, test, operand = args[1], _SELECT_TESTS[args[2]], args[3]
+        self._emit_values(
+            [item for item in _index_items(self.val(args[0])) if test(_field_of(item, key), operand)]
+        )
 
     def _op_TRY_BEGIN(self, args):
-        catch_label, error_reg, buffer_reg = args
-        emit_depth = max(len(self.emit_stack) - 1, 0)
+        catch_label, error_reg = args[0], args[1]
+        # Legacy form carries a capture buffer pushed right before TRY_BEGIN.
+        buffer_reg = args[2] if len(args) > 2 else None
+        emit_depth = len(self.emit_stack)
+        if buffer_reg is not None:
+            emit_depth = max(emit_depth - 1, 0)
         self.try_stack.append((catch_label, error_reg, emit_depth, buffer_reg))
+        self._try_tail_depths.append(len(self.tail_returns))
 
     def _op_TRY_END(self, args):
         if self.try_stack:
             self.try_stack.pop()
+            self._try_tail_depths.pop()
+
+    def _handle_exception(self, exc):
+        # A caught error abandons the tail routines entered since its try began.
+        if self.try_stack:
+            del self.tail_returns[self._try_tail_depths.pop():]
+        return super()._handle_exception(exc)
+
+    def _op_CALL_TAIL(self, args):
+        # [entry_label]: run a shared pipeline continuation, then resume after this call.
+        self.tail_returns.append(self.pc + 1)
+        self.pc = self.labels[args[0]]
+        return "jump"
+
+    def _op_RET_TAIL(self, args):
+        self.pc = self.tail_returns.pop()
+        return "jump"
 
 
     def _op_FLATTEN(self, args):
@@ -385,55 +732,10 @@ class JQVM(BytecodeVM):
         has_initial = len(args) > 3 and args[3] not in (None, "")
         initial_value = self.val(args[3]) if has_initial else None
 
-        if op_name == "sum":
-            acc = initial_value if has_initial else 0
-            for item in items:
-                if item is not None:
-                    acc += item
-        elif op_name == "product":
-            acc = initial_value if has_initial else 1
-            for item in items:
-                if item is not None:
-                    acc *= item
-        elif op_name == "min":
-            if has_initial:
-                acc = initial_value
-            elif items:
-                acc = items[0]
-                items = items[1:]
-            else:
-                acc = None
-            for item in items:
-                if acc is None or (item is not None and item < acc):
-                    acc = item
-        elif op_name == "max":
-            if has_initial:
-                acc = initial_value
-            elif items:
-                acc = items[0]
-                items = items[1:]
-            else:
-                acc = None
-            for item in items:
-                if acc is None or (item is not None and item > acc):
-                    acc = item
-        elif op_name == "concat":
-            if has_initial:
-                acc = initial_value
-            else:
-                acc = []
-            if acc is None:
-                acc = []
-            if not isinstance(acc, list):
-                acc = [acc]
-            for item in items:
-                if isinstance(item, list):
-                    acc.extend(item)
-                elif item is not None:
-                    acc.append(item)
-        else:
+        reducer = _REDUCERS.get(op_name)
+        if reducer is None:
             raise RuntimeError(f"Unsupported reduce operation: {op_name}")
-        self.registers[args[0]] = acc
+        self.registers[args[0]] = reducer(items, has_initial, initial_value)
 
     def _op_KEYS(self, args):
         src = self.val(args[1])
@@ -551,6 +853,15 @@ class JQVM(BytecodeVM):
                 out = res
         self.registers[args[0]] = out
 
+    def _by_keys(self, src, args):
+        # *_BY operands: (dest, array, keys_reg) or (dest, array, None, key_path)
+        if len(args) > 3 and args[3] is not None:
+            if not isinstance(src, list):
+                return None
+            path = args[3]
+            return [_lookup_path(item, path) for item in src]
+        return self.registers.get(args[2])
+
     def _op_SORT(self, args):
         src = self.val(args[1])
         if isinstance(src, list):
@@ -561,7 +872,7 @@ class JQVM(BytecodeVM):
 
     def _op_SORT_BY(self, args):
         src = self.val(args[1])
-        keys = self.registers.get(args[2])
+        keys = self._by_keys(src, args)
         if isinstance(src, list) and isinstance(keys, list):
             pairs = list(zip(keys, src))
             pairs.sort(key=lambda kv: self._sort_key(kv[0]))
@@ -585,7 +896,7 @@ class JQVM(BytecodeVM):
 
     def _op_UNIQUE_BY(self, args):
         src = self.val(args[1])
-        keys = self.registers.get(args[2])
+        keys = self._by_keys(src, args)
         if isinstance(src, list) and isinstance(keys, list):
             seen = []
             out = []
@@ -614,7 +925,7 @@ class JQVM(BytecodeVM):
 
     def _op_MIN_BY(self, args):
         src = self.val(args[1])
-        keys = self.registers.get(args[2])
+        keys = self._by_keys(src, args)
         out = None
         if isinstance(src, list) and isinstance(keys, list) and src:
             idx = min(range(len(src)), key=lambda i: self._sort_key(keys[i]))
@@ -623,7 +934,7 @@ class JQVM(BytecodeVM):
 
     def _op_MAX_BY(self, args):
         src = self.val(args[1])
-        keys = self.registers.get(args[2])
+        keys = self._by_keys(src, args)
         out = None
         if isinstance(src, list) and isinstance(keys, list) and src:
             idx = max(range(len(src)), key=lambda i: self._sort_key(keys[i]))
@@ -632,7 +943,7 @@ class JQVM(BytecodeVM):
 
     def _op_GROUP_BY(self, args):
         src = self.val(args[1])
-        keys = self.registers.get(args[2])
+        keys = self._by_keys(src, args)
         out = []
         if isinstance(src, list) and isinstance(keys, list):
             pairs = list(zip(keys, src))
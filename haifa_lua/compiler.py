@@ -144,10 +144,12 @@ class LuaCompiler:
         return InstructionDebug(location, self.function_name)
 
     def _emit(self, opcode: Opcode, args, *, node: object | None = None) -> Instruction:
-        if isinstance(args, (list, tuple)):
-            arg_list = list(args)
+        if isinstance(args, tuple):
+            arg_list = args
+        elif isinstance(args, list):
+            arg_list = tuple(args)
         else:
-            arg_list = [args]
+            arg_list = (args,)
         debug = self._debug_for(node)
         if debug is not None:
             self._last_debug = debug